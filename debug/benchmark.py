@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""Benchmark.
+
+Measure the throughput of Nitro's event pipeline against a simulated virtual
+machine. Neither the Nitro KVM module nor a guest are required.
+
+Usage:
+  benchmark.py [options]
+
+Options:
+  -h --help             Show this screen.
+  --vcpus=N             Number of simulated VCPUs [default: 4]
+  --events=N            Number of events to process [default: 100000]
+  --rate=N              Events per second and per VCPU, 0 for unlimited [default: 0]
+  --processes=N         Number of simulated guest processes [default: 100]
+  --syscalls=LIST       Comma separated system call mix, as name[:weight] [default: read:4,write:4,open,close,newstat,mmap]
+  --hooks=LIST          Comma separated system calls to define empty hooks on [default: ]
+  --nobackend           Only measure the listener
+  --parallel            Process events of each VCPU in its own thread
+  --cache-policy=POLICY  When libvmi caches are invalidated [default: always]
+  --seed=N              Seed for the event generator [default: 0]
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+from docopt import docopt
+
+sys.path.insert(1, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+from nitro.listener import Listener
+from nitro.simulation import (SimulatedKVM, SimulatedDomain,
+                              SimulatedLinuxLibvmi, EventGenerator,
+                              LINUX_SYSCALL_HANDLERS)
+from nitro.backends.linux.backend import clean_name
+
+
+def parse_syscalls(spec):
+    numbers = {clean_name(handler): nb for nb, handler in
+               enumerate(LINUX_SYSCALL_HANDLERS)}
+    syscalls = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition(':')
+        syscalls[numbers[name]] = float(weight) if weight else 1
+    return syscalls
+
+
+class Benchmark:
+
+    def __init__(self, args):
+        self.nb_events = int(args['--events'])
+        self.parallel = args['--parallel']
+        nb_vcpu = int(args['--vcpus'])
+        rate = float(args['--rate']) or None
+        self.libvmi = SimulatedLinuxLibvmi(int(args['--processes']))
+        generator = EventGenerator(parse_syscalls(args['--syscalls']),
+                                   self.libvmi.cr3s, rate,
+                                   int(args['--seed']))
+        self.domain = SimulatedDomain('nitro_benchmark', nb_vcpu)
+        self.listener = Listener(self.domain, SimulatedKVM(generator, nb_vcpu),
+                                 pid=os.getpid())
+        self.backend = None
+        if not args['--nobackend']:
+            # imported here, the backends depend on libvmi being installed
+            from nitro.backends.linux import LinuxBackend
+            from nitro.backends.backend import CachePolicy
+            cache_policy = CachePolicy[args['--cache-policy']]
+            self.backend = LinuxBackend(self.domain, self.libvmi, self.listener,
+                                        cache_policy=cache_policy,
+                                        time_libvmi=True)
+            hooks = {name: lambda syscall, backend: None
+                     for name in filter(None, args['--hooks'].split(','))}
+            self.backend.define_hooks(hooks)
+        self.count = 0
+        self.count_lock = threading.Lock()
+
+    def process_event(self, event):
+        if self.backend is not None:
+            self.backend.process_event(event)
+        with self.count_lock:
+            self.count += 1
+            if self.count == self.nb_events:
+                self.listener.stop(synchronous=False)
+
+    def run(self):
+        self.listener.set_traps(True)
+        start = time.perf_counter()
+        if self.parallel:
+            self.listener.listen_parallel(self.process_event)
+        else:
+            for event in self.listener.listen():
+                self.process_event(event)
+        elapsed = time.perf_counter() - start
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        vcpus = self.listener.vcpus_io
+        nb_events = sum(vcpu.ioctls['continue_vm'] for vcpu in vcpus)
+        stall_time = sum(vcpu.stall_time for vcpu in vcpus)
+        result = {
+            'events': nb_events,
+            'elapsed': elapsed,
+            'events_per_sec': nb_events / elapsed,
+            'mean_stall_us': stall_time / nb_events * 1e6 if nb_events else 0,
+            'max_stall_us': max(vcpu.max_stall_time for vcpu in vcpus) * 1e6,
+            'vcpus': {vcpu.vcpu_nb: dict(vcpu.ioctls) for vcpu in vcpus},
+            'libvmi': dict(self.libvmi.calls),
+        }
+        if self.backend is not None:
+            stats = self.backend.stats
+            result['backend'] = dict(stats)
+            if stats['libvmi_reads']:
+                result['libvmi_read_mean_us'] = \
+                    stats['libvmi_read_time'] / stats['libvmi_reads'] * 1e6
+            result['latency'] = self.backend.latency_report()
+        else:
+            result['latency'] = self.listener.latency_report()
+        return result
+
+
+def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    benchmark = Benchmark(args)
+    print(json.dumps(benchmark.run(), indent=4))
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -8,7 +8,22 @@ Usage:
 Options:
   -h --help            Show this screen
   --nobackend          Don't analyze events
-  -o FILE --out=FILE   Output file (stdout if not specified)
+  --parallel           Process events of each VCPU in its own thread
+  --cache-policy=POLICY
+                       When libvmi caches are invalidated: always, cr3_change,
+                       memory_syscalls or generation [default: always]
+  --time-libvmi        Measure libvmi read latency
+  --process-fields=LIST
+                       Comma separated process fields to output, for example
+                       name,pid (all if not specified)
+  --metrics=ADDRESS    Serve live metrics in Prometheus' text format on
+                       [HOST:]PORT, HOST defaults to 127.0.0.1
+  -o FILE --out=FILE   Output file, one JSON event per line (stdout if not
+                       specified)
+  --compress=METHOD    Compress the output file with gzip or lzma
+  --rotate-size=BYTES  Start a new output file after BYTES of events
+  --rotate-time=SECONDS
+                       Start a new output file every SECONDS
 
 """
 
@@ -22,6 +37,10 @@ from libvmi import LibvmiError
 from docopt import docopt
 
 from nitro.nitro import Nitro
+from nitro.backends.backend import CachePolicy
+from nitro.backends.factory import BACKENDS
+from nitro.metrics import MetricsServer
+from nitro.writer import EventWriter
 
 
 
@@ -33,49 +52,101 @@ def init_logger():
 
 class NitroRunner:
 
-    def __init__(self, vm_name, analyze_enabled, output=None):
+    def __init__(self, vm_name, analyze_enabled, output=None, parallel=False,
+                 cache_policy=CachePolicy.always, time_libvmi=False,
+                 process_fields=None, metrics_address=None, compression=None,
+                 rotate_size=None, rotate_time=None):
         self.vm_name = vm_name
         self.analyze_enabled = analyze_enabled
         self.output = output
+        self.parallel = parallel
+        self.cache_policy = cache_policy
+        self.time_libvmi = time_libvmi
+        self.process_fields = process_fields
+        self.metrics_address = metrics_address
+        self.compression = compression
+        self.rotate_size = rotate_size
+        self.rotate_time = rotate_time
         # get domain from libvirt
         con = libvirt.open('qemu:///system')
         self.domain = con.lookupByName(vm_name)
-        self.events = []
+        self.writer = None
         self.nitro = None
         # define new SIGINT handler, to stop nitro
         signal.signal(signal.SIGINT, self.sigint_handler)
+        # latencies are logged on SIGUSR1
+        signal.signal(signal.SIGUSR1, self.sigusr1_handler)
 
     def run(self):
-        self.nitro = Nitro(self.domain, self.analyze_enabled)
+        self.nitro = Nitro(self.domain, self.analyze_enabled,
+                           cache_policy=self.cache_policy,
+                           time_libvmi=self.time_libvmi)
+        if self.analyze_enabled and self.process_fields is not None:
+            # some fields are only available on some operating systems
+            check_process_fields(self.process_fields,
+                                 self.nitro.backend.PROCESS_FIELDS)
+        if self.output is not None:
+            self.writer = EventWriter(self.output, self.compression,
+                                      self.rotate_size, self.rotate_time)
+        metrics_server = None
+        if self.metrics_address is not None:
+            metrics_server = MetricsServer(self.nitro.listener,
+                                           self.nitro.backend,
+                                           self.metrics_address)
+            metrics_server.start()
         self.nitro.listener.set_traps(True)
-        for event in self.nitro.listen():
-            event_info = event.as_dict()
-            if self.analyze_enabled:
-                try:
-                    syscall = self.nitro.backend.process_event(event)
-                except LibvmiError:
-                    logging.error("Backend event processing failure")
-                else:
-                    event_info = syscall.as_dict()
-            if self.output is None:
-                pprint(event_info, width=1)
+        try:
+            if self.parallel:
+                self.nitro.listen_parallel(self.process_event)
             else:
-                self.events.append(event_info)
-
-
+                for event in self.nitro.listen():
+                    self.process_event(event)
+        finally:
+            # keep the events recorded so far
+            if self.writer is not None:
+                self.writer.close()
+
+        if metrics_server is not None:
+            metrics_server.stop()
         if self.analyze_enabled:
             # we can safely stop the backend
             self.nitro.backend.stop()
 
-        if self.output is not None:
-            logging.info('Writing events')
-            with open(self.output, 'w') as f:
-                json.dump(self.events, f, indent=4)
+    def process_event(self, event):
+        event_info = event.as_dict()
+        if self.analyze_enabled:
+            try:
+                syscall = self.nitro.backend.process_event(event)
+                # the process is resolved lazily, here
+                event_info = syscall.as_dict(self.process_fields)
+            except LibvmiError:
+                logging.error("Backend event processing failure")
+        if self.writer is None:
+            pprint(event_info, width=1)
+        else:
+            self.writer.write(event_info)
 
     def sigint_handler(self, *args, **kwargs):
         logging.info('CTRL+C received, stopping Nitro')
         self.nitro.stop()
 
+    def sigusr1_handler(self, *args, **kwargs):
+        if self.nitro is None:
+            return
+        if self.analyze_enabled:
+            report = self.nitro.backend.latency_report()
+        else:
+            report = self.nitro.listener.latency_report()
+        logging.info(json.dumps(report, indent=4))
+
+
+def check_process_fields(fields, known_fields):
+    """Exit with an error if ``fields`` contains unknown process fields"""
+    unknown = [field for field in fields if field not in known_fields]
+    if unknown:
+        raise SystemExit('Unknown process fields: {} (available: {})'.format(
+            ', '.join(unknown), ', '.join(known_fields)))
+
 
 def main():
     init_logger()
@@ -83,7 +154,32 @@ def main():
     vm_name = args['<vm_name>']
     analyze_enabled = False if args['--nobackend'] else True
     output = args['--out']
-    runner = NitroRunner(vm_name, analyze_enabled, output)
+    parallel = args['--parallel']
+    cache_policy = CachePolicy[args['--cache-policy']]
+    time_libvmi = args['--time-libvmi']
+    process_fields = args['--process-fields']
+    if process_fields is not None:
+        process_fields = process_fields.split(',')
+        known_fields = []
+        for backend in BACKENDS.values():
+            known_fields.extend(field for field in backend.PROCESS_FIELDS
+                                if field not in known_fields)
+        check_process_fields(process_fields, known_fields)
+    compression = args['--compress']
+    rotate_size = args['--rotate-size']
+    if rotate_size is not None:
+        rotate_size = int(rotate_size)
+    rotate_time = args['--rotate-time']
+    if rotate_time is not None:
+        rotate_time = float(rotate_time)
+    metrics_address = args['--metrics']
+    if metrics_address is not None:
+        host, _, port = metrics_address.rpartition(':')
+        metrics_address = (host or '127.0.0.1', int(port))
+    runner = NitroRunner(vm_name, analyze_enabled, output, parallel,
+                         cache_policy, time_libvmi, process_fields,
+                         metrics_address, compression, rotate_size,
+                         rotate_time)
     runner.run()
 
 
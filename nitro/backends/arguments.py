@@ -1,6 +1,7 @@
 import struct
 
 from enum import Enum
+from libvmi import LibvmiError
 from nitro.event import SyscallType
 
 class SyscallArgumentType(Enum):
@@ -11,6 +12,11 @@ class SyscallArgumentType(Enum):
 class ArgumentMap:
     """
     ``ArgumentMap`` is a base class for providing access to system call arguments.
+
+    Argument values are cached once they have been read. Register arguments
+    are taken from the event. When the number of arguments of the call is
+    known, the stack arguments are fetched with a single read the first time
+    one of them is accessed.
     """
 
     ARG_SIZE = {
@@ -18,41 +24,108 @@ class ArgumentMap:
         SyscallType.sysenter: 'I'   # x32 -> 4 bytes
     }
 
+    ARG_STRUCT = {call_type: struct.Struct(fmt) for call_type, fmt in ARG_SIZE.items()}
+
     __slots__ = (
         "event",
+        "target_event",
         "process",
         "modified",
-        "arg_size_format"
+        "arg_size_format",
+        "arg_struct",
+        "nb_args",
+        "values",
     )
 
-    def __init__(self, event, process):
+    def __init__(self, event, process, nb_args=None):
         """
         :param NitroEvent event: event that is used to access arguments
         :param Process process: process which address space is used for argument lookups
+        :param int nb_args: number of arguments of the call, if known
         """
         #: Underlying event
         self.event = event
+        #: Event whose VCPU receives the modified register arguments, the
+        #: event being processed
+        self.target_event = event
         #: Process associated with the ``ArgumentMap``
         self.process = process
         self.modified = {}
         self.arg_size_format = self.ARG_SIZE[self.event.type]
+        self.arg_struct = self.ARG_STRUCT[self.event.type]
+        #: Number of arguments of the call, None if unknown
+        self.nb_args = nb_args
+        #: Argument values read so far, indexed by position
+        self.values = {}
+
+    def locate(self, index):
+        """
+        Return the type and the location of the argument at ``index``
+
+        :rtype: tuple
+        """
+        raise NotImplementedError("locate must be overridden by a subclass")
+
+    def __getitem__(self, index):
+        try:
+            return self.values[index]
+        except KeyError:
+            pass
+        arg_type, opaque = self.locate(index)
+        if (arg_type == SyscallArgumentType.memory and
+                self.nb_args is not None and 0 <= index < self.nb_args):
+            try:
+                self.snapshot()
+            except (LibvmiError, RuntimeError):
+                # part of the stack is unreadable, try the argument alone
+                pass
+            else:
+                return self.values[index]
+        value = self.get_argument_value(arg_type, opaque)
+        self.values[index] = value
+        return value
+
+    def __setitem__(self, index, value):
+        arg_type, opaque = self.locate(index)
+        self.set_argument_value(arg_type, opaque, value)
+        self.values[index] = value
+        self.modified[index] = value
+
+    def snapshot(self):
+        """Read all the stack arguments of the call at once"""
+        stack = []
+        for index in range(self.nb_args):
+            if index in self.values:
+                continue
+            arg_type, opaque = self.locate(index)
+            if arg_type == SyscallArgumentType.memory:
+                stack.append((index, opaque))
+        if stack:
+            size = self.arg_struct.size
+            first = stack[0][1]
+            count = stack[-1][1] - first + 1
+            addr = self.event.regs.rsp + (first * size)
+            buffer = self.process.read_memory(addr, count * size)
+            for index, opaque in stack:
+                value, = self.arg_struct.unpack_from(buffer, (opaque - first) * size)
+                self.values[index] = value
 
     def get_argument_value(self, arg_type, opaque):
         if arg_type == SyscallArgumentType.register:
             value = self.event.get_register(opaque)
         else:
             # memory
-            size = struct.calcsize(self.arg_size_format)
+            size = self.arg_struct.size
             addr = self.event.regs.rsp + (opaque * size)
-            value, *rest = struct.unpack(self.arg_size_format, self.process.read_memory(addr, size))
+            value, = self.arg_struct.unpack(self.process.read_memory(addr, size))
         return value
 
     def set_argument_value(self, arg_type, opaque, value):
         if arg_type == SyscallArgumentType.register:
-            self.event.update_register(opaque, value)
+            self.target_event.update_register(opaque, value)
         else:
             # memory
-            size = struct.calcsize(self.arg_size_format)
+            size = self.arg_struct.size
             addr = self.event.regs.rsp + (opaque * size)
-            buffer = struct.pack(self.arg_size_format, value)
+            buffer = self.arg_struct.pack(value)
             self.process.write_memory(addr, buffer)
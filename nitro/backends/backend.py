@@ -6,11 +6,128 @@ that generated the event and arguments.
 
 import logging
 import json
-from collections import defaultdict
+import struct
+import threading
+import time
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from enum import Enum
+from fnmatch import fnmatchcase
+from functools import partial
 
 from nitro.event import SyscallDirection
+from nitro.syscall import Syscall
+from nitro.metrics import LatencyHistogram
+from nitro.backends.instrumentation import TimedLibvmi
+from nitro.backends.process import EventPageCaches, PageCache, Process
 from libvmi import LibvmiError
 
+
+#: Name of the hooks fired for every system call
+CATCH_ALL = '*'
+
+
+def is_pattern(name):
+    """Is the hook name ``name`` a pattern matching several system calls"""
+    return any(char in name for char in '*?[')
+
+
+def add_hooks(hooks, new_hooks):
+    """Append the callbacks of ``new_hooks`` to ``hooks``, by name"""
+    for name, callback in new_hooks.items():
+        hooks.setdefault(name, []).append(callback)
+
+
+def remove_hook(hooks, name, callback=None):
+    """Remove ``callback``, or all the callbacks, defined on ``name``"""
+    if callback is None:
+        del hooks[name]
+    else:
+        callbacks = hooks[name]
+        callbacks.remove(callback)
+        if not callbacks:
+            del hooks[name]
+
+
+class CachePolicy(Enum):
+    """When are libvmi caches invalidated"""
+    #: before every event
+    always = 0
+    #: when the address space differs from the previous event's
+    cr3_change = 1
+    #: after system calls modifying memory mappings
+    memory_syscalls = 2
+    #: per address space, after its mappings have been modified
+    generation = 3
+
+
+class PendingSyscalls:
+    """
+    System calls waiting for their exit event, indexed by the guest thread
+    that entered them.
+
+    A thread has at most one system call in progress, so entering a new one
+    means the exit of the previous one has been missed. Entries are also
+    evicted when the table is full or when they are older than ``max_age``
+    seconds. The enters and exits that could not be paired are counted in
+    ``stats``.
+    """
+
+    __slots__ = (
+        "size",
+        "max_age",
+        "stats",
+        "pending",
+    )
+
+    def __init__(self, size, max_age, stats):
+        #: Maximum number of pending system calls
+        self.size = size
+        #: Maximum time a system call waits for its exit, in seconds
+        self.max_age = max_age
+        self.stats = stats
+        #: ``(syscall or syscall number, enter time)`` by thread, oldest first
+        self.pending = OrderedDict()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, thread, syscall):
+        """Record ``syscall`` entered by ``thread``"""
+        now = time.monotonic()
+        if self.pending.pop(thread, None) is not None:
+            self.stats['syscall_orphan_enter'] += 1
+        self.pending[thread] = (syscall, now)
+        self.expire(now)
+
+    def pop(self, thread):
+        """
+        Retrieve the system call ``thread`` is exiting from.
+
+        :returns: the system call or None if its enter is unknown
+        """
+        try:
+            syscall, _ = self.pending.pop(thread)
+        except KeyError:
+            self.stats['syscall_orphan_exit'] += 1
+            return None
+        return syscall
+
+    def expire(self, now):
+        """Evict the oldest system calls, while too old or too many"""
+        pending = self.pending
+        while pending:
+            _, enter_time = next(iter(pending.values()))
+            if len(pending) <= self.size and now - enter_time <= self.max_age:
+                break
+            pending.popitem(last=False)
+            self.stats['syscall_orphan_enter'] += 1
+            self.stats['syscall_pending_eviction'] += 1
+
+    def clear(self):
+        self.pending.clear()
+
+
 class Backend:
     """
     Base class for Backends. ``Backend`` provides functionality for dispatching
@@ -23,77 +140,517 @@ class Backend:
         "hooks",
         "stats",
         "listener",
-        "syscall_filtering"
+        "syscall_filtering",
+        "lock",
+        "cache_policy",
+        "last_cr3",
+        "generation",
+        "flushed_generation",
+        "generations",
+        "flushed_generations",
+        "configuration",
+        "pending_hooks",
+        "page_cache",
+        "out_arguments",
+        "pending_syscalls",
+        "hook_syscall_nbs",
+        "dispatch_table",
+        "catch_all_hooks",
+        "memory_syscall_nbs",
+        "syscall_latency",
+        "hook_latency",
     )
 
-    def __init__(self, domain, libvmi, listener, syscall_filtering=True):
-        """Create a new ``Backend``"""
+    #: Cleaned names of the system calls modifying memory mappings
+    MEMORY_SYSCALLS = frozenset()
+    #: Fields of the processes found by the backend, see :meth:`.Process.as_dict`
+    PROCESS_FIELDS = Process.FIELDS
+    #: Maximum number of system calls waiting for their exit
+    PENDING_SYSCALLS_SIZE = 4096
+    #: Maximum time a system call waits for its exit, in seconds
+    PENDING_SYSCALLS_MAX_AGE = 3600
+
+    def __init__(self, domain, libvmi, listener, syscall_filtering=True,
+                 cache_policy=CachePolicy.always, time_libvmi=False):
+        """
+        Create a new ``Backend``
+
+        :param bool time_libvmi: measure libvmi reads in ``stats``, see
+            :class:`.TimedLibvmi`
+        """
 
         #: libvirt domain associated with the backend
         self.domain = domain
-        #: handle to libvmi
-        self.libvmi = libvmi
+        #: Statistics about the backend
+        self.stats = defaultdict(int)
+        #: handle to libvmi, wrapped before the helpers of the subclasses
+        #: get hold of it
+        self.libvmi = TimedLibvmi(libvmi, self.stats) if time_libvmi else libvmi
         #: ``Listener`` associated with the ``Backend``
         self.listener = listener
         #: Is system call filtering enabled for the backend
         self.syscall_filtering = syscall_filtering
-        #: Event hooks
+        #: Event hooks, lists of callbacks indexed by the name they are
+        #: defined on
         self.hooks = {
             SyscallDirection.enter: {},
             SyscallDirection.exit: {}
         }
-        #: Statistics about the backend
-        self.stats = defaultdict(int)
+        #: Numbers of the system calls matched by the hook names
+        self.hook_syscall_nbs = {}
+        #: Hooks indexed by system call number, see :meth:`build_dispatch_table`
+        self.dispatch_table = {direction: {} for direction in self.hooks}
+        #: Hooks fired for every system call
+        self.catch_all_hooks = {direction: () for direction in self.hooks}
+        #: Lock serializing access to libvmi and to the backend state when
+        #: events are processed concurrently by the listener
+        self.lock = threading.RLock()
+        #: When libvmi caches are invalidated
+        self.cache_policy = cache_policy
+        self.last_cr3 = None
+        # number of memory mapping changes seen, overall and per address space
+        self.generation = 0
+        self.flushed_generation = 0
+        self.generations = {}
+        self.flushed_generations = {}
+        #: Listener configuration in progress, see :meth:`configure`
+        self.configuration = None
+        #: Hooks once the configuration in progress is applied
+        self.pending_hooks = None
+        #: Guest pages read by processes, cached per event
+        self.page_cache = EventPageCaches()
+        #: Numbers of the ``MEMORY_SYSCALLS``, set by the subclasses once their
+        #: system call table is loaded
+        self.memory_syscall_nbs = frozenset()
+        #: Time spent processing events, by direction and system call number
+        self.syscall_latency = defaultdict(LatencyHistogram)
+        #: Time spent in each hook, by direction and callback
+        self.hook_latency = defaultdict(LatencyHistogram)
+        #: OUT arguments, indexed by system call number and argument position
+        self.out_arguments = {}
+        #: System calls waiting for their exit event
+        self.pending_syscalls = PendingSyscalls(self.PENDING_SYSCALLS_SIZE,
+                                                self.PENDING_SYSCALLS_MAX_AGE,
+                                                self.stats)
+
+    def invalidate_caches(self, event):
+        """
+        Flush libvmi caches before analyzing ``event``, as required by the
+        cache policy. Kernel symbols don't move, so the symbol cache is kept.
+        The pages read by the hooks of ``event`` are cached until it is
+        released, other events never see them.
+        """
+        event.page_cache = PageCache(self.stats)
+        self.page_cache.event = event
+        policy = self.cache_policy
+        if policy == CachePolicy.always:
+            self.flush_caches()
+        elif policy == CachePolicy.cr3_change:
+            cr3 = event.sregs.cr3
+            if cr3 != self.last_cr3:
+                self.flush_caches()
+                self.last_cr3 = cr3
+        elif policy == CachePolicy.memory_syscalls:
+            if self.generation != self.flushed_generation:
+                self.flush_caches()
+                self.flushed_generation = self.generation
+        elif policy == CachePolicy.generation:
+            cr3 = event.sregs.cr3
+            generation = self.generations.get(cr3, 0)
+            if generation != self.flushed_generations.get(cr3, 0):
+                self.flush_caches(cr3)
+                self.flushed_generations[cr3] = generation
+
+    def flush_caches(self, dtb=None):
+        """
+        Flush libvmi caches
+
+        :param int dtb: only flush the address translations of this address
+            space, all of them if None
+        """
+        if dtb is None:
+            self.libvmi.v2pcache_flush()
+        else:
+            self.libvmi.v2pcache_flush(dtb)
+        self.libvmi.pidcache_flush()
+        self.libvmi.rvacache_flush()
+        self.stats['cache_flushes'] += 1
+
+    def address_space_changed(self, cr3):
+        """
+        Record that memory mappings of the address space ``cr3`` are being
+        modified. This is called when system calls from ``MEMORY_SYSCALLS``
+        enter and exit.
+        """
+        self.generation += 1
+        self.generations[cr3] = self.generations.get(cr3, 0) + 1
+
+    @staticmethod
+    def get_thread_id(event):
+        """
+        Identify the guest thread that produced ``event``.
+
+        Events are trapped in user mode, on both sides of the system call, so
+        the thread is identified by its address space and by its user mode
+        fs and gs bases, which point to its thread local storage (TEB on
+        Windows). Unlike the VCPU, they don't change when the scheduler
+        migrates the thread.
+        """
+        sregs = event.sregs
+        return (sregs.cr3, sregs.fs.base, sregs.gs.base)
+
+    def syscall_process(self, syscall):
+        """Find the process that entered ``syscall``, see :attr:`.Syscall.process`"""
+        with self.lock:
+            return self.associate_process(syscall.enter_event.sregs.cr3)
+
+    def syscall_arguments(self, syscall):
+        """Build the arguments of ``syscall``, see :attr:`.Syscall.args`"""
+        with self.lock:
+            return self.build_arguments(syscall.enter_event, syscall.process,
+                                        syscall.nb)
+
+    def build_arguments(self, event, process, syscall_nb):
+        """
+        Return the ``ArgumentMap`` of system call ``syscall_nb``, entered with
+        ``event``.
+        """
+        raise NotImplementedError
+
+    def find_syscall_nbs(self, names):
+        """Return the numbers of the known system calls among ``names``"""
+        nbs = (self.find_syscall_nb(name) for name in names)
+        return frozenset(nb for nb in nbs if nb is not None)
+
+    def define_out_argument(self, name, index, fmt='P'):
+        """
+        Declare that an argument of a system call points to a value written by
+        the call. The pointer is recorded when the call is entered, and the
+        value it points to is read once when it exits. The value is then
+        available in :attr:`.Syscall.out` to the exit hooks.
+
+        :param str name: Name of the system call.
+        :param int index: Position of the argument.
+        :param str fmt: ``struct`` format of the value.
+        :raises RuntimeError: if the system call is unknown.
+        """
+        syscall_nb = self.find_syscall_nb(name)
+        if syscall_nb is None:
+            raise RuntimeError('Unable to find syscall number for %s' % name)
+        self.out_arguments.setdefault(syscall_nb, {})[index] = struct.Struct(fmt)
+        if self.syscall_filtering:
+            self.listener.add_syscall_filters(
+                sorted(self.required_syscall_nbs() | {syscall_nb}))
+
+    def record_out_arguments(self, syscall):
+        """Record the OUT argument pointers of ``syscall`` as it is entered"""
+        if not self.out_arguments:
+            return
+        out_arguments = self.out_arguments.get(syscall.nb)
+        if not out_arguments or syscall.args is None:
+            return
+        syscall.out_pointers = {}
+        for index, value_struct in out_arguments.items():
+            try:
+                pointer = syscall.args[index]
+            except (LibvmiError, RuntimeError):
+                self.stats['out_argument_failure'] += 1
+                continue
+            syscall.out_pointers[index] = (pointer, value_struct)
+
+    def keeps_enter_event(self, syscall_nb):
+        """
+        Whether the exit of ``syscall_nb`` needs its enter event, for the
+        arguments of its exit hooks or its OUT arguments. Other enter events
+        are not copied out of the buffer pool.
+        """
+        exit_hooks = self.dispatch_table[SyscallDirection.exit].get(
+            syscall_nb, self.catch_all_hooks[SyscallDirection.exit])
+        return bool(exit_hooks) or syscall_nb in self.out_arguments
+
+    def pop_pending_syscall(self, event):
+        """
+        Retrieve the system call exited by ``event``, None if its enter is
+        unknown. The calls whose enter event was not kept, see
+        :meth:`keeps_enter_event`, come back without arguments and with the
+        process of ``event``.
+        """
+        syscall = self.pending_syscalls.pop(self.get_thread_id(event))
+        if isinstance(syscall, int):
+            syscall = Syscall(event, nb=syscall, args=None, backend=self)
+        return syscall
+
+    def capture_out_arguments(self, syscall):
+        """Read the values of the OUT arguments of ``syscall`` as it exits"""
+        if not syscall.out_pointers or syscall.process is None:
+            return
+        syscall.out = {}
+        for index, (pointer, value_struct) in syscall.out_pointers.items():
+            value = None
+            if pointer:
+                try:
+                    buffer = syscall.process.read_memory(pointer,
+                                                         value_struct.size)
+                except (LibvmiError, RuntimeError):
+                    self.stats['out_argument_failure'] += 1
+                else:
+                    value, = value_struct.unpack(buffer)
+            syscall.out[index] = value
+
+    def count(self, key):
+        """Increment the statistic ``key``"""
+        with self.lock:
+            self.stats[key] += 1
 
     def dispatch_hooks(self, syscall):
+        """
+        Call the hooks of ``syscall``. They are called without holding
+        :attr:`lock`, which the backend takes to access libvmi.
+        """
+        direction = syscall.event.direction
+        handlers = self.dispatch_table[direction].get(
+            syscall.nb, self.catch_all_hooks[direction])
+        if not handlers:
+            return
         # TODO: don't dispatch if the process is None
         if syscall.process is None:
             return
-
-        try:
-            hook = self.hooks[syscall.event.direction][syscall.name]
-        except KeyError:
-            pass
-        else:
+        debug = logging.root.isEnabledFor(logging.DEBUG)
+        for hook in handlers:
+            start = time.perf_counter()
             try:
-                logging.debug('Processing hook %s - %s',
-                              syscall.event.direction.name, hook.__name__)
+                if debug:
+                    logging.debug('Processing hook %s - %s', direction.name,
+                                  getattr(hook, '__name__', repr(hook)))
                 hook(syscall, self)
             # FIXME: There should be a way for OS specific backends to report these
             # except InconsistentMemoryError: #
             #     self.stats['memory_access_error'] += 1
             #     logging.exception('Memory access error')
             except LibvmiError:
-                self.stats['libvmi_failure'] += 1
+                self.count('libvmi_failure')
                 logging.exception('VMI_FAILURE')
             # misc failures
             except ValueError:
-                self.stats['misc_error'] += 1
+                self.count('misc_error')
                 logging.exception('Misc error')
             except Exception:
                 logging.exception('Unknown error while processing hook')
             else:
-                self.stats['hooks_completed'] += 1
+                self.count('hooks_completed')
             finally:
-                self.stats['hooks_processed'] += 1
+                with self.lock:
+                    self.hook_latency[direction, hook].record(
+                        time.perf_counter() - start)
+                    self.stats['hooks_processed'] += 1
 
     def define_hook(self, name, callback, direction=SyscallDirection.enter):
         """
-        Register a new system call hook with the ``Backend``.
-        
+        Register a new system call hook with the ``Backend``. Several hooks
+        can be defined on the same system call, they are called in the order
+        they were defined.
+
+        ``name`` can also be a pattern such as ``Nt*File``, matched against
+        the names of the system calls when the hook is defined, or
+        :data:`CATCH_ALL` to hook every system call. Hooks defined on a name
+        are called first, then the ones defined on a pattern and finally the
+        catch-all hooks. When system call filtering is enabled, catch-all
+        hooks only see the system calls passing the filters.
+
         :param str name: Name of the system call to hook.
         :param callable callback: Callable to call when the hook is fired.
         :param SyscallDirection direction: Should the hook fire when system call is entered or exited.
+        :raises RuntimeError: if no system call matches ``name``.
         """
-        logging.info('Defining %s hook on %s', direction.name, name)
-        self.hooks[direction][name] = callback
+        self.define_hooks({name: callback}, direction)
 
-    def undefine_hook(self, name, direction=SyscallDirection.enter):
+    def define_hooks(self, hooks, direction=SyscallDirection.enter):
         """
-        Unregister a hook.
+        Register several system call hooks with the ``Backend``, see
+        :meth:`define_hook`. When system call filtering is enabled, all the
+        filters are installed at once while the domain is suspended.
+
+        :param dict hooks: Callables indexed by the name of the system call to hook.
+        :param SyscallDirection direction: Should the hooks fire when system calls are entered or exited.
+        :raises RuntimeError: if a system call is unknown, no hook is defined then.
         """
+        syscall_nbs = set()
+        for name in hooks:
+            nbs = self.find_hook_syscall_nbs(name)
+            if nbs is not None:
+                syscall_nbs.update(nbs)
+        logging.info('Defining %s hooks on %s', direction.name,
+                     ', '.join(hooks))
+        self.change_hooks(add_hooks, direction, hooks)
+        if self.syscall_filtering and syscall_nbs:
+            syscall_nbs.update(self.required_syscall_nbs())
+            self.listener.add_syscall_filters(sorted(syscall_nbs))
+
+    def undefine_hook(self, name, direction=SyscallDirection.enter,
+                      callback=None):
+        """
+        Unregister the hooks defined on ``name``, or only ``callback`` if
+        given. The filters of the system calls that are no longer hooked are
+        removed. Inside :meth:`configure`, the hooks defined and removed
+        earlier in the same configuration are taken into account.
+
+        :raises RuntimeError: if no such hook is defined.
+        """
+        callbacks = self.configured_hooks[direction].get(name)
+        if callbacks is None or (callback is not None and
+                                 callback not in callbacks):
+            raise RuntimeError('No {} hook defined on {}'.format(
+                direction.name, name))
         logging.info('Removing hook on %s', name)
-        self.hooks[direction].pop(name)
+        if self.syscall_filtering and (callback is None or
+                                       callbacks == [callback]):
+            syscall_nbs = self.unhooked_syscall_nbs(name, direction)
+            if syscall_nbs:
+                self.listener.remove_syscall_filters(sorted(syscall_nbs))
+        self.change_hooks(remove_hook, direction, name, callback)
+
+    def find_hook_syscall_nbs(self, name):
+        """
+        Return the numbers of the system calls hooked by ``name``, None for
+        :data:`CATCH_ALL`. Patterns are matched against the names of
+        :attr:`syscall_names`, which the subclasses define.
+
+        :raises RuntimeError: if no system call matches ``name``.
+        """
+        if name == CATCH_ALL:
+            return None
+        try:
+            return self.hook_syscall_nbs[name]
+        except KeyError:
+            pass
+        if is_pattern(name):
+            nbs = frozenset(nb for syscall_name, nb in self.syscall_names.items()
+                            if fnmatchcase(syscall_name, name))
+        else:
+            syscall_nb = self.find_syscall_nb(name)
+            nbs = frozenset() if syscall_nb is None else frozenset((syscall_nb,))
+        if not nbs:
+            raise RuntimeError('Unable to find syscall number for %s' % name)
+        self.hook_syscall_nbs[name] = nbs
+        return nbs
+
+    def unhooked_syscall_nbs(self, name, direction):
+        """
+        Return the numbers of the system calls that are hooked by ``name``
+        and by no other hook, and whose OUT arguments are not captured. The
+        :meth:`required_syscall_nbs` are only included once no system call
+        is hooked or captured anymore.
+        """
+        nbs = set(self.hook_syscall_nbs.get(name, ()))
+        if not nbs:
+            return nbs
+        # the system calls whose OUT arguments are captured stay trapped
+        nbs.difference_update(self.out_arguments)
+        filtered = bool(self.out_arguments)
+        for other_direction, hooks in self.configured_hooks.items():
+            for other in hooks:
+                if (other, other_direction) != (name, direction):
+                    other_nbs = self.hook_syscall_nbs.get(other, ())
+                    nbs.difference_update(other_nbs)
+                    filtered = filtered or bool(other_nbs)
+        if filtered:
+            nbs.difference_update(self.required_syscall_nbs())
+        else:
+            # without filters, every system call is trapped again
+            nbs.update(self.required_syscall_nbs())
+        return nbs
+
+    def required_syscall_nbs(self):
+        """
+        Return the numbers of the system calls the backend has to see to keep
+        its caches up to date. When system call filtering is enabled, they
+        are trapped along with the hooked system calls.
+        """
+        if self.cache_policy in (CachePolicy.memory_syscalls,
+                                 CachePolicy.generation):
+            # the caches are only flushed after these
+            return self.memory_syscall_nbs
+        return frozenset()
+
+    @property
+    def configured_hooks(self):
+        """Hooks including the changes of the configuration in progress"""
+        if self.pending_hooks is not None:
+            return self.pending_hooks
+        return self.hooks
+
+    def build_dispatch_table(self, direction):
+        """
+        Index the hooks of ``direction`` by system call number, so events are
+        dispatched without looking their names up.
+        """
+        hooks = self.hooks[direction]
+        catch_all = tuple(hooks.get(CATCH_ALL, ()))
+        handlers = defaultdict(list)
+        # hooks on names first, then the ones on patterns
+        for patterns in (False, True):
+            for name, callbacks in hooks.items():
+                if name == CATCH_ALL or is_pattern(name) != patterns:
+                    continue
+                for syscall_nb in self.hook_syscall_nbs[name]:
+                    handlers[syscall_nb].extend(callbacks)
+        self.dispatch_table[direction] = {
+            syscall_nb: tuple(callbacks) + catch_all
+            for syscall_nb, callbacks in handlers.items()
+        }
+        self.catch_all_hooks[direction] = catch_all
+
+    def change_hooks(self, change, direction, *args):
+        """
+        Apply ``change`` to the hooks of ``direction``, or delay it until the
+        configuration in progress is applied. The pending hooks are changed
+        right away, so the next changes of the configuration see them.
+        """
+        if self.configuration is not None:
+            change(self.pending_hooks[direction], *args)
+            self.configuration.actions.append(
+                partial(self.apply_hook_change, change, direction, *args))
+        else:
+            self.apply_hook_change(change, direction, *args)
+
+    def apply_hook_change(self, change, direction, *args):
+        change(self.hooks[direction], *args)
+        self.build_dispatch_table(direction)
+
+    @contextmanager
+    def configure(self):
+        """
+        Batch changes to the hooks, the system call filters and the trap. They
+        are applied together when the block exits, while the domain is
+        suspended once, see :meth:`.Listener.configure`::
+
+            with backend.configure():
+                backend.undefine_hook('read')
+                backend.define_hook('open', on_open)
+                backend.listener.set_traps(True)
+        """
+        if self.configuration is not None:
+            yield self.configuration
+            return
+        with self.listener.configure() as config:
+            self.configuration = config
+            self.pending_hooks = {
+                direction: {name: list(callbacks)
+                            for name, callbacks in hooks.items()}
+                for direction, hooks in self.hooks.items()
+            }
+            try:
+                yield config
+            finally:
+                self.configuration = None
+                self.pending_hooks = None
+
+    def find_syscall_nb(self, syscall_name):
+        """
+        Return the number of the system call named ``syscall_name``, or None
+        if it is unknown.
+        """
+        raise NotImplementedError
 
     def __enter__(self):
         return self
@@ -101,7 +658,56 @@ class Backend:
     def __exit__(self, *args):
         self.stop()
 
+    def latency_report(self):
+        """
+        Summary of the time spent processing events, by system call and by
+        hook, along with the listener's :meth:`.Listener.latency_report`.
+
+        :rtype: dict
+        """
+        report = self.listener.latency_report()
+        with self.lock:
+            report['syscalls'] = {
+                '{}:{}'.format(direction.name, self.syscall_label(syscall_nb)):
+                histogram.as_dict()
+                for (direction, syscall_nb), histogram
+                in self.syscall_latency.items()
+            }
+            hook_labels = self.hook_labels()
+            report['hooks'] = {
+                '{}:{}'.format(direction.name, hook_labels[direction, hook]):
+                histogram.as_dict()
+                for (direction, hook), histogram in self.hook_latency.items()
+            }
+        return report
+
+    def hook_labels(self):
+        """Names of the hooks in reports, by direction and callback"""
+        labels = {}
+        seen = set()
+        for direction, hook in self.hook_latency:
+            label = getattr(hook, '__qualname__', repr(hook))
+            if (direction, label) in seen:
+                # several callbacks with the same name, lambdas...
+                label = '{} ({:#x})'.format(label, id(hook))
+            seen.add((direction, label))
+            labels[direction, hook] = label
+        return labels
+
+    def syscall_label(self, syscall_nb):
+        """Name of system call ``syscall_nb`` in reports"""
+        if syscall_nb is None:
+            return 'Unknown'
+        try:
+            return self.resolve_syscall(syscall_nb)[1]
+        except LibvmiError:
+            return str(syscall_nb)
+
     def stop(self):
         """Stop the backend"""
+        for vcpu_io in self.listener.vcpus_io:
+            for key, value in vcpu_io.stats.items():
+                self.stats[key] += value
         logging.info(json.dumps(self.stats, indent=4))
+        logging.info(json.dumps(self.latency_report(), indent=4))
         self.libvmi.destroy()
@@ -1,4 +1,5 @@
 from libvmi import VMIOS, Libvmi
+from nitro.backends.backend import CachePolicy
 from nitro.backends.linux import LinuxBackend
 from nitro.backends.windows import WindowsBackend
 
@@ -10,11 +11,14 @@ BACKENDS = {
 class BackendNotFoundError(Exception):
     pass
 
-def get_backend(domain, listener, syscall_filtering):
+def get_backend(domain, listener, syscall_filtering,
+                cache_policy=CachePolicy.always, time_libvmi=False):
     """
     Return a suitable backend based on guest operating system.
 
     :param domain: libvirt domain
+    :param CachePolicy cache_policy: when libvmi caches are invalidated
+    :param bool time_libvmi: measure libvmi reads, see :class:`.TimedLibvmi`
     :returns: new backend instance
     :rtype: Backend
     :raises: BackendNotFoundError
@@ -22,7 +26,8 @@ def get_backend(domain, listener, syscall_filtering):
     libvmi = Libvmi(domain.name())
     os_type = libvmi.get_ostype()
     try:
-        return BACKENDS[os_type](domain, libvmi, listener, syscall_filtering)
+        return BACKENDS[os_type](domain, libvmi, listener, syscall_filtering,
+                                 cache_policy, time_libvmi=time_libvmi)
     except KeyError:
         raise BackendNotFoundError('Unable to find an appropritate backend for'
                                    'this OS: {}'.format(os_type))
@@ -0,0 +1,43 @@
+"""
+Helpers for measuring where the back ends spend their time.
+"""
+
+import time
+
+
+class TimedLibvmi:
+    """
+    Wrapper around a libvmi handle measuring the latency of memory reads.
+
+    Every ``read_*`` call is counted in ``stats['libvmi_reads']`` and its
+    duration, in seconds, is added to ``stats['libvmi_read_time']``. Other
+    attributes are passed through to the wrapped handle.
+    """
+
+    def __init__(self, libvmi, stats):
+        """
+        :param libvmi: libvmi handle to wrap
+        :param dict stats: statistics to update, typically ``Backend.stats``
+        """
+        self.libvmi = libvmi
+        self.stats = stats
+
+    def __getattr__(self, name):
+        attr = getattr(self.libvmi, name)
+        if name.startswith('read_') and callable(attr):
+            attr = self.timed(attr)
+        # cache the attribute, __getattr__ is only called on misses
+        setattr(self, name, attr)
+        return attr
+
+    def timed(self, read):
+        stats = self.stats
+
+        def timed_read(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return read(*args, **kwargs)
+            finally:
+                stats['libvmi_reads'] += 1
+                stats['libvmi_read_time'] += time.perf_counter() - start
+        return timed_read
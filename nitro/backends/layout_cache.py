@@ -0,0 +1,84 @@
+"""
+On-disk cache for guest kernel layouts (symbols, offsets, system call tables)
+that are expensive to extract but only depend on the guest's kernel build.
+
+Layouts are stored as JSON documents under ``$NITRO_CACHE_DIR`` or, if it is
+not set, under ``$XDG_CACHE_HOME/nitro`` (``~/.cache/nitro``).
+"""
+
+import os
+import re
+import json
+import logging
+
+from tempfile import NamedTemporaryFile
+
+
+def get_cache_dir():
+    """Return the directory holding cached layouts"""
+    cache_dir = os.getenv('NITRO_CACHE_DIR')
+    if cache_dir is None:
+        xdg_cache = os.getenv('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+        cache_dir = os.path.join(xdg_cache, 'nitro')
+    return cache_dir
+
+
+def get_cache_path(kind, key):
+    """
+    Return where the layout identified by ``key`` is stored
+
+    :param str kind: kind of layout, for example ``windows`` or ``linux``
+    :param str key: identity of the kernel build
+    """
+    # keys come from guest memory, keep them safe to use as file names
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', key)
+    return os.path.join(get_cache_dir(), kind, '{}.json'.format(name))
+
+
+def load_layout(kind, key):
+    """
+    Load a cached layout
+
+    :returns: the cached layout or None if it is not available
+    :rtype: dict
+    """
+    path = get_cache_path(kind, key)
+    try:
+        with open(path, 'r') as f:
+            layout = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logging.warning('Ignoring unreadable layout cache %s', path)
+        return None
+    logging.info('Loaded %s layout from %s', kind, path)
+    return layout
+
+
+def store_layout(kind, key, layout):
+    """
+    Store a layout in the cache. Failures are logged and otherwise ignored,
+    the cache is only an optimization.
+    """
+    path = get_cache_path(kind, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, concurrent readers never see a
+        # partial layout
+        f = NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False)
+        try:
+            with f:
+                json.dump(layout, f)
+            os.replace(f.name, path)
+        except BaseException:
+            # don't leave partial layouts behind
+            try:
+                os.unlink(f.name)
+            except OSError:
+                pass
+            raise
+    except OSError:
+        logging.warning('Failed to store %s layout in %s', kind, path)
+    else:
+        logging.info('Stored %s layout in %s', kind, path)
@@ -25,26 +25,11 @@ class LinuxArgumentMap(ArgumentMap):
         ],
     }
 
-    def __getitem__(self, index):
+    def locate(self, index):
         try:
-            arg_type, opaque = self.CONVENTION[self.event.type][index]
+            return self.CONVENTION[self.event.type][index]
         except KeyError as error:
             raise RuntimeError('Unknown convention') from error
         except IndexError:
             raise RuntimeError('Invalid argument index: Linux syscalls are '
                                'limited to 6 parameters')
-
-        return self.get_argument_value(arg_type, opaque)
-
-
-    def __setitem__(self, index, value):
-        try:
-            arg_type, opaque = self.CONVENTION[self.event.type][index]
-        except KeyError as error:
-            raise RuntimeError('Unknown convention') from error
-        except IndexError:
-            raise RuntimeError('Invalid argument index: Linux syscalls are '
-                               'limited to 6 parameters')
-
-        self.set_argument_value(arg_type, opaque, value)
-        self.modified[index] = value
@@ -4,14 +4,18 @@ Backend for extracting information about system calls from Linux guests.
 
 import logging
 import re
+import struct
+import hashlib
+import time
 
 from ctypes import sizeof, c_void_p
 
 from libvmi import LibvmiError
+from nitro.backends import layout_cache
 from nitro.syscall import Syscall
 from nitro.event import SyscallDirection
 from nitro.backends.linux.process import LinuxProcess
-from nitro.backends.backend import Backend
+from nitro.backends.backend import Backend, CachePolicy
 from nitro.backends.linux.arguments import LinuxArgumentMap
 
 # Technically, I do not think using this the way
@@ -22,35 +26,86 @@ HANDLER_NAME_REGEX = re.compile(r"^(SyS|sys)_(?P<name>.+)")
 
 MAX_SYSTEM_CALL_COUNT = 1024
 
+# System calls after which the address space of the caller is released and
+# its page directory might be reused by another process
+ADDRESS_SPACE_RELEASING_SYSCALLS = frozenset((
+    "exit",
+    "exit_group",
+    "execve",
+    "execveat",
+))
+
 class LinuxBackend(Backend):
     """Extract information about system calls produced by the guest. This backend
     support 64-bit Linux guests."""
 
     __slots__ = (
         "sys_call_table_addr",
+        "init_task_addr",
         "nb_vcpu",
-        "syscall_stack",
         "tasks_offset",
         "syscall_names",
+        "syscall_table",
+        "releasing_syscall_nbs",
         "mm_offset",
         "pgd_offset",
+        "pid_offset",
+        "name_offset",
+        "tasks",
+        "processes",
+        "released_tasks",
     )
 
-    def __init__(self, domain, libvmi, listener, syscall_filtering=True):
-        super().__init__(domain, libvmi, listener, syscall_filtering)
+    PROCESS_FIELDS = LinuxProcess.FIELDS
+
+    MEMORY_SYSCALLS = frozenset((
+        "mmap",
+        "munmap",
+        "mprotect",
+        "mremap",
+        "brk",
+        "madvise",
+        "remap_file_pages",
+        "shmat",
+        "shmdt",
+        "execve",
+        "execveat",
+    ))
+
+    def __init__(self, domain, libvmi, listener, syscall_filtering=True,
+                 cache_policy=CachePolicy.always, time_libvmi=False):
+        super().__init__(domain, libvmi, listener, syscall_filtering,
+                         cache_policy, time_libvmi)
         self.sys_call_table_addr = self.libvmi.translate_ksym2v("sys_call_table")
         logging.debug("sys_call_table at %s", hex(self.sys_call_table_addr))
 
         vcpus_info = self.domain.vcpus()
         self.nb_vcpu = len(vcpus_info[0])
 
-        self.syscall_stack = tuple([] for _ in range(self.nb_vcpu))
-
+        #: ``(full_name, clean_name)`` of each system call, indexed by number
+        self.syscall_table = tuple((name, clean_name(name))
+                                   for name in self.load_syscall_table())
         self.syscall_names = self.build_syscall_name_map()
+        self.memory_syscall_nbs = self.find_syscall_nbs(self.MEMORY_SYSCALLS)
+        #: Numbers of the ``ADDRESS_SPACE_RELEASING_SYSCALLS``
+        self.releasing_syscall_nbs = self.find_syscall_nbs(
+            ADDRESS_SPACE_RELEASING_SYSCALLS)
 
         self.tasks_offset = self.libvmi.get_offset("linux_tasks")
         self.mm_offset = self.libvmi.get_offset("linux_mm")
         self.pgd_offset = self.libvmi.get_offset("linux_pgd")
+        self.pid_offset = self.libvmi.get_offset("linux_pid")
+        self.name_offset = self.libvmi.get_offset("linux_name")
+        # address of swapper's task_struct, the head of the task list
+        self.init_task_addr = self.libvmi.translate_ksym2v("init_task")
+
+        #: Address of the task_struct of each process, indexed by cr3
+        self.tasks = {}
+        #: Processes seen so far, indexed by cr3
+        self.processes = {}
+        #: task_struct of the processes that released their address space,
+        #: indexed by cr3
+        self.released_tasks = {}
 
     def process_event(self, event):
         """
@@ -59,41 +114,84 @@ class LinuxBackend(Backend):
         that contains higher-level information about the system call that is
         being processed.
 
+        Like ``event``, a system call being entered is only valid until
+        the event is released.
+
         :param NitroEvent event: event to be analyzed
         :returns: system call based on ``event``.
         :rtype: Systemcall
         """
 
-        # Clearing these caches is really important since otherwise we will end
-        # up with incorrect memory references. Unfortunatelly, this will also
-        # make the backend slow. In my limited testing it seems that only
-        # clearing v2p cache works most of the time but I am sure issues will
-        # arise.
-        self.libvmi.v2pcache_flush()
-        self.libvmi.pidcache_flush()
-        self.libvmi.rvacache_flush()
-        self.libvmi.symcache_flush()
+        start = time.perf_counter()
+        with self.lock:
+            cr3 = event.sregs.cr3
+            if event.direction == SyscallDirection.exit:
+                syscall = self.pop_pending_syscall(event)
+                if syscall is not None and syscall.nb in self.memory_syscall_nbs:
+                    self.address_space_changed(cr3)
 
-        process = self.associate_process(event.sregs.cr3)
-        if event.direction == SyscallDirection.exit:
-            try:
-                syscall = self.syscall_stack[event.vcpu_nb].pop()
-                syscall.event = event
-            except IndexError:
-                syscall = Syscall(event, "Unknown", "Unknown", process, None)
-        else:
-            # Maybe we should catch errors from associate_process
-            name = self.get_syscall_name(event.regs.rax)
-            args = LinuxArgumentMap(event, process)
-            cleaned = clean_name(name) if name is not None else None
-            syscall = Syscall(event, name, cleaned, process, args)
-            self.syscall_stack[event.vcpu_nb].append(syscall)
+            # Clearing these caches is really important since otherwise we will
+            # end up with incorrect memory references. Unfortunatelly, this will
+            # also make the backend slow, see CachePolicy for cheaper
+            # alternatives.
+            self.invalidate_caches(event)
+
+            # the process, the names and the arguments are only resolved when
+            # a hook or the caller needs them
+            if event.direction == SyscallDirection.exit:
+                if syscall is not None:
+                    syscall.event = event
+                    self.capture_out_arguments(syscall)
+                else:
+                    syscall = Syscall(event, "Unknown", "Unknown", args=None,
+                                      backend=self)
+            else:
+                syscall_nb = event.regs.rax
+                keep = self.keeps_enter_event(syscall_nb)
+                if keep:
+                    # the exit needs the enter event, copy it out of the pool
+                    event = event.copy()
+                syscall = Syscall(event, nb=syscall_nb, backend=self)
+                self.record_out_arguments(syscall)
+                self.pending_syscalls.push(self.get_thread_id(event),
+                                           syscall if keep else syscall_nb)
+                if syscall_nb in self.memory_syscall_nbs:
+                    self.address_space_changed(cr3)
+                if syscall_nb in self.releasing_syscall_nbs:
+                    self.process_releasing(syscall)
+        # hooks run outside of the lock, they take it to access libvmi, so
+        # hooks of other VCPUs run meanwhile
         self.dispatch_hooks(syscall)
+        with self.lock:
+            self.syscall_latency[event.direction, syscall.nb].record(
+                time.perf_counter() - start)
         return syscall
 
+    def build_arguments(self, event, process, syscall_nb):
+        return LinuxArgumentMap(event, process)
+
+    def required_syscall_nbs(self):
+        # the cached processes are checked once their address space is released
+        return super().required_syscall_nbs() | self.releasing_syscall_nbs
+
+    def resolve_syscall(self, rax):
+        """
+        Return the handler name and the cleaned name of the system call
+        associated with ``rax``. Numbers outside of the system call table
+        are looked up in the guest's memory.
+
+        :param int rax: index into system call table.
+        :rtype: tuple
+        """
+        if 0 <= rax < len(self.syscall_table):
+            return self.syscall_table[rax]
+        name = self.get_syscall_name(rax)
+        return name, clean_name(name) if name is not None else None
+
     def get_syscall_name(self, rax):
         """
-        Return name of the system call handler associated with ``rax``.
+        Return name of the system call handler associated with ``rax``, as
+        found in the guest's memory.
 
         :param int rax: index into system call table.
         :returns: system call handler name
@@ -107,67 +205,207 @@ class LinuxBackend(Backend):
         return self.libvmi.translate_v2ksym(addr)
 
     def build_syscall_name_map(self):
+        """
+        Map system call names to their index in the system call table. Both
+        handler names and cleaned names are indexed.
+        """
+        mapping = {}
+        for i, (name, cleaned) in enumerate(self.syscall_table):
+            mapping[name] = i
+            mapping[cleaned] = i
+        return mapping
+
+    def load_syscall_table(self):
+        """
+        Return the names of the system call handlers, in system call table order.
+
+        The table only depends on the kernel build, it is cached on disk and
+        identified by the kernel's banner.
+        """
+        banner = self.get_kernel_banner()
+        key = get_kernel_id(banner) if banner else None
+        layout = None
+        if key is not None:
+            layout = layout_cache.load_layout('linux', key)
+        if layout is not None:
+            handlers = layout['syscall_table']
+        else:
+            handlers = self.read_syscall_table()
+            if key is not None:
+                layout_cache.store_layout('linux', key, {
+                    'banner': banner,
+                    'syscall_table': handlers,
+                })
+        return handlers
+
+    def read_syscall_table(self):
+        """
+        Return the names of the system call handlers, in system call table order.
+        """
         # Its a bit difficult to know where the system call table ends, here we
         # do something kind of risky and read as long as translate_v2ksym
         # returns something that looks like a system call handler.
-        mapping = {}
+        size = MAX_SYSTEM_CALL_COUNT * VOID_P_SIZE
+        try:
+            buffer, bytes_read = self.libvmi.read_va(self.sys_call_table_addr,
+                                                     0, size)
+        except LibvmiError:
+            bytes_read = 0
+        if bytes_read != size:
+            # the table might be close to the end of the mapped kernel image,
+            # fall back to reading one entry at a time
+            logging.debug("Failed to read the system call table at once")
+            addrs = self.read_syscall_table_entries()
+        else:
+            addrs = struct.unpack_from("{}P".format(MAX_SYSTEM_CALL_COUNT), buffer)
+        handlers = []
+        # most of the unimplemented entries point to the same handler
+        symbols = {}
+        for addr in addrs:
+            symbol = symbols.get(addr)
+            if symbol is None:
+                try:
+                    symbol = self.libvmi.translate_v2ksym(addr)
+                except LibvmiError as error:
+                    logging.critical("Failed to build syscall name map")
+                    raise error
+                symbols[addr] = symbol
+            if symbol is None:
+                break
+            handlers.append(symbol)
+        return handlers
+
+    def read_syscall_table_entries(self):
+        """
+        Generate the entries of the system call table, reading them one by one.
+        """
         for i in range(0, MAX_SYSTEM_CALL_COUNT):
             p_addr = self.sys_call_table_addr + (i * VOID_P_SIZE)
             try:
-                addr = self.libvmi.read_addr_va(p_addr, 0)
-                symbol = self.libvmi.translate_v2ksym(addr)
+                yield self.libvmi.read_addr_va(p_addr, 0)
             except LibvmiError as error:
                 logging.critical("Failed to build syscall name map")
                 raise error
-            else:
-                if symbol is not None:
-                    mapping[symbol] = i
-                else:
-                    break
-        return mapping
+
+    def get_kernel_banner(self):
+        """
+        Return the guest's kernel banner, or None if it cannot be read.
+        """
+        try:
+            addr = self.libvmi.translate_ksym2v("linux_banner")
+            return self.libvmi.read_str_va(addr, 0)
+        except LibvmiError:
+            return None
 
     def find_syscall_nb(self, syscall_name):
         # What about thos compat_* handlers?
-        handler_regexp = re.compile(r"^(SyS|sys)_{}$".format(re.escape(syscall_name)))
-        for full_name, ind in self.syscall_names.items():
-            if handler_regexp.match(full_name) is not None:
-                return ind
+        return self.syscall_names.get(syscall_name)
 
     def associate_process(self, cr3):
         """
         Get ``LinuxProcess`` associated with ``cr3``
+
+        Processes are cached by cr3. On a miss, the task list is walked again
+        to index the address space of every task.
+
         :params int cr3: cr3 value
         :returns: process associated with ``cr3``
         :rtype: LinuxProcess
         """
-        head = self.libvmi.translate_ksym2v("init_task") # get the address of swapper's task_struct
+        process = self.processes.get(cr3)
+        if process is not None and not self.is_released(process):
+            self.stats['process_cache_hit'] += 1
+            return process
+        self.stats['process_cache_miss'] += 1
+        task = self.tasks.get(cr3)
+        if task is None:
+            self.refresh_tasks()
+            task = self.tasks.get(cr3)
+            if task is None:
+                return None
+        # Eventually, I would like to look for the executable name from mm->exe_file->f_path
+        process = LinuxProcess(self.libvmi, cr3, task, self.pid_offset,
+                               self.name_offset, self.page_cache, self.lock)
+        self.processes[cr3] = process
+        return process
+
+    def refresh_tasks(self):
+        """
+        Rebuild the cr3 to task_struct index by walking the task list, and
+        forget about the cached processes whose task has changed.
+        """
+        self.stats['process_cache_refresh'] += 1
+        tasks = {}
+        head = self.init_task_addr
         next_ = head
         while True: # Maybe this should have a sanity check stopping it
-            mm = self.libvmi.read_addr_va(next_ + self.mm_offset, 0)
-            if not mm:
-                mm = self.libvmi.read_addr_va(next_ + self.mm_offset + VOID_P_SIZE, 0)
-            if mm:
-                pgd = self.libvmi.read_addr_va(mm + self.pgd_offset, 0)
-                pgd_phys_addr = self.libvmi.translate_kv2p(pgd)
-                if cr3 == pgd_phys_addr:
-                    # Eventually, I would like to look for the executable name from mm->exe_file->f_path
-                    return LinuxProcess(self.libvmi, cr3, next_)
-            else:
-                #logging.debug("missing mm")
-                pass
+            pgd_phys_addr = self.read_task_pgd(next_)
+            if pgd_phys_addr is not None:
+                # keep the first task using the address space
+                tasks.setdefault(pgd_phys_addr, next_)
             next_ = self.libvmi.read_addr_va(next_ + self.tasks_offset, 0) - self.tasks_offset
             if next_ == head:
                 break
+        self.tasks = tasks
+        self.processes = {cr3: process for cr3, process in self.processes.items()
+                          if tasks.get(cr3) == process.task_struct}
 
-    def define_hook(self, name, callback, direction=SyscallDirection.enter):
-        super().define_hook(name, callback, direction)
-        if self.syscall_filtering:
-            self.add_syscall_filter(name)
+    def read_task_pgd(self, task):
+        """
+        Return the physical address of the page directory used by ``task``,
+        or None if it has no address space.
+        """
+        mm = self.libvmi.read_addr_va(task + self.mm_offset, 0)
+        if not mm:
+            # kernel threads borrow the address space in active_mm
+            mm = self.libvmi.read_addr_va(task + self.mm_offset + VOID_P_SIZE, 0)
+            if not mm:
+                return None
+        pgd = self.libvmi.read_addr_va(mm + self.pgd_offset, 0)
+        return self.libvmi.translate_kv2p(pgd)
 
-    def undefine_hook(self, name, direction=SyscallDirection.enter):
-        super().undefine_hook(name, direction)
-        if self.syscall_filtering:
-            self.remove_syscall_filter(name)
+    def process_releasing(self, syscall):
+        """
+        Remember that the caller of ``syscall`` is releasing its address
+        space. Its process is resolved first, so that the system call keeps
+        it. The cached entry is checked against the task's page directory
+        until the address space is reused by another task, see
+        :meth:`is_released`.
+        """
+        process = syscall.process
+        if process is not None:
+            self.released_tasks[process.cr3] = process.task_struct
+
+    def is_released(self, process):
+        """
+        Check if the cached ``process`` has released its address space, in
+        which case it is forgotten.
+        """
+        task = self.released_tasks.get(process.cr3)
+        if task is None:
+            return False
+        if task != process.task_struct:
+            # another task is using the address space
+            del self.released_tasks[process.cr3]
+            return False
+        try:
+            if self.read_task_pgd(task) == process.cr3:
+                # the task is still running
+                return False
+        except LibvmiError:
+            pass
+        self.stats['process_cache_released'] += 1
+        del self.released_tasks[process.cr3]
+        self.invalidate_process(process.cr3)
+        return True
+
+    def invalidate_process(self, cr3):
+        """
+        Forget about the process using ``cr3``, for example when its address
+        space is about to be released.
+        """
+        self.tasks.pop(cr3, None)
+        self.processes.pop(cr3, None)
 
     def add_syscall_filter(self, syscall_name):
         syscall_nb = self.find_syscall_nb(syscall_name)
@@ -187,3 +425,9 @@ class LinuxBackend(Backend):
 def clean_name(name):
     matches = HANDLER_NAME_REGEX.search(name)
     return matches.group("name") if matches is not None else name
+
+def get_kernel_id(banner):
+    """Return a short identifier of the kernel build described by ``banner``"""
+    # banners are long and contain spaces, keep file names short
+    digest = hashlib.sha1(banner.encode()).hexdigest()
+    return 'linux-{}'.format(digest[:16])
@@ -9,10 +9,9 @@ class LinuxProcess(Process):
         "pid"
     )
 
-    def __init__(self, libvmi, cr3, task_struct):
-        super().__init__(libvmi, cr3)
-        pid_offset = self.libvmi.get_offset("linux_pid")
-        name_offset = self.libvmi.get_offset("linux_name")
+    def __init__(self, libvmi, cr3, task_struct, pid_offset, name_offset,
+                 page_cache=None, lock=None):
+        super().__init__(libvmi, cr3, page_cache, lock)
 
         #: Kernel task_struct for the process
         self.task_struct = task_struct
@@ -1,3 +1,30 @@
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+
+_UNSET = object()
+
+PAGE_SIZE = 0x1000
+PAGE_MASK = PAGE_SIZE - 1
+
+
+def lazy_attribute(method):
+    """
+    Turn ``method`` into a read-only property computed on first access. The
+    value is memoized in the ``_<name>`` slot of the object.
+    """
+    slot = '_' + method.__name__
+
+    @functools.wraps(method)
+    def getter(self):
+        value = getattr(self, slot, _UNSET)
+        if value is _UNSET:
+            value = method(self)
+            setattr(self, slot, value)
+        return value
+    return property(getter)
+
 
 class Process:
     """
@@ -8,11 +35,20 @@ class Process:
     __slots__ = (
         "libvmi",
         "cr3",
+        "page_cache",
+        "lock",
     )
 
-    def __init__(self, libvmi, cr3):
+    #: Fields included in the dictionary representation of the process
+    FIELDS = ('name', 'pid')
+
+    def __init__(self, libvmi, cr3, page_cache=None, lock=None):
         self.libvmi = libvmi
         self.cr3 = cr3
+        #: ``PageCache`` or ``EventPageCaches`` serving memory reads, if any
+        self.page_cache = page_cache
+        #: Lock held while accessing libvmi, hooks run concurrently
+        self.lock = lock if lock is not None else nullcontext()
 
     @property
     def pid(self):
@@ -22,16 +58,16 @@ class Process:
     def name(self):
         raise NotImplementedError("name must be overridden by a subclass")
 
-    def as_dict(self):
+    def as_dict(self, fields=None):
         """
         Returns a dictionary representing the process.
 
+        :param fields: names of the fields to include, ``FIELDS`` if None
         :rtype: dict
         """
-        return {
-            'name': self.name,
-            'pid': self.pid
-        }
+        if fields is None:
+            fields = self.FIELDS
+        return {field: getattr(self, field) for field in fields}
 
     def read_memory(self, addr, count):
         """
@@ -39,7 +75,10 @@ class Process:
         
         :raises: LibvmiError
         """
-        buffer, bytes_read = self.libvmi.read_va(addr, self.pid, count)
+        with self.lock:
+            if self.page_cache is not None:
+                return self.page_cache.read(self.libvmi, addr, self.pid, count)
+            buffer, bytes_read = self.libvmi.read_va(addr, self.pid, count)
         if bytes_read != count:
             raise RuntimeError('Fail to read memory')
         return buffer
@@ -50,4 +89,166 @@ class Process:
 
         :raises: LibvmiError
         """
-        self.libvmi.write_va(addr, self.pid, buffer)
+        with self.lock:
+            if self.page_cache is not None:
+                self.page_cache.invalidate(addr, self.pid, len(buffer))
+            self.libvmi.write_va(addr, self.pid, buffer)
+
+
+class ProcessCache:
+    """
+    Bounded cache of processes, indexed by cr3 and by pid. When the cache is
+    full, the least recently used process is evicted. Lookups, evictions and
+    invalidations are counted in ``stats``.
+    """
+
+    __slots__ = (
+        "size",
+        "by_cr3",
+        "by_pid",
+        "stats",
+    )
+
+    def __init__(self, size, stats):
+        #: Maximum number of cached processes
+        self.size = size
+        #: Processes indexed by cr3, from the least to the most recently used
+        self.by_cr3 = OrderedDict()
+        #: Processes indexed by pid
+        self.by_pid = {}
+        self.stats = stats
+
+    def __len__(self):
+        return len(self.by_cr3)
+
+    def get(self, cr3):
+        """Return the process using ``cr3``, or None if it is not cached"""
+        try:
+            process = self.by_cr3[cr3]
+        except KeyError:
+            self.stats['process_cache_miss'] += 1
+            return None
+        self.by_cr3.move_to_end(cr3)
+        self.stats['process_cache_hit'] += 1
+        return process
+
+    def get_by_pid(self, pid):
+        """Return the process identified by ``pid``, or None if it is not cached"""
+        return self.by_pid.get(pid)
+
+    def add(self, process):
+        """Cache ``process``, replacing processes using the same cr3 or pid"""
+        self.invalidate(process.cr3)
+        stale = self.by_pid.get(process.pid)
+        if stale is not None:
+            self.invalidate(stale.cr3)
+        self.by_cr3[process.cr3] = process
+        self.by_pid[process.pid] = process
+        while len(self.by_cr3) > self.size:
+            _, evicted = self.by_cr3.popitem(last=False)
+            del self.by_pid[evicted.pid]
+            self.stats['process_cache_eviction'] += 1
+
+    def invalidate(self, cr3):
+        """Forget about the process using ``cr3``"""
+        process = self.by_cr3.pop(cr3, None)
+        if process is not None:
+            del self.by_pid[process.pid]
+            self.stats['process_cache_invalidation'] += 1
+
+    def clear(self):
+        """Forget about every process"""
+        self.stats['process_cache_invalidation'] += len(self.by_cr3)
+        self.by_cr3.clear()
+        self.by_pid.clear()
+
+
+class PageCache:
+    """
+    Guest memory pages read while analyzing an event, indexed by address space
+    and page address. Overlapping and adjacent reads are served from the cache,
+    which has to be cleared before the guest runs again. Hits and misses are
+    counted in ``stats``.
+    """
+
+    __slots__ = (
+        "pages",
+        "stats",
+    )
+
+    def __init__(self, stats):
+        #: Page contents indexed by ``(pid, page address)``
+        self.pages = {}
+        self.stats = stats
+
+    def read(self, libvmi, addr, pid, count):
+        """
+        Read ``count`` bytes at ``addr`` in the address space of ``pid``,
+        using ``libvmi`` for the pages that are not cached.
+
+        :raises: LibvmiError
+        """
+        offset = addr & PAGE_MASK
+        page_addr = addr - offset
+        chunks = []
+        while page_addr < addr + count:
+            key = (pid, page_addr)
+            page = self.pages.get(key)
+            if page is None:
+                self.stats['page_cache_miss'] += 1
+                page, bytes_read = libvmi.read_va(page_addr, pid, PAGE_SIZE)
+                if bytes_read != PAGE_SIZE:
+                    raise RuntimeError('Fail to read memory')
+                self.pages[key] = page
+            else:
+                self.stats['page_cache_hit'] += 1
+            chunks.append(page)
+            page_addr += PAGE_SIZE
+        content = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        return content[offset:offset + count]
+
+    def invalidate(self, addr, pid, count):
+        """Forget about the pages overlapping ``count`` bytes at ``addr``"""
+        page_addr = addr & ~PAGE_MASK
+        while page_addr < addr + count:
+            self.pages.pop((pid, page_addr), None)
+            page_addr += PAGE_SIZE
+
+    def clear(self):
+        """Forget about every page"""
+        self.pages.clear()
+
+
+class EventPageCaches(threading.local):
+    """
+    Serve memory reads from the ``PageCache`` of the event the current thread
+    is analyzing. Processes are shared by the VCPUs, so pages are only served
+    to the hooks of the event they were read for. Reads made while no event
+    is analyzed, or once it is released, go to libvmi.
+    """
+
+    def __init__(self):
+        #: ``NitroEvent`` analyzed by the current thread
+        self.event = None
+
+    @property
+    def current(self):
+        """``PageCache`` of the event analyzed by the current thread, if any"""
+        event = self.event
+        return event.page_cache if event is not None else None
+
+    def read(self, libvmi, addr, pid, count):
+        """See :meth:`PageCache.read`"""
+        cache = self.current
+        if cache is not None:
+            return cache.read(libvmi, addr, pid, count)
+        buffer, bytes_read = libvmi.read_va(addr, pid, count)
+        if bytes_read != count:
+            raise RuntimeError('Fail to read memory')
+        return buffer
+
+    def invalidate(self, addr, pid, count):
+        """See :meth:`PageCache.invalidate`"""
+        cache = self.current
+        if cache is not None:
+            cache.invalidate(addr, pid, count)
@@ -17,25 +17,13 @@ class WindowsArgumentMap(ArgumentMap):
         ],
     }
 
-    def __getitem__(self, index):
+    def locate(self, index):
         try:
-            arg_type, opaque = self.CONVENTION[self.event.type][index]
+            convention = self.CONVENTION[self.event.type]
         except KeyError as error:
             raise RuntimeError('Unknown convention') from error
-        except IndexError:
-            arg_type, opaque = self.CONVENTION[self.event.type][-1]
-            opaque += index - len(self.CONVENTION[self.event.type]) + 1
-
-        return self.get_argument_value(arg_type, opaque)
-
-    def __setitem__(self, index, value):
         try:
-            arg_type, opaque = self.CONVENTION[self.event.type][index]
-        except KeyError as error:
-            raise RuntimeError('Unknown covention') from error
+            return convention[index]
         except IndexError:
-            arg_type, opaque = self.CONVENTION[self.event.type][-1]
-            opaque += index - len(self.CONVENTION[self.event.type]) + 1
-
-        self.set_argument_value(arg_type, opaque, value)
-        self.modified[index] = value
+            arg_type, opaque = convention[-1]
+            return arg_type, opaque + index - len(convention) + 1
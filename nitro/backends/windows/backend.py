@@ -2,22 +2,197 @@ import logging
 import re
 import stat
 import os
+import struct
 import subprocess
 import shutil
 import json
+import time
 
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 import libvirt
+from libvmi import LibvmiError
 
 from nitro.event import SyscallDirection
 from nitro.syscall import Syscall
+from nitro.backends.process import ProcessCache
 from nitro.backends.windows.process import WindowsProcess
-from nitro.backends.backend import Backend
+from nitro.backends.backend import Backend, CachePolicy
 from nitro.backends.windows.arguments import WindowsArgumentMap
+from nitro.backends import layout_cache
 
 GETSYMBOLS_SCRIPT = 'get_symbols.py'
 
+#: Default number of processes kept in the process cache
+PROCESS_CACHE_SIZE = 1024
+
+#: Pseudo handle referring to the calling process
+NT_CURRENT_PROCESS = 0xffffffffffffffff
+
+POINTER = struct.Struct('<Q')
+#: Length and address of the characters of a UNICODE_STRING
+UNICODE_STRING = struct.Struct('<H6xQ')
+
+#: Offsets of DllBase and BaseDllName in KLDR_DATA_TABLE_ENTRY
+LDR_DLL_BASE_OFFSET = 0x30
+LDR_BASE_DLL_NAME_OFFSET = 0x58
+
+#: Number of system call arguments passed in registers (rcx, rdx, r8 and r9)
+NB_REGISTER_ARGUMENTS = 4
+
+
+class EprocessIndex:
+    """
+    Snapshot of the guest's active process list, indexing ``EPROCESS``
+    addresses by ``DirectoryTableBase`` and by pid. The fields needed from
+    each ``EPROCESS`` are fetched with a single read.
+    """
+
+    __slots__ = (
+        "libvmi",
+        "stats",
+        "head",
+        "links_offset",
+        "dtb_offset",
+        "pid_offset",
+        "window_offset",
+        "window_size",
+        "by_dtb",
+        "by_pid",
+    )
+
+    def __init__(self, libvmi, symbols, stats):
+        self.libvmi = libvmi
+        self.stats = stats
+        #: Address of PsActiveProcessHead
+        self.head = self.libvmi.translate_ksym2v('PsActiveProcessHead')
+        offsets = symbols['offsets']
+        self.links_offset = offsets['EPROCESS']['ActiveProcessLinks']
+        self.dtb_offset = offsets['KPROCESS']['DirectoryTableBase']
+        self.pid_offset = offsets['EPROCESS']['UniqueProcessId']
+        # part of the EPROCESS holding the list entry (Flink and Blink),
+        # DirectoryTableBase and UniqueProcessId
+        fields = (self.links_offset, self.links_offset + POINTER.size,
+                  self.dtb_offset, self.pid_offset)
+        self.window_offset = min(fields)
+        self.window_size = max(fields) + POINTER.size - self.window_offset
+        #: ``(eprocess, pid)`` indexed by DirectoryTableBase
+        self.by_dtb = {}
+        #: ``(eprocess, DirectoryTableBase)`` indexed by pid
+        self.by_pid = {}
+
+    def read_entry(self, links):
+        """
+        Read the process whose ``ActiveProcessLinks`` are at ``links``
+
+        :returns: EPROCESS address, Flink, Blink, DirectoryTableBase and pid
+        :rtype: tuple
+        :raises RuntimeError: if the EPROCESS cannot be read entirely
+        """
+        eproc = links - self.links_offset
+        buffer, bytes_read = self.libvmi.read_va(eproc + self.window_offset, 0,
+                                                 self.window_size)
+        if bytes_read != self.window_size:
+            raise RuntimeError('Unable to read the EPROCESS at {}'.format(
+                hex(eproc)))
+
+        def field(offset):
+            return POINTER.unpack_from(buffer, offset - self.window_offset)[0]
+
+        return (eproc, field(self.links_offset),
+                field(self.links_offset + POINTER.size),
+                field(self.dtb_offset), field(self.pid_offset))
+
+    def add(self, eproc, dtb, pid):
+        # drop the entries that the new process is replacing
+        _, old_pid = self.by_dtb.get(dtb, (None, None))
+        if old_pid is not None and old_pid != pid:
+            self.by_pid.pop(old_pid, None)
+        _, old_dtb = self.by_pid.get(pid, (None, None))
+        if old_dtb is not None and old_dtb != dtb:
+            self.by_dtb.pop(old_dtb, None)
+        self.by_dtb[dtb] = (eproc, pid)
+        self.by_pid[pid] = (eproc, dtb)
+
+    def refresh(self):
+        """Rebuild the index by walking the whole process list"""
+        self.stats['eprocess_index_refresh'] += 1
+        self.clear()
+        flink = self.libvmi.read_addr_va(self.head, 0)
+        while flink != self.head:
+            eproc, flink, _, dtb, pid = self.read_entry(flink)
+            self.add(eproc, dtb, pid)
+
+    def update(self):
+        """
+        Index the processes created since the list was walked. They are
+        inserted at the tail of the list, which is walked backwards until a
+        known process is found.
+        """
+        self.stats['eprocess_index_update'] += 1
+        blink = self.libvmi.read_addr_va(self.head + POINTER.size, 0)
+        while blink != self.head:
+            eproc, _, blink, dtb, pid = self.read_entry(blink)
+            if self.by_dtb.get(dtb) == (eproc, pid):
+                break
+            self.add(eproc, dtb, pid)
+
+    def remove(self, dtb, pid):
+        """Forget about the process using ``dtb`` and identified by ``pid``"""
+        self.by_dtb.pop(dtb, None)
+        self.by_pid.pop(pid, None)
+
+    def clear(self):
+        self.by_dtb = {}
+        self.by_pid = {}
+
+    def is_current(self, eproc, dtb, pid):
+        """
+        Check that ``eproc`` still belongs to the process list and is still
+        using ``dtb`` and identified by ``pid``. The memory of a terminated
+        process might be reused, or still hold its fields once unlinked.
+        """
+        links = eproc + self.links_offset
+        try:
+            _, _, blink, current_dtb, current_pid = self.read_entry(links)
+            return ((current_dtb, current_pid) == (dtb, pid) and
+                    self.libvmi.read_addr_va(blink, 0) == links)
+        except (LibvmiError, RuntimeError):
+            return False
+
+    def lookup(self, index, key):
+        entry = getattr(self, index).get(key)
+        if entry is not None:
+            eproc, value = entry
+            dtb, pid = (key, value) if index == 'by_dtb' else (value, key)
+            if self.is_current(eproc, dtb, pid):
+                return entry
+            self.stats['eprocess_index_stale'] += 1
+            self.remove(dtb, pid)
+            entry = None
+        if entry is None:
+            self.update()
+            entry = getattr(self, index).get(key)
+            if entry is None:
+                # the process might have been replaced by an older one
+                self.refresh()
+                entry = getattr(self, index).get(key)
+        return entry
+
+    def find_by_dtb(self, dtb):
+        """
+        Return the EPROCESS address and the pid of the process using ``dtb``,
+        or None if there is no such process.
+        """
+        return self.lookup('by_dtb', dtb)
+
+    def find_by_pid(self, pid):
+        """
+        Return the EPROCESS address and the DirectoryTableBase of the process
+        identified by ``pid``, or None if there is no such process.
+        """
+        return self.lookup('by_pid', pid)
+
 
 class WindowsBackend(Backend):
     """Extract information about system calls produced by the guest. This backend
@@ -25,31 +200,288 @@ supports 66-bit Windows 7 guests."""
 
     __slots__ = (
         "nb_vcpu",
-        "syscall_stack",
         "sdt",
+        "syscall_table",
+        "syscall_names",
+        "terminate_process_nb",
+        "eprocesses",
         "tasks_offset",
         "pdbase_offset",
         "processes",
+        "suspect_processes",
         "symbols"
     )
 
-    def __init__(self, domain, libvmi, listener, syscall_filtering=True):
-        super().__init__(domain, libvmi, listener, syscall_filtering)
+    PROCESS_FIELDS = WindowsProcess.FIELDS
+
+    MEMORY_SYSCALLS = frozenset((
+        "NtAllocateVirtualMemory",
+        "NtFreeVirtualMemory",
+        "NtProtectVirtualMemory",
+        "NtMapViewOfSection",
+        "NtUnmapViewOfSection",
+        "NtUnmapViewOfSectionEx",
+        "NtAllocateUserPhysicalPages",
+        "NtFreeUserPhysicalPages",
+        "NtMapUserPhysicalPages",
+        "NtMapUserPhysicalPagesScatter",
+    ))
+
+    def __init__(self, domain, libvmi, listener, syscall_filtering=True,
+                 cache_policy=CachePolicy.always,
+                 process_cache_size=PROCESS_CACHE_SIZE, time_libvmi=False):
+        super().__init__(domain, libvmi, listener, syscall_filtering,
+                         cache_policy, time_libvmi)
         vcpus_info = self.domain.vcpus()
         self.nb_vcpu = len(vcpus_info[0])
 
-        # create on syscall stack per vcpu
-        self.syscall_stack = tuple([] for _ in range(self.nb_vcpu))
         self.sdt = None
+        self.syscall_table = None
+        self.syscall_names = None
+        #: Number of NtTerminateProcess
+        self.terminate_process_nb = None
+        self.eprocesses = None
         self.load_symbols()
 
         # get offsets
         self.tasks_offset = self.libvmi.get_offset("win_tasks")
         self.pdbase_offset = self.libvmi.get_offset("win_pdbase")
 
-        self.processes = {}
+        #: Processes seen so far, indexed by cr3 and by pid
+        self.processes = ProcessCache(process_cache_size, self.stats)
+        #: cr3 of the cached processes that might have been terminated
+        self.suspect_processes = set()
 
     def load_symbols(self):
+        # Symbols only depend on the kernel build, look for them in the cache
+        # before going through the ram dump
+        kernel_id = self.get_kernel_id()
+        symbols = None
+        if kernel_id is not None:
+            symbols = layout_cache.load_layout('windows', kernel_id)
+        extracted = symbols is None
+        if extracted:
+            symbols = self.extract_symbols()
+        # load ssdt entries
+        nt_ssdt = {'ServiceTable': {}, 'ArgumentTable': []}
+        win32k_ssdt = {'ServiceTable': {}, 'ArgumentTable': []}
+        self.sdt = [nt_ssdt, win32k_ssdt]
+        cur_ssdt = None
+        table_addrs = {}
+        for e in symbols['syscall_table']:
+            if isinstance(e, list) and e[0] == 'r':
+                if e[1]["divider"] is not None:
+                    # new table
+                    m = re.match(r'Table ([0-9]) @ (0x[0-9a-fA-F]+)?', e[1]["divider"])
+                    idx = int(m.group(1))
+                    if m.group(2) is not None:
+                        table_addrs[idx] = int(m.group(2), 16)
+                    cur_ssdt = self.sdt[idx]['ServiceTable']
+                else:
+                    entry = e[1]["entry"]
+                    full_name = e[1]["symbol"]["symbol"]
+                    # add entry  to our current ssdt
+                    cur_ssdt[entry] = full_name
+        if extracted:
+            # the tables move when the guest reboots (KASLR), only the
+            # argument counts are cached with the symbols
+            symbols = dict(symbols, argument_tables=self.read_argument_tables(
+                table_addrs))
+            if kernel_id is not None:
+                layout_cache.store_layout('windows', kernel_id, symbols)
+        argument_tables = symbols.get('argument_tables')
+        if argument_tables is None:
+            logging.warning('No system call argument counts in the cached '
+                            'symbols of %s', kernel_id)
+            argument_tables = []
+        for idx, counts in enumerate(argument_tables):
+            if counts is not None:
+                self.sdt[idx]['ArgumentTable'] = counts
+        self.syscall_table = tuple(self.build_syscall_table(idx)
+                                   for idx in range(len(self.sdt)))
+        self.syscall_names = self.build_syscall_name_map()
+        self.memory_syscall_nbs = self.find_syscall_nbs(self.MEMORY_SYSCALLS)
+        self.terminate_process_nb = self.find_syscall_nb('NtTerminateProcess')
+        # save rekall symbols
+        self.symbols = symbols
+        #: Index of the guest's processes
+        self.eprocesses = EprocessIndex(self.libvmi, symbols, self.stats)
+
+    def read_argument_tables(self, table_addrs):
+        """
+        Return the number of stack arguments of the system calls of each
+        SSDT, None for the tables that cannot be read.
+
+        :param dict table_addrs: address of the service tables, indexed by
+            SSDT
+        """
+        tables = []
+        for idx, ssdt in enumerate(self.sdt):
+            service_table = ssdt['ServiceTable']
+            counts = None
+            if service_table and idx in table_addrs:
+                counts = self.read_argument_table(table_addrs[idx],
+                                                  max(service_table) + 1)
+            tables.append(counts)
+        return tables
+
+    def read_argument_table(self, table_addr, count):
+        """
+        Return the number of stack arguments of the ``count`` system calls of
+        the service table at ``table_addr``, in system call order, or None if
+        the table cannot be read.
+        """
+        # on x64, the low 4 bits of each entry hold the number of arguments
+        # passed on the stack
+        size = count * 4
+        try:
+            buffer, bytes_read = self.libvmi.read_va(table_addr, 0, size)
+        except LibvmiError:
+            bytes_read = 0
+        if bytes_read != size:
+            # win32k's table is only mapped in the session space of GUI processes
+            logging.warning('Unable to read the service table at %s',
+                            hex(table_addr))
+            return None
+        entries = struct.unpack_from('<{}I'.format(count), buffer)
+        return [entry & 0xf for entry in entries]
+
+    def get_argument_count(self, rax):
+        """
+        Return the number of arguments of the system call ``rax``, or None if
+        it is unknown.
+        """
+        ssn = rax & 0xFFF
+        idx = (rax & 0x3000) >> 12
+        try:
+            nb_stack_args = self.sdt[idx]['ArgumentTable'][ssn]
+        except IndexError:
+            return None
+        return NB_REGISTER_ARGUMENTS + nb_stack_args
+
+    def build_syscall_table(self, idx):
+        """
+        Return ``(full_name, clean_name)`` of each entry of the SSDT ``idx``,
+        indexed by system call number.
+        """
+        service_table = self.sdt[idx]['ServiceTable']
+        table = []
+        for ssn in range(max(service_table, default=-1) + 1):
+            full_name = service_table.get(ssn, 'Table{}!Unknown'.format(idx))
+            table.append((full_name, clean_name(full_name)))
+        return tuple(table)
+
+    def build_syscall_name_map(self):
+        """
+        Map system call names to their number. Both full names and cleaned
+        names are indexed.
+        """
+        mapping = {}
+        for idx, ssdt in enumerate(self.sdt):
+            for ssn, full_name in ssdt['ServiceTable'].items():
+                syscall_nb = (idx << 12) | ssn
+                mapping.setdefault(full_name, syscall_nb)
+                mapping.setdefault(clean_name(full_name), syscall_nb)
+        return mapping
+
+    def get_kernel_id(self):
+        """
+        Identify the guest's kernel build from the PE headers of ntoskrnl and
+        of win32k, which provides the second system call table, in the same
+        way as symbol servers identify binaries: image timestamp followed by
+        image size, plus the image checksum.
+
+        :returns: kernel identity or None if a header could not be read
+        :rtype: str
+        """
+        try:
+            ntoskrnl_id = self.read_image_id(
+                self.libvmi.get_offset('win_ntoskrnl_va'), 0)
+            win32k_id = self.find_win32k_id()
+        except (LibvmiError, ValueError):
+            ntoskrnl_id = win32k_id = None
+        if ntoskrnl_id is None or win32k_id is None:
+            logging.warning('Unable to identify the kernel build')
+            return None
+        return 'ntoskrnl-{}_win32k-{}'.format(ntoskrnl_id, win32k_id)
+
+    def read_image_id(self, base, pid):
+        """
+        Identify the image loaded at ``base`` from its PE header, read in the
+        address space of ``pid``.
+
+        :returns: image identity or None if the header could not be read
+        :rtype: str
+        """
+        # IMAGE_DOS_HEADER.e_lfanew
+        pe_offset = self.libvmi.read_32(base + 0x3c, pid)
+        header, bytes_read = self.libvmi.read_va(base + pe_offset, pid, 0x60)
+        if bytes_read != 0x60:
+            return None
+        signature, timestamp = struct.unpack_from('<4s4xI', header)
+        if signature != b'PE\0\0':
+            return None
+        # IMAGE_OPTIONAL_HEADER64 follows the 0x18 bytes of signature and file header
+        size_of_image, = struct.unpack_from('<I', header, 0x18 + 0x38)
+        checksum, = struct.unpack_from('<I', header, 0x18 + 0x40)
+        return '{:08X}{:x}-{:08x}'.format(timestamp, size_of_image, checksum)
+
+    def find_win32k_id(self):
+        """
+        Identify win32k from its PE header. The driver is loaded in session
+        space, which is not mapped in the kernel's address space, so the
+        header is read in the address space of each process until one belongs
+        to a session.
+
+        :returns: image identity or None if the header could not be read
+        :rtype: str
+        """
+        base = self.find_module_base('win32k.sys')
+        if base is None:
+            return None
+        for pid in [0] + self.list_pids():
+            try:
+                image_id = self.read_image_id(base, pid)
+            except LibvmiError:
+                continue
+            if image_id is not None:
+                return image_id
+        return None
+
+    def find_module_base(self, name):
+        """
+        Return the address where the kernel module ``name`` is loaded, or
+        None if it is not in PsLoadedModuleList.
+        """
+        head = self.libvmi.translate_ksym2v('PsLoadedModuleList')
+        entry = self.libvmi.read_addr_va(head, 0)
+        while entry != head:
+            buffer, bytes_read = self.libvmi.read_va(
+                entry + LDR_BASE_DLL_NAME_OFFSET, 0, UNICODE_STRING.size)
+            if bytes_read != UNICODE_STRING.size:
+                return None
+            length, addr = UNICODE_STRING.unpack(buffer)
+            module, bytes_read = self.libvmi.read_va(addr, 0, length)
+            if (bytes_read == length and
+                    module.decode('utf-16-le', 'replace').lower() == name):
+                return self.libvmi.read_addr_va(entry + LDR_DLL_BASE_OFFSET, 0)
+            entry = self.libvmi.read_addr_va(entry, 0)
+        return None
+
+    def list_pids(self):
+        """Pids of the guest's processes, found with libvmi's offsets"""
+        head = self.libvmi.translate_ksym2v('PsActiveProcessHead')
+        tasks_offset = self.libvmi.get_offset('win_tasks')
+        pid_offset = self.libvmi.get_offset('win_pid')
+        pids = []
+        flink = self.libvmi.read_addr_va(head, 0)
+        while flink != head:
+            pids.append(self.libvmi.read_32(flink - tasks_offset + pid_offset, 0))
+            flink = self.libvmi.read_addr_va(flink, 0)
+        return pids
+
+    def extract_symbols(self):
+        """Extract symbols from a dump of the guest's memory with Rekall"""
         # we need to put the ram dump in our own directory
         # because otherwise it will be created in /tmp
         # and later owned by root
@@ -76,121 +508,160 @@ supports 66-bit Windows 7 guests."""
                 output = subprocess.check_output(symbols_process)
         logging.info('Loading symbols')
         # load output as json
-        symbols = json.loads(output.decode('utf-8'))
-        # load ssdt entries
-        nt_ssdt = {'ServiceTable': {}, 'ArgumentTable': {}}
-        win32k_ssdt = {'ServiceTable': {}, 'ArgumentTable': {}}
-        self.sdt = [nt_ssdt, win32k_ssdt]
-        cur_ssdt = None
-        for e in symbols['syscall_table']:
-            if isinstance(e, list) and e[0] == 'r':
-                if e[1]["divider"] is not None:
-                    # new table
-                    m = re.match(r'Table ([0-9]) @ .*', e[1]["divider"])
-                    idx = int(m.group(1))
-                    cur_ssdt = self.sdt[idx]['ServiceTable']
-                else:
-                    entry = e[1]["entry"]
-                    full_name = e[1]["symbol"]["symbol"]
-                    # add entry  to our current ssdt
-                    cur_ssdt[entry] = full_name
-        # save rekall symbols
-        self.symbols = symbols
+        return json.loads(output.decode('utf-8'))
 
     def process_event(self, event):
-        # invalidate libvmi cache
-        self.libvmi.v2pcache_flush()
-        self.libvmi.pidcache_flush()
-        self.libvmi.rvacache_flush()
-        self.libvmi.symcache_flush()
-        # rebuild context
-        cr3 = event.sregs.cr3
-        # 1 find process
-        process = self.associate_process(cr3)
-        # 2 find syscall
-        if event.direction == SyscallDirection.exit:
-            try:
-                syscall = self.syscall_stack[event.vcpu_nb].pop()
-                # replace register values
-                syscall.event = event
-            except IndexError:
-                # FIXME: This is ugly, names should be None
-                syscall = Syscall(event, 'Unknown', 'Unknown', process, None)
-        else:
-            syscall_name = self.get_syscall_name(event.regs.rax)
-            # build syscall
-            args = WindowsArgumentMap(event, process)
-            cleaned = clean_name(syscall_name)
-            syscall = Syscall(event, syscall_name, cleaned, process, args)
-            # push syscall to the stack to retrieve it at exit
-            self.syscall_stack[event.vcpu_nb].append(syscall)
-        # dispatch on the hooks
+        start = time.perf_counter()
+        with self.lock:
+            # rebuild context
+            cr3 = event.sregs.cr3
+            if event.direction == SyscallDirection.exit:
+                syscall = self.pop_pending_syscall(event)
+                if syscall is not None and syscall.nb in self.memory_syscall_nbs:
+                    self.address_space_changed(cr3)
+            # invalidate libvmi cache
+            self.invalidate_caches(event)
+            # the process, the names and the arguments are only resolved when
+            # a hook or the caller needs them
+            if event.direction == SyscallDirection.exit:
+                if syscall is not None:
+                    # replace register values
+                    syscall.event = event
+                    self.capture_out_arguments(syscall)
+                else:
+                    # FIXME: This is ugly, names should be None
+                    syscall = Syscall(event, 'Unknown', 'Unknown', args=None,
+                                      backend=self)
+            else:
+                syscall_nb = event.regs.rax
+                keep = self.keeps_enter_event(syscall_nb)
+                if keep:
+                    # the exit needs the enter event, copy it out of the pool
+                    event = event.copy()
+                syscall = Syscall(event, nb=syscall_nb, backend=self)
+                self.record_out_arguments(syscall)
+                # keep the syscall, or its number, to retrieve it at exit
+                self.pending_syscalls.push(self.get_thread_id(event),
+                                           syscall if keep else syscall_nb)
+                if syscall_nb in self.memory_syscall_nbs:
+                    self.address_space_changed(cr3)
+                if syscall_nb == self.terminate_process_nb:
+                    self.process_terminating(syscall)
+        # dispatch on the hooks, outside of the lock: they take it to
+        # access libvmi, so hooks of other VCPUs run meanwhile
         self.dispatch_hooks(syscall)
+        with self.lock:
+            self.syscall_latency[event.direction, syscall.nb].record(
+                time.perf_counter() - start)
         return syscall
 
-    def define_hook(self, name, callback, direction=SyscallDirection.enter):
-        super().define_hook(name, callback, direction)
-        if self.syscall_filtering:
-            self.add_syscall_filter(name)
+    def build_arguments(self, event, process, syscall_nb):
+        return WindowsArgumentMap(event, process,
+                                  self.get_argument_count(syscall_nb))
 
-    def undefine_hook(self, name, direction=SyscallDirection.enter):
-        super().undefine_hook(name, direction)
-        if self.syscall_filtering:
-            self.remove_syscall_filter(name)
+    def required_syscall_nbs(self):
+        nbs = super().required_syscall_nbs()
+        if self.terminate_process_nb is not None:
+            # the process caches are invalidated on termination
+            nbs |= {self.terminate_process_nb}
+        return nbs
 
     def find_syscall_nb(self, syscall_name):
-        for ssdt in self.sdt:
-            for syscall_nb, full_name in ssdt['ServiceTable'].items():
-                if re.match(r'^.*{}$'.format(syscall_name), full_name):
-                    return syscall_nb
+        try:
+            return self.syscall_names[syscall_name]
+        except KeyError:
+            pass
+        # partial names are matched against the end of the full names
+        for full_name, syscall_nb in self.syscall_names.items():
+            if full_name.endswith(syscall_name):
+                return syscall_nb
         return None
 
     def associate_process(self, cr3):
-        if cr3 in self.processes:
-            p = self.processes[cr3]
-        else:
+        p = self.check_process(self.processes.get(cr3))
+        if p is None:
             p = self.find_eprocess(cr3)
             # index by cr3 or pid
             # a callback might want to search by pid
-            self.processes[cr3] = p
-            self.processes[p.pid] = p
+            self.processes.add(p)
         return p
 
+    def get_process_by_pid(self, pid):
+        """
+        Return the process identified by ``pid``, or None if there is no such
+        process.
+
+        :rtype: WindowsProcess
+        """
+        with self.lock:
+            p = self.check_process(self.processes.get_by_pid(pid))
+            if p is None:
+                entry = self.eprocesses.find_by_pid(pid)
+                if entry is None:
+                    return None
+                eproc, cr3 = entry
+                p = WindowsProcess(self.libvmi, cr3, eproc, self.symbols,
+                                   pid, self.lock, self.page_cache)
+                self.processes.add(p)
+            return p
+
+    def process_terminating(self, syscall):
+        """
+        Forget about the processes terminated by the ``NtTerminateProcess``
+        ``syscall``, their page directory and pid might be reused.
+        """
+        handle = syscall.args[0]
+        if handle == NT_CURRENT_PROCESS:
+            process = syscall.process
+            self.processes.invalidate(process.cr3)
+            self.suspect_processes.discard(process.cr3)
+            self.eprocesses.remove(process.cr3, process.pid)
+        elif handle != 0:
+            # 0 terminates the other threads of the caller, any other handle
+            # refers to a process that cannot be told without the handle
+            # table: the cached processes are checked again when next used,
+            # the entries of the index always are
+            self.suspect_processes.update(self.processes.by_cr3)
+
+    def check_process(self, process):
+        """
+        Return the cached ``process``, or None if it has been terminated since
+        it was cached, see :meth:`process_terminating`.
+        """
+        if process is None or process.cr3 not in self.suspect_processes:
+            return process
+        self.suspect_processes.discard(process.cr3)
+        if self.eprocesses.is_current(process.eproc, process.cr3, process.pid):
+            return process
+        self.stats['process_cache_stale'] += 1
+        self.processes.invalidate(process.cr3)
+        return None
+
     def find_eprocess(self, cr3):
-        # read PsActiveProcessHead list_entry
-        ps_head = self.libvmi.translate_ksym2v('PsActiveProcessHead')
-        flink = self.libvmi.read_addr_ksym('PsActiveProcessHead')
-
-        while flink != ps_head:
-            # get start of EProcess
-            start_eproc = flink - self.symbols['offsets']['EPROCESS'][
-                'ActiveProcessLinks']
-            # move to start of DirectoryTableBase
-            directory_table_base_off = start_eproc + \
-                                       self.symbols['offsets']['KPROCESS'][
-                                           'DirectoryTableBase']
-            # read directory_table_base
-            directory_table_base = self.libvmi.read_addr_va(
-                directory_table_base_off, 0)
-            # compare to our cr3
-            if cr3 == directory_table_base:
-                return WindowsProcess(self.libvmi, cr3, start_eproc,
-                                      self.symbols)
-            # read new flink
-            flink = self.libvmi.read_addr_va(flink, 0)
+        entry = self.eprocesses.find_by_dtb(cr3)
+        if entry is not None:
+            eproc, pid = entry
+            return WindowsProcess(self.libvmi, cr3, eproc, self.symbols, pid,
+                                  self.lock, self.page_cache)
         raise RuntimeError('Process not found')
 
-    def get_syscall_name(self, rax):
+    def resolve_syscall(self, rax):
+        """
+        Return the full name and the cleaned name of the system call
+        associated with ``rax``.
+        """
         ssn = rax & 0xFFF
         idx = (rax & 0x3000) >> 12
         try:
-            syscall_name = self.sdt[idx]['ServiceTable'][ssn]
-        except (KeyError, IndexError):
+            return self.syscall_table[idx][ssn]
+        except IndexError:
             # this code should not be reached,
             # because there is only 2 SSDT's defined in Windows (Nt and Win32k)
             # the 2 others are NULL
-            syscall_name = 'Table{}!Unknown'.format(idx)
-        return syscall_name
+            return 'Table{}!Unknown'.format(idx), 'Unknown'
+
+    def get_syscall_name(self, rax):
+        return self.resolve_syscall(rax)[0]
 
     def add_syscall_filter(self, syscall_name):
         syscall_nb = self.find_syscall_nb(syscall_name)
@@ -1,72 +1,98 @@
 import datetime
-from nitro.backends.process import Process
+from nitro.backends.process import Process, lazy_attribute
 from nitro.backends.windows.types import PEB, UnicodeString, LargeInteger
 
 WINDOWS_TICK = 10000000
 SEC_TO_UNIX_EPOCH = 11644473600
 
 class WindowsProcess(Process):
+    """
+    Class representing a Windows process. Its attributes are read from the
+    guest's memory the first time they are accessed.
+    """
 
     __slots__ = (
         "eproc",
-        "name",
-        "pid",
-        "iswow64",
-        "create_time",
-        "path",
-        "command_line",
-        "parent_pid",
-        "symbols"
+        "symbols",
+        "_name",
+        "_pid",
+        "_iswow64",
+        "_create_time",
+        "_path",
+        "_command_line",
+        "_parent_pid",
     )
 
-    def __init__(self, libvmi, cr3, eproc, symbols):
-        super().__init__(libvmi, cr3)
+    FIELDS = (
+        'name',
+        'pid',
+        'parent_pid',
+        'command_line',
+        'iswow64',
+        'path',
+        'create_time',
+    )
+
+    def __init__(self, libvmi, cr3, eproc, symbols, pid=None, lock=None,
+                 page_cache=None):
+        """
+        :param int pid: pid of the process, if it is already known
+        :param lock: lock held while reading the attributes, to serialize
+            access to libvmi
+        :param PageCache page_cache: cache serving memory reads
+        """
+        super().__init__(libvmi, cr3, page_cache, lock)
         self.eproc = eproc
         self.symbols = symbols
+        if pid is not None:
+            self._pid = pid
+
+    def read_field(self, read, name):
+        """Read the EPROCESS field ``name`` with ``read``"""
+        offset = self.symbols['offsets']['EPROCESS'][name]
+        with self.lock:
+            return read(self.eproc + offset, 0)
+
+    @lazy_attribute
+    def name(self):
+        return self.read_field(self.libvmi.read_str_va, 'ImageFileName')
+
+    @lazy_attribute
+    def pid(self):
+        return self.read_field(self.libvmi.read_addr_va, 'UniqueProcessId')
+
+    @lazy_attribute
+    def command_line(self):
+        peb_addr = self.read_field(self.libvmi.read_addr_va, 'Peb')
+        with self.lock:
+            peb = PEB(peb_addr, self)
+            return peb.ProcessParameters.CommandLine.Buffer
 
-        # get name
-        image_file_name_off = self.symbols['offsets']['EPROCESS']['ImageFileName']
-        image_file_name_addr = self.eproc + image_file_name_off
-        self.name = self.libvmi.read_str_va(image_file_name_addr, 0)
-        # get pid
-        unique_processid_off = self.symbols['offsets']['EPROCESS']['UniqueProcessId']
-        unique_processid_addr = self.eproc + unique_processid_off
-        self.pid = self.libvmi.read_addr_va(unique_processid_addr, 0)
-        # get command line
-        peb_off = self.symbols['offsets']['EPROCESS']['Peb']
-        peb_addr = self.libvmi.read_addr_va(self.eproc + peb_off, 0)
-        peb = PEB(peb_addr, self)
-        self.command_line = peb.ProcessParameters.CommandLine.Buffer
-        # get full path
-        seauditprocess_off = self.symbols['offsets']['EPROCESS']['SeAuditProcessCreationInfo']
-        seauditprocesscreationinfo_offs = self.eproc + seauditprocess_off
+    @lazy_attribute
+    def path(self):
+        sapci = self.read_field(self.libvmi.read_addr_va,
+                                'SeAuditProcessCreationInfo')
+        with self.lock:
+            fullpath = UnicodeString(sapci, self)
+            return fullpath.Buffer
 
-        sapci = self.libvmi.read_addr_va(seauditprocesscreationinfo_offs, 0)
-        fullpath = UnicodeString(sapci, self)
-        self.path = fullpath.Buffer
-        # get create time
+    @lazy_attribute
+    def create_time(self):
         create_time_addr = self.eproc + self.symbols['offsets']['EPROCESS']['CreateTime']
-        ct = LargeInteger(create_time_addr, self)
+        with self.lock:
+            ct = LargeInteger(create_time_addr, self)
         # Converts Windows 64-bit time to UNIX time, the below code has been taken from Volatility
         ct = ct.QuadPart / WINDOWS_TICK
         ct = ct - SEC_TO_UNIX_EPOCH
-        self.create_time = datetime.datetime.fromtimestamp(ct)\
+        return datetime.datetime.fromtimestamp(ct)\
             .strftime("%Y-%m-%d %H:%M:%S")
-        # get parent PID
-        parent_pid_off = self.symbols['offsets']['EPROCESS']['InheritedFromUniqueProcessId']
-        parent_pid_addr = self.eproc + parent_pid_off
 
-        ppid = self.libvmi.read_addr_va(parent_pid_addr, 0)
-        self.parent_pid = ppid
-        # get iswow64, if value is non-zero then iswow64 is true
-        wow64_off = self.symbols['offsets']['EPROCESS']['Wow64Process']
-        self.iswow64 = self.libvmi.read_addr_va(self.eproc + wow64_off, 0) != 0
+    @lazy_attribute
+    def parent_pid(self):
+        return self.read_field(self.libvmi.read_addr_va,
+                               'InheritedFromUniqueProcessId')
 
-    def as_dict(self):
-        parent = super().as_dict()
-        parent["parent_pid"] = self.parent_pid
-        parent["command_line"] = self.command_line
-        parent["iswow64"] = self.iswow64
-        parent["path"] = self.path
-        parent["create_time"] = self.create_time
-        return parent
+    @lazy_attribute
+    def iswow64(self):
+        # if value is non-zero then iswow64 is true
+        return self.read_field(self.libvmi.read_addr_va, 'Wow64Process') != 0
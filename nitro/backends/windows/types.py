@@ -6,23 +6,73 @@ class InconsistentMemoryError(Exception):
 
 
 class WinStruct(object):
+    """
+    Base class for Windows structures read from a process' memory.
+
+    ``_fields_`` lists the ``(offset, name, format)`` of the fields, where
+    ``format`` is either a ``struct`` format or a nested ``WinStruct``. When a
+    subclass is defined, its fields are compiled into a single ``struct.Struct``
+    so that the whole structure, including its nested structures, is fetched
+    with one read and decoded with one unpack.
+    """
+
     _fields_ = []
 
-    def __init__(self, addr, process):
-        # logging.debug('Building %s from %s', self.__class__.__name__, hex(addr))
-        for f_offset, f_name, f_format in self._fields_:
-            if isinstance(f_format, str):
-                # logging.debug('Field {}, {}, at {} + {}'
-                #               .format(f_name, f_format, hex(addr), hex(f_offset)))
-                f_size = struct.calcsize(f_format)
-                content = process.read_memory(addr + f_offset, f_size)
-                f_value, *rest = struct.unpack(f_format, content)
-                # logging.debug('Value: {}'.format(hex(f_value)))
-            else:
-                # our struct
-                # f_format is a class
-                f_value = f_format(addr + f_offset, process)
-            setattr(self, f_name, f_value)
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile()
+
+    @classmethod
+    def _compile(cls):
+        scalars = sorted((offset, name, fmt.replace('P', 'Q'))
+                         for offset, name, fmt in cls._fields_
+                         if isinstance(fmt, str))
+        nested = [(offset, name, fmt) for offset, name, fmt in cls._fields_
+                  if not isinstance(fmt, str)]
+        start = min((offset for offset, _, _ in cls._fields_), default=0)
+        end = start
+        layout = '<'
+        #: names of the fields decoded by _struct_, in order
+        cls._names_ = []
+        #: fields overlapping others, decoded on their own
+        cls._overlapping_ = []
+        for offset, name, fmt in scalars:
+            if offset < end:
+                cls._overlapping_.append(
+                    (offset - start, name, struct.Struct('<' + fmt)))
+                continue
+            layout += 'x' * (offset - end) + fmt
+            cls._names_.append(name)
+            end = offset + struct.calcsize('<' + fmt)
+        cls._struct_ = struct.Struct(layout)
+        for offset, name, field in cls._overlapping_:
+            end = max(end, start + offset + field.size)
+        for offset, name, field in nested:
+            end = max(end, offset + field._offset_ + field._size_)
+        cls._nested_ = [(offset - start, name, field)
+                        for offset, name, field in nested]
+        #: offset of the first field
+        cls._offset_ = start
+        #: number of bytes from the first field to the end of the last one
+        cls._size_ = end - start
+
+    def __init__(self, addr, process, buffer=None):
+        """
+        :param int addr: address of the structure
+        :param Process process: process whose memory contains the structure
+        :param buffer: content of the structure, read from ``process`` if None
+        """
+        if buffer is None:
+            buffer = process.read_memory(addr + self._offset_, self._size_)
+        for name, value in zip(self._names_, self._struct_.unpack_from(buffer)):
+            setattr(self, name, value)
+        for offset, name, field in self._overlapping_:
+            setattr(self, name, field.unpack_from(buffer, offset)[0])
+        for offset, name, field in self._nested_:
+            # nested structures are decoded from the same buffer
+            start = offset + field._offset_
+            setattr(self, name, field(addr + offset + self._offset_, process,
+                                      buffer[start:start + field._size_]))
 
 
 class ObjectAttributes(WinStruct):
@@ -38,8 +88,8 @@ class ObjectAttributes(WinStruct):
         (0x10, 'ObjectName', 'P'),
     ]
 
-    def __init__(self, addr, process):
-        super().__init__(addr, process)
+    def __init__(self, addr, process, buffer=None):
+        super().__init__(addr, process, buffer)
         if self.Length != 0x30:
             # memory inconsistent
             raise InconsistentMemoryError()
@@ -57,8 +107,8 @@ class ClientID(WinStruct):
         (8, 'UniqueThread', 'P'),
     ]
 
-    def __init__(self, addr, process):
-        super().__init__(addr, process)
+    def __init__(self, addr, process, buffer=None):
+        super().__init__(addr, process, buffer)
 
 
 class LargeInteger(WinStruct):
@@ -74,8 +124,8 @@ class LargeInteger(WinStruct):
         (0, 'QuadPart', 'q')
     ]
 
-    def __init__(self, addr, process):
-        super().__init__(addr, process)
+    def __init__(self, addr, process, buffer=None):
+        super().__init__(addr, process, buffer)
 
 
 class UnicodeString(WinStruct):
@@ -91,8 +141,8 @@ class UnicodeString(WinStruct):
         (0x8, 'Buffer', 'P'),
     ]
 
-    def __init__(self, addr, process):
-        super().__init__(addr, process)
+    def __init__(self, addr, process, buffer=None):
+        super().__init__(addr, process, buffer)
         buffer = process.read_memory(self.Buffer, self.Length)
         try:
             string = buffer.decode('utf-16-le')
@@ -110,8 +160,8 @@ class PEB(WinStruct):
         (0x20, 'ProcessParameters', 'P')
     ]
 
-    def __init__(self, addr, process):
-        super().__init__(addr, process)
+    def __init__(self, addr, process, buffer=None):
+        super().__init__(addr, process, buffer)
         self.ProcessParameters = RtlUserProcessParameters(
             self.ProcessParameters, process)
 
@@ -127,8 +177,8 @@ class RtlUserProcessParameters(WinStruct):
         (0x70, 'CommandLine', UnicodeString)
     ]
 
-    def __init__(self, addr, process):
-        super().__init__(addr, process)
+    def __init__(self, addr, process, buffer=None):
+        super().__init__(addr, process, buffer)
 
 
 class AccessMask:
@@ -186,8 +236,8 @@ class FileRenameInformation(WinStruct):
 
     ]
 
-    def __init__(self, addr, process):
-        super().__init__(addr, process)
+    def __init__(self, addr, process, buffer=None):
+        super().__init__(addr, process, buffer)
         buffer = process.read_memory(addr + 0x14, self.FileNameLength)
         try:
             string = buffer.decode('utf-16-le')
@@ -205,8 +255,8 @@ class FileDispositionInformation(WinStruct):
         (0, 'DeleteFile', "B")
     ]
 
-    def __init__(self, addr, process):
-        super().__init__(addr, process)
+    def __init__(self, addr, process, buffer=None):
+        super().__init__(addr, process, buffer)
 
 
 class FileBasicInformation(WinStruct):
@@ -227,5 +277,5 @@ class FileBasicInformation(WinStruct):
 
     ]
 
-    def __init__(self, addr, process):
-        super().__init__(addr, process)
+    def __init__(self, addr, process, buffer=None):
+        super().__init__(addr, process, buffer)
@@ -1,6 +1,9 @@
 import datetime
+import time
 from enum import Enum
 
+from nitro.kvm import NitroEventStr
+
 
 class SyscallDirection(Enum):
     """System call direction"""
@@ -14,36 +17,119 @@ class SyscallType(Enum):
     syscall = 1
 
 
+#: Directions indexed by their raw value
+DIRECTIONS = tuple(SyscallDirection)
+#: System call mechanisms indexed by their raw value
+TYPES = tuple(SyscallType)
+
+
 class NitroEvent:
     """
     ``NitroEvent`` represents a low-level system event. It contains information
     about the state of the machine when the system was stopped.
+
+    Events are created for every trap, so only the raw values are stored when
+    the event is received. Enumerations, register views and the textual time
+    are built when they are first accessed.
     """
 
     __slots__ = (
-        'direction',
-        'type',
-        'regs',
-        'sregs',
+        'raw',
+        'raw_direction',
+        'raw_type',
         'vcpu_nb',
         'vcpu_io',
-        'time',
+        'timestamp',
+        'pooled',
+        'page_cache',
+        '_regs',
+        '_sregs',
     )
 
     def __init__(self, nitro_event_str, vcpu_io):
-        #: Event direction. Are we entering or exiting a system call
-        self.direction = SyscallDirection(nitro_event_str.direction)
-        #: System call mechanism used
-        self.type = SyscallType(nitro_event_str.type)
-        #: Register state
-        self.regs = nitro_event_str.regs
-        #: Special register state
-        self.sregs = nitro_event_str.sregs
+        #: Raw event structure received from KVM
+        self.raw = nitro_event_str
+        #: Raw event direction
+        self.raw_direction = nitro_event_str.direction
+        #: Raw system call mechanism
+        self.raw_type = nitro_event_str.type
         #: Handle to the VCPU where the event originated
         self.vcpu_io = vcpu_io
         #: VCPU number
-        self.vcpu_nb = self.vcpu_io.vcpu_nb
-        self.time = datetime.datetime.now().isoformat()
+        self.vcpu_nb = vcpu_io.vcpu_nb
+        #: Time when the event was received, in nanoseconds since the epoch
+        self.timestamp = time.time_ns()
+        #: Is the raw structure a VCPU buffer that must be released
+        self.pooled = True
+        #: Guest pages read while analyzing the event, set by the backend
+        self.page_cache = None
+        self._regs = None
+        self._sregs = None
+
+    @property
+    def direction(self):
+        """Event direction. Are we entering or exiting a system call"""
+        return DIRECTIONS[self.raw_direction]
+
+    @property
+    def type(self):
+        """System call mechanism used"""
+        return TYPES[self.raw_type]
+
+    @property
+    def regs(self):
+        """Register state"""
+        if self._regs is None:
+            self._regs = self.raw.regs
+        return self._regs
+
+    @regs.setter
+    def regs(self, regs):
+        self._regs = regs
+
+    @property
+    def sregs(self):
+        """Special register state"""
+        if self._sregs is None:
+            self._sregs = self.raw.sregs
+        return self._sregs
+
+    @property
+    def time(self):
+        """Time when the event was received, in ISO 8601 format"""
+        return datetime.datetime.fromtimestamp(self.timestamp / 1e9).isoformat()
+
+    def release(self):
+        """
+        Give the underlying event buffer back to the VCPU for reuse. The
+        register state of a released event must not be accessed anymore, use
+        ``copy`` to keep an event around. The pages read for the event are
+        dropped as well, the guest has been resumed.
+        """
+        if self.page_cache is not None:
+            self.page_cache.clear()
+            self.page_cache = None
+        if self.pooled:
+            self.vcpu_io.release_event(self.raw)
+            self.pooled = False
+
+    def copy(self):
+        """
+        Return a copy of the event that stays valid after this event is
+        released.
+
+        :rtype: NitroEvent
+        """
+        nitro_event_str = NitroEventStr()
+        nitro_event_str.direction = self.raw_direction
+        nitro_event_str.type = self.raw_type
+        nitro_event_str.regs = self.regs
+        nitro_event_str.sregs = self.sregs
+        event = NitroEvent(nitro_event_str, self.vcpu_io)
+        event.timestamp = self.timestamp
+        # the copy owns its buffer
+        event.pooled = False
+        return event
 
     def __str__(self):
         type_msg = self.type.name.upper()
@@ -76,14 +162,15 @@ class NitroEvent:
             return value
 
     def update_register(self, register, value):
-        """Change individual register's values"""
-        # get latest regs, to avoid replacing EIP by value before emulation
-        self.regs = self.vcpu_io.get_regs()
+        """
+        Change individual register's values. Changes are cached by the VCPU
+        and sent to KVM right before it is resumed.
+        """
+        regs = self.vcpu_io.modify_regs()
         # update register if possible
         try:
-            setattr(self.regs, register, value)
+            setattr(regs, register, value)
         except AttributeError:
             raise RuntimeError('Unknown register')
         else:
-            # send new register to KVM VCPU
-            self.vcpu_io.set_regs(self.regs)
+            self.regs = regs
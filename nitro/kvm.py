@@ -4,12 +4,18 @@ Nitro's enhanced KVM capabilities.
 """
 
 import os
+import time
 import logging
+from collections import deque, defaultdict
 from ctypes import *
 from ioctl_opt import IO, IOR, IOW
 
+from nitro.metrics import LatencyHistogram
+
 KVMIO = 0xAE
 NITRO_MAX_VCPUS = 64
+#: Number of event buffers preallocated for each VCPU
+NITRO_EVENT_BUFFERS = 4
 
 
 class DTable(Structure):
@@ -148,6 +154,7 @@ class KVM(IOCTL):
         Attach to KVM virtual machine
         
         :param int pid: pid of the Qemu process to attach to.
+        :rtype: VM
         :raises: RuntimeError
         """
         logging.debug('attach_vm PID = %s', pid)
@@ -156,7 +163,7 @@ class KVM(IOCTL):
         if r < 0:
             # invalid vm fd
             raise RuntimeError('Error: fail to attach to the VM')
-        return r
+        return VM(r)
 
 
 class VM(IOCTL):
@@ -228,11 +235,54 @@ class VM(IOCTL):
         return r
 
 
-class VCPU(IOCTL):
+class RegisterCache:
+    """
+    Batch the register changes made while a VCPU is paused, see
+    :meth:`modify_regs`. Shared by :class:`VCPU` and the simulated VCPU.
+
+    Classes using it provide ``vcpu_nb``, ``paused_since``, ``dirty_regs``
+    and ``stats`` along with ``get_regs`` and ``set_regs``.
+    """
+
+    __slots__ = ()
+
+    def modify_regs(self):
+        """
+        Get the registers to modify while the VCPU is paused.
+
+        Registers are retrieved on the first modification and written back
+        with a single ``set_regs`` when the VCPU is resumed, so any number of
+        changes costs two requests.
+
+        :rtype: Regs
+        """
+        if self.paused_since is None:
+            raise RuntimeError('VCPU {} is not paused'.format(self.vcpu_nb))
+        if self.dirty_regs is None:
+            # get latest regs, to avoid replacing EIP by value before emulation
+            self.dirty_regs = self.get_regs()
+        else:
+            self.stats['regs_ioctls_saved'] += 2
+        return self.dirty_regs
+
+    def flush_regs(self):
+        """Write the registers modified through ``modify_regs`` back"""
+        if self.dirty_regs is not None:
+            regs = self.dirty_regs
+            self.dirty_regs = None
+            return self.set_regs(regs)
+
+
+class VCPU(IOCTL, RegisterCache):
     """Class that allows controlling and inspecting the state of an individual virtual CPU."""
 
     __slots__ = (
         'vcpu_nb',
+        'event_buffers',
+        'dirty_regs',
+        'stats',
+        'paused_since',
+        'pause_latency',
     )
 
     #: Request for retrieving event
@@ -252,24 +302,57 @@ class VCPU(IOCTL):
         super().__init__()
         self.vcpu_nb = vcpu_nb
         self.fd = vcpu_fd
+        #: Free event buffers, recycled through ``release_event``
+        self.event_buffers = deque(NitroEventStr() for _ in
+                                   range(NITRO_EVENT_BUFFERS))
+        #: Modified registers waiting to be written back
+        self.dirty_regs = None
+        #: Statistics about the VCPU
+        self.stats = defaultdict(int)
+        self.paused_since = None
+        #: Time spent paused, from ``get_event`` to ``continue_vm``
+        self.pause_latency = LatencyHistogram()
 
     def get_event(self):
         """
         Retrieve event from the virtual machine
 
+        The returned buffer belongs to the VCPU's buffer pool and has to be
+        given back with ``release_event`` once it is no longer used.
+
         :rtype: NitroEventStr
         """
         # logging.debug('get_event %s, self.vcpu_nb)
-        nitro_ev = NitroEventStr()
+        try:
+            nitro_ev = self.event_buffers.pop()
+        except IndexError:
+            # every buffer is still in use
+            nitro_ev = NitroEventStr()
         ret = self.make_ioctl(self.KVM_NITRO_GET_EVENT, byref(nitro_ev))
         if ret != 0:
-            raise ValueError("get_event failed on vcpu %d (%d)".format(self.vcpu_nb, ret))
+            self.event_buffers.append(nitro_ev)
+            raise ValueError("get_event failed on vcpu {} ({})".format(self.vcpu_nb, ret))
+        self.paused_since = time.perf_counter()
         return nitro_ev
 
+    def release_event(self, nitro_ev):
+        """
+        Give an event buffer back to the VCPU so that it can be reused.
+
+        :param NitroEventStr nitro_ev: buffer returned by ``get_event``
+        """
+        if len(self.event_buffers) < NITRO_EVENT_BUFFERS:
+            self.event_buffers.append(nitro_ev)
+
     def continue_vm(self):
         """Continue virtual machine execution"""
         # logging.debug('continue_vm %s', self.vcpu_nb)
-        return self.make_ioctl(self.KVM_NITRO_CONTINUE, 0)
+        self.flush_regs()
+        ret = self.make_ioctl(self.KVM_NITRO_CONTINUE, 0)
+        if self.paused_since is not None:
+            self.pause_latency.record(time.perf_counter() - self.paused_since)
+            self.paused_since = None
+        return ret
 
     def get_regs(self):
         """
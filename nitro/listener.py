@@ -5,11 +5,13 @@ import psutil
 import logging
 import time
 import threading
+from contextlib import contextmanager
 from queue import Queue, Empty
 from concurrent.futures import ThreadPoolExecutor, wait
 
 from nitro.event import NitroEvent
-from nitro.kvm import KVM, VM
+from nitro.kvm import KVM
+from nitro.metrics import LatencyHistogram
 
 class QEMUNotFoundError(Exception):
     pass
@@ -37,6 +39,36 @@ def find_qemu_pid(vm_name):
         logging.critical('Cannot find QEMU')
         raise QEMUNotFoundError('Cannot find QEMU')
 
+class Configuration:
+    """
+    Pending changes to the system call trap and filters of a virtual machine,
+    see :meth:`Listener.configure`.
+    """
+
+    __slots__ = (
+        'traps',
+        'syscall_filters',
+        'actions',
+    )
+
+    def __init__(self, syscall_filters):
+        #: Should system calls be trapped, None to keep the current setting
+        self.traps = None
+        #: System calls that are filtered once the configuration is applied
+        self.syscall_filters = set(syscall_filters)
+        #: Callables to run while the domain is suspended
+        self.actions = []
+
+    def set_traps(self, enabled):
+        self.traps = enabled
+
+    def add_syscall_filter(self, syscall_nb):
+        self.syscall_filters.add(syscall_nb)
+
+    def remove_syscall_filter(self, syscall_nb):
+        self.syscall_filters.discard(syscall_nb)
+
+
 class Listener:
     """
     Class for listening to events from a virtual machine.
@@ -52,18 +84,25 @@ class Listener:
         'futures',
         'queue',
         'current_cont_event',
+        'configuration',
+        'queue_wait',
     )
 
-    def __init__(self, domain):
+    def __init__(self, domain, kvm_io=None, pid=None):
+        """
+        :param domain: libvirt domain to listen to
+        :param kvm_io: KVM interface to use instead of ``/dev/kvm``, such as
+            :class:`~.SimulatedKVM`
+        :param int pid: pid of the QEMU instance, looked up if not specified
+        """
         #: Libvirt domain that the Listener is monitoring
         self.domain = domain
         #: Pid of the QEMU instance that is being monitored
-        self.pid = find_qemu_pid(domain.name())
+        self.pid = pid if pid is not None else find_qemu_pid(domain.name())
         # init KVM
-        self.kvm_io = KVM()
-        # get VM fd
-        vm_fd = self.kvm_io.attach_vm(self.pid)
-        self.vm_io = VM(vm_fd)
+        self.kvm_io = kvm_io if kvm_io is not None else KVM()
+        # get VM
+        self.vm_io = self.kvm_io.attach_vm(self.pid)
         # get VCPU fds
         self.vcpus_io = self.vm_io.attach_vcpus()
         logging.info('Detected %s VCPUs', len(self.vcpus_io))
@@ -71,12 +110,70 @@ class Listener:
         self.futures = None
         self.queue = None
         self.current_cont_event = None
+        #: Configuration in progress, see :meth:`configure`
+        self.configuration = None
+        #: Time events wait in the queue of :meth:`listen` before being
+        #: consumed, including the time waiting for the queue to have room
+        self.queue_wait = LatencyHistogram()
 
-    def set_traps(self, enabled):
-        if self.domain.isActive():
+    @contextmanager
+    def suspended(self):
+        """Keep the domain suspended, if it is running, for the duration of the block"""
+        active = self.domain.isActive()
+        if active:
             self.domain.suspend()
-            self.vm_io.set_syscall_trap(enabled)
-            self.domain.resume()
+        try:
+            yield
+        finally:
+            if active:
+                self.domain.resume()
+
+    @contextmanager
+    def configure(self):
+        """
+        Batch changes to the system call trap and filters. Changes made
+        through the listener, or the yielded :class:`Configuration`, are
+        applied when the block exits, while the domain is suspended once.
+        Nothing is applied if the block raises an exception. Nested blocks
+        are part of the outermost one.
+        """
+        if self.configuration is not None:
+            yield self.configuration
+            return
+        config = Configuration(self.vm_io.syscall_filters)
+        self.configuration = config
+        try:
+            yield config
+        finally:
+            self.configuration = None
+        self.apply_configuration(config)
+
+    def apply_configuration(self, config):
+        """Apply the difference between ``config`` and the current configuration"""
+        current = self.vm_io.syscall_filters
+        removed = sorted(current - config.syscall_filters)
+        added = sorted(config.syscall_filters - current)
+        # the trap cannot be set on a domain that is not running
+        traps = config.traps if self.domain.isActive() else None
+        if not (removed or added or config.actions or traps is not None):
+            return
+        with self.suspended():
+            # stop trapping before the filters are changed, start after, so
+            # that events are never produced by a partial configuration
+            if traps is False:
+                self.vm_io.set_syscall_trap(False)
+            for syscall_nb in removed:
+                self.vm_io.remove_syscall_filter(syscall_nb)
+            for syscall_nb in added:
+                self.vm_io.add_syscall_filter(syscall_nb)
+            for action in config.actions:
+                action()
+            if traps:
+                self.vm_io.set_syscall_trap(True)
+
+    def set_traps(self, enabled):
+        with self.configure() as config:
+            config.set_traps(enabled)
 
     def __enter__(self):
         return self
@@ -94,7 +191,12 @@ class Listener:
         self.kvm_io.close()
 
     def listen(self):
-        """Generator yielding NitroEvents from the virtual machine"""
+        """
+        Generator yielding NitroEvents from the virtual machine
+
+        Events are released once the consumer asks for the next one, use
+        ``NitroEvent.copy`` to keep an event around.
+        """
         self.stop_request = threading.Event()
         pool = ThreadPoolExecutor(max_workers=len(self.vcpus_io))
         self.futures = []
@@ -108,12 +210,13 @@ class Listener:
         # while a thread is still running
         while [f for f in self.futures if f.running()]:
             try:
-                (event, continue_event) = self.queue.get(timeout=1)
+                (event, continue_event, queued) = self.queue.get(timeout=1)
             except Empty:
                 # domain has crashed or is shutdown ?
                 if not self.domain.isActive():
                     self.stop_request.set()
             else:
+                self.queue_wait.record(time.perf_counter() - queued)
                 if not self.stop_request.is_set():
                     yield event
                 continue_event.set()
@@ -124,6 +227,39 @@ class Listener:
                 raise f.exception()
         logging.info('Stop Nitro listening')
 
+    def listen_parallel(self, callback):
+        """
+        Process events from all the VCPUs concurrently.
+
+        Instead of funneling every event through a single consumer, each VCPU
+        thread calls ``callback`` with its ``NitroEvent`` and resumes its VCPU
+        as soon as the callback returns, releasing the event. Events coming
+        from different VCPUs are therefore analyzed in parallel, and
+        ``callback`` has to be thread-safe. This method blocks until the
+        listener is stopped.
+
+        :param callable callback: called with every ``NitroEvent``
+        """
+        self.stop_request = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=len(self.vcpus_io))
+        self.futures = []
+        for vcpu_io in self.vcpus_io:
+            f = pool.submit(self.process_vcpu, vcpu_io, callback)
+            self.futures.append(f)
+
+        # while a thread is still running
+        while [f for f in self.futures if f.running()]:
+            done, not_done = wait(self.futures, timeout=1)
+            if not_done and not self.domain.isActive():
+                # domain has crashed or is shutdown ?
+                self.stop_request.set()
+
+        # raise process_vcpu exceptions if any
+        for f in self.futures:
+            if f.exception() is not None:
+                raise f.exception()
+        logging.info('Stop Nitro listening')
+
     def listen_vcpu(self, vcpu_io, queue):
         """Listen to an individual virtual CPU"""
         logging.info('Start listening on VCPU %s', vcpu_io.vcpu_nb)
@@ -143,19 +279,83 @@ class Listener:
                 # put the event in the queue
                 # and wait for the event to be processed,
                 # when the main thread will set the continue_event
-                item = (e, continue_event)
+                item = (e, continue_event, time.perf_counter())
                 queue.put(item)
                 continue_event.wait()
                 # reset continue_event
                 continue_event.clear()
                 vcpu_io.continue_vm()
+                # the event buffer can be reused for the next event
+                e.release()
 
         logging.debug('stop listening on VCPU %s', vcpu_io.vcpu_nb)
 
+    def process_vcpu(self, vcpu_io, callback):
+        """Listen to an individual virtual CPU and process its events in place"""
+        logging.info('Start processing on VCPU %s', vcpu_io.vcpu_nb)
+        while not self.stop_request.is_set():
+            try:
+                nitro_raw_ev = vcpu_io.get_event()
+            except ValueError as e:
+                if not self.vm_io.syscall_filters:
+                    logging.debug(str(e))
+            else:
+                e = NitroEvent(nitro_raw_ev, vcpu_io)
+                try:
+                    if not self.stop_request.is_set():
+                        callback(e)
+                except Exception:
+                    # stop the other VCPU threads, the exception
+                    # will be raised by listen_parallel
+                    self.stop_request.set()
+                    raise
+                finally:
+                    vcpu_io.continue_vm()
+                    e.release()
+
+        logging.debug('stop processing on VCPU %s', vcpu_io.vcpu_nb)
+
+    def latency_report(self):
+        """
+        Summary of the time events wait in the queue and of the time each
+        VCPU is paused, see :class:`.LatencyHistogram`.
+
+        :rtype: dict
+        """
+        return {
+            'queue_wait': self.queue_wait.as_dict(),
+            'vcpu_paused': {vcpu_io.vcpu_nb: vcpu_io.pause_latency.as_dict()
+                            for vcpu_io in self.vcpus_io},
+        }
+
     def add_syscall_filter(self, syscall_nb):
         """Add system call filter to a virtual machine"""
-        self.vm_io.add_syscall_filter(syscall_nb)
+        if self.configuration is not None:
+            self.configuration.add_syscall_filter(syscall_nb)
+        else:
+            self.vm_io.add_syscall_filter(syscall_nb)
 
     def remove_syscall_filter(self, syscall_nb):
         """Remove system call filter form a virtual machine"""
-        self.vm_io.remove_syscall_filter(syscall_nb)
+        if self.configuration is not None:
+            self.configuration.remove_syscall_filter(syscall_nb)
+        else:
+            self.vm_io.remove_syscall_filter(syscall_nb)
+
+    def add_syscall_filters(self, syscall_nbs):
+        """
+        Add several system call filters to a virtual machine, the domain is
+        only suspended once. Filters that are already installed are skipped.
+        """
+        with self.configure() as config:
+            for syscall_nb in syscall_nbs:
+                config.add_syscall_filter(syscall_nb)
+
+    def remove_syscall_filters(self, syscall_nbs):
+        """
+        Remove several system call filters from a virtual machine, the domain
+        is only suspended once, so the guest never runs with a part of them.
+        """
+        with self.configure() as config:
+            for syscall_nb in syscall_nbs:
+                config.remove_syscall_filter(syscall_nb)
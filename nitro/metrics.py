@@ -0,0 +1,274 @@
+"""
+Latency measurements of the event pipeline: how long VCPUs stay paused, how
+long events wait to be consumed and how long the backends and their hooks
+take to analyze them. The measurements and the backend statistics can be
+served live in Prometheus' text format by a :class:`MetricsServer`.
+"""
+
+import math
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations, in microseconds.
+
+    Each power of two is split in ``SUB_BUCKETS`` buckets of equal width, so
+    percentiles are estimated within 25%. The exact maximum is kept as well.
+    """
+
+    __slots__ = (
+        'buckets',
+        'count',
+        'total',
+        'max',
+    )
+
+    #: Number of buckets per power of two
+    SUB_BUCKETS = 4
+    #: Number of buckets, the last one counts everything above ~18 minutes
+    NB_BUCKETS = 30 * SUB_BUCKETS + 1
+
+    def __init__(self):
+        #: Number of durations in each bucket
+        self.buckets = [0] * self.NB_BUCKETS
+        #: Number of durations recorded
+        self.count = 0
+        #: Sum of the durations, in seconds
+        self.total = 0.0
+        #: Longest duration, in seconds
+        self.max = 0.0
+
+    def record(self, duration):
+        """Add ``duration``, in seconds"""
+        self.buckets[min(self.bucket(duration), self.NB_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    @classmethod
+    def bucket(cls, duration):
+        """Index of the bucket of ``duration``, in seconds"""
+        micros = duration * 1e6
+        if micros < 1:
+            return 0
+        mantissa, exponent = math.frexp(micros)
+        return ((exponent - 1) * cls.SUB_BUCKETS +
+                int((mantissa * 2 - 1) * cls.SUB_BUCKETS) + 1)
+
+    @classmethod
+    def upper_bound(cls, bucket):
+        """Upper bound of the durations in ``bucket``, in seconds"""
+        if bucket == 0:
+            return 1e-6
+        exponent, sub_bucket = divmod(bucket - 1, cls.SUB_BUCKETS)
+        return 2 ** exponent * (1 + (sub_bucket + 1) / cls.SUB_BUCKETS) / 1e6
+
+    def percentile(self, fraction):
+        """
+        Estimate the duration below which ``fraction`` of the durations fall,
+        in seconds.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                break
+        return min(self.upper_bound(bucket), self.max)
+
+    def as_dict(self):
+        """Summary of the histogram, durations in microseconds"""
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count * 1e6 if self.count else 0,
+            'p50_us': self.percentile(0.5) * 1e6,
+            'p99_us': self.percentile(0.99) * 1e6,
+            'max_us': self.max * 1e6,
+        }
+
+
+class MetricsWriter:
+    """Format metrics in Prometheus' text exposition format"""
+
+    __slots__ = (
+        'prefix',
+        'lines',
+    )
+
+    def __init__(self, prefix='nitro_'):
+        self.prefix = prefix
+        self.lines = []
+
+    def metric(self, name, kind, description, samples):
+        """
+        Add a metric.
+
+        :param str name: name of the metric, without prefix
+        :param str kind: ``counter``, ``gauge`` or ``summary``
+        :param str description: help text
+        :param samples: ``(labels, value)`` pairs, ``labels`` being a dict
+        """
+        name = self.prefix + name
+        self.lines.append('# HELP {} {}'.format(name, description))
+        self.lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in samples:
+            self.sample(name, labels, value)
+
+    def sample(self, name, labels, value):
+        if labels:
+            name = '{}{{{}}}'.format(name, ','.join(
+                '{}="{}"'.format(key, escape_label(str(label)))
+                for key, label in labels.items()))
+        self.lines.append('{} {}'.format(name, float(value)))
+
+    def summary(self, name, description, histograms):
+        """
+        Add a summary metric made of ``LatencyHistogram`` objects.
+
+        :param histograms: ``(labels, histogram)`` pairs
+        """
+        self.metric(name, 'summary', description, ())
+        name = self.prefix + name
+        for labels, histogram in histograms:
+            for quantile in (0.5, 0.99):
+                self.sample(name, dict(labels, quantile=quantile),
+                            histogram.percentile(quantile))
+            self.sample(name + '_sum', labels, histogram.total)
+            self.sample(name + '_count', labels, histogram.count)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def escape_label(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def collect_metrics(listener, backend=None):
+    """
+    Gather the live metrics of ``listener`` and ``backend``.
+
+    :rtype: str
+    :returns: the metrics, in Prometheus' text format
+    """
+    writer = MetricsWriter()
+    vcpus = list(listener.vcpus_io)
+    writer.metric('vcpu_events_total', 'counter',
+                  'Events handled by each VCPU',
+                  [({'vcpu': vcpu.vcpu_nb}, vcpu.pause_latency.count)
+                   for vcpu in vcpus])
+    writer.metric('vcpus_paused', 'gauge',
+                  'VCPUs currently paused on an event',
+                  [({}, sum(vcpu.paused_since is not None for vcpu in vcpus))])
+    writer.summary('vcpu_pause_seconds',
+                   'Time VCPUs stay paused on an event',
+                   [({'vcpu': vcpu.vcpu_nb}, vcpu.pause_latency)
+                    for vcpu in vcpus])
+    queue = listener.queue
+    writer.metric('queue_depth', 'gauge',
+                  'Events waiting to be consumed',
+                  [({}, queue.qsize() if queue is not None else 0)])
+    writer.summary('queue_wait_seconds',
+                   'Time events wait before being consumed',
+                   [({}, listener.queue_wait)])
+    writer.metric('process_cpu_seconds_total', 'counter',
+                  'CPU time used by Nitro', [({}, time.process_time())])
+    if backend is None:
+        return writer.text()
+
+    with backend.lock:
+        stats = sorted(backend.stats.items())
+        # names are not unique, unknown system calls share theirs
+        syscalls = [({'direction': direction.name,
+                      'syscall': backend.syscall_label(syscall_nb),
+                      'nb': '' if syscall_nb is None else syscall_nb}, histogram)
+                    for (direction, syscall_nb), histogram
+                    in backend.syscall_latency.items()]
+        hook_labels = backend.hook_labels()
+        hooks = [({'direction': direction.name,
+                   'hook': hook_labels[direction, hook]}, histogram)
+                 for (direction, hook), histogram
+                 in backend.hook_latency.items()]
+    for key, value in stats:
+        writer.metric('backend_{}_total'.format(key), 'counter',
+                      'Backend statistic {}'.format(key), [({}, value)])
+    writer.metric('hook_errors_total', 'counter', 'Hooks that raised an error',
+                  [({}, backend.stats['hooks_processed'] -
+                    backend.stats['hooks_completed'])])
+    writer.metric('syscalls_total', 'counter', 'System call events processed',
+                  [(labels, histogram.count) for labels, histogram in syscalls])
+    writer.summary('syscall_seconds', 'Time spent processing system call events',
+                   syscalls)
+    writer.summary('hook_seconds', 'Time spent in hooks', hooks)
+    return writer.text()
+
+
+class MetricsServer:
+    """
+    HTTP server exposing :func:`collect_metrics` on ``/metrics``, from a
+    daemon thread, for Prometheus to scrape::
+
+        server = MetricsServer(nitro.listener, nitro.backend, ('127.0.0.1', 9400))
+        server.start()
+    """
+
+    __slots__ = (
+        'listener',
+        'backend',
+        'server',
+        'thread',
+    )
+
+    def __init__(self, listener, backend=None, address=('127.0.0.1', 9400)):
+        self.listener = listener
+        self.backend = backend
+        self.server = ThreadingHTTPServer(address, self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self):
+        """``(host, port)`` the server listens on"""
+        return self.server.server_address[:2]
+
+    def handler_class(self):
+        metrics_server = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = collect_metrics(metrics_server.listener,
+                                       metrics_server.backend).encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug('metrics: ' + format, *args)
+
+        return MetricsHandler
+
+    def start(self):
+        logging.info('Serving metrics on http://%s:%s/metrics', *self.address)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='nitro-metrics', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
@@ -1,18 +1,24 @@
 from nitro.listener import Listener
 from nitro.backends import get_backend
+from nitro.backends.backend import CachePolicy
 
 class Nitro:
 
-    def __init__(self, domain, introspection=True, syscall_filtering=True):
+    def __init__(self, domain, introspection=True, syscall_filtering=True,
+                 cache_policy=CachePolicy.always, time_libvmi=False):
         self.listener = Listener(domain)
         self.introspection = introspection
         self.backend = None
         if self.introspection:
-            self.backend = get_backend(domain, self.listener, syscall_filtering)
+            self.backend = get_backend(domain, self.listener, syscall_filtering,
+                                       cache_policy, time_libvmi)
 
     def listen(self):
         yield from self.listener.listen()
 
+    def listen_parallel(self, callback):
+        self.listener.listen_parallel(callback)
+
     def __enter__(self):
         return self
 
@@ -0,0 +1,498 @@
+"""
+Simulated stand-ins for Nitro's KVM interface and for a guest's memory. These
+make it possible to drive :class:`~.Listener` and the analysis back ends with
+synthetic events on a machine that has neither the patched KVM module nor a
+running guest, which is mostly useful for measuring the event pipeline.
+"""
+
+import logging
+import random
+import struct
+import threading
+import time
+from collections import Counter, deque, defaultdict
+from ctypes import addressof, memmove, sizeof
+
+from nitro.event import SyscallDirection, SyscallType
+from nitro.kvm import (NitroEventStr, Regs, SRegs, RegisterCache,
+                       NITRO_EVENT_BUFFERS)
+from nitro.metrics import LatencyHistogram
+
+#: Handlers found at the start of the 64-bit Linux system call table
+LINUX_SYSCALL_HANDLERS = (
+    'SyS_read', 'SyS_write', 'SyS_open', 'SyS_close', 'SyS_newstat',
+    'SyS_newfstat', 'SyS_newlstat', 'SyS_poll', 'SyS_lseek', 'SyS_mmap',
+    'SyS_mprotect', 'SyS_munmap', 'SyS_brk', 'SyS_rt_sigaction',
+    'SyS_rt_sigprocmask', 'sys_rt_sigreturn', 'SyS_ioctl', 'SyS_pread64',
+    'SyS_pwrite64', 'SyS_readv', 'SyS_writev', 'SyS_access', 'SyS_pipe',
+    'SyS_select', 'sys_sched_yield', 'SyS_mremap', 'SyS_msync',
+    'SyS_mincore', 'SyS_madvise', 'SyS_shmget', 'SyS_shmat', 'SyS_shmctl',
+    'SyS_dup', 'SyS_dup2', 'sys_pause', 'SyS_nanosleep', 'SyS_getitimer',
+    'SyS_alarm', 'SyS_setitimer', 'sys_getpid', 'SyS_sendfile64',
+    'SyS_socket', 'SyS_connect', 'SyS_accept', 'SyS_sendto', 'SyS_recvfrom',
+    'SyS_sendmsg', 'SyS_recvmsg', 'SyS_shutdown', 'SyS_bind', 'SyS_listen',
+    'SyS_getsockname', 'SyS_getpeername', 'SyS_socketpair', 'SyS_setsockopt',
+    'SyS_getsockopt', 'sys_clone', 'sys_fork', 'sys_vfork', 'sys_execve',
+    'SyS_exit', 'SyS_wait4', 'SyS_kill', 'SyS_newuname',
+)
+
+
+class EventGenerator:
+    """
+    Source of synthetic system calls.
+
+    Each VCPU draws system call numbers from ``syscalls`` according to their
+    weights and attributes them to a random address space from ``cr3s``.
+    """
+
+    __slots__ = (
+        'numbers',
+        'weights',
+        'cr3s',
+        'rate',
+        'seed',
+    )
+
+    def __init__(self, syscalls, cr3s, rate=None, seed=0):
+        """
+        :param dict syscalls: system call number -> relative weight
+        :param list cr3s: cr3 values the events are attributed to
+        :param float rate: events per second and per VCPU, unlimited if None
+        :param int seed: seed for the pseudo-random generators
+        """
+        self.numbers = list(syscalls.keys())
+        self.weights = list(syscalls.values())
+        self.cr3s = list(cr3s)
+        self.rate = rate
+        self.seed = seed
+
+    def stream(self, vcpu_nb):
+        """
+        Endless stream of ``(syscall_nb, cr3)`` tuples for one VCPU.
+
+        :param int vcpu_nb: VCPU number, used to derive the stream's seed
+        """
+        rand = random.Random(self.seed + vcpu_nb)
+        while True:
+            syscall_nb, = rand.choices(self.numbers, self.weights)
+            yield syscall_nb, rand.choice(self.cr3s)
+
+
+class SimulatedKVM:
+    """Stand-in for :class:`~.KVM` attaching to a simulated virtual machine."""
+
+    __slots__ = (
+        'generator',
+        'nb_vcpu',
+    )
+
+    def __init__(self, generator, nb_vcpu):
+        self.generator = generator
+        self.nb_vcpu = nb_vcpu
+
+    def attach_vm(self, pid):
+        logging.debug('attach_vm PID = %s (simulated)', pid)
+        return SimulatedVM(self.generator, self.nb_vcpu)
+
+    def close(self):
+        pass
+
+
+class SimulatedVM:
+    """Stand-in for :class:`~.VM` owning the simulated VCPUs."""
+
+    __slots__ = (
+        'generator',
+        'nb_vcpu',
+        'syscall_filters',
+        'trap_enabled',
+        'vcpus',
+    )
+
+    def __init__(self, generator, nb_vcpu):
+        self.generator = generator
+        self.nb_vcpu = nb_vcpu
+        self.syscall_filters = set()
+        self.trap_enabled = False
+        self.vcpus = None
+
+    def attach_vcpus(self):
+        self.vcpus = [SimulatedVCPU(i, self) for i in range(self.nb_vcpu)]
+        return self.vcpus
+
+    def set_syscall_trap(self, enabled):
+        self.trap_enabled = enabled
+        return 0
+
+    def add_syscall_filter(self, syscall_nb):
+        self.syscall_filters.add(syscall_nb)
+        return 0
+
+    def remove_syscall_filter(self, syscall_nb):
+        self.syscall_filters.remove(syscall_nb)
+        return 0
+
+    def close(self):
+        pass
+
+
+class SimulatedVCPU(RegisterCache):
+    """
+    Stand-in for :class:`~.VCPU` producing events from an ``EventGenerator``.
+
+    Besides emulating the requests of the real VCPU, the simulated VCPU keeps
+    track of how many times each request has been made and of how long it has
+    been kept paused waiting for ``continue_vm``.
+    """
+
+    __slots__ = (
+        'vcpu_nb',
+        'vm',
+        'stream',
+        'regs',
+        'sregs',
+        'event_buffers',
+        'pending',
+        'next_time',
+        'paused_since',
+        'stall_time',
+        'max_stall_time',
+        'pause_latency',
+        'ioctls',
+        'dirty_regs',
+        'stats',
+    )
+
+    #: Time a request waits for an event before failing, like the real VCPU
+    TIMEOUT = 0.1
+    #: How many filtered out system calls are generated before timing out
+    MAX_FILTERED = 10000
+    #: Thread local storage of the thread running on the first VCPU
+    TLS_BASE = 0x7ff000000000
+
+    def __init__(self, vcpu_nb, vm):
+        self.vcpu_nb = vcpu_nb
+        self.vm = vm
+        self.stream = vm.generator.stream(vcpu_nb)
+        self.regs = Regs()
+        self.sregs = SRegs()
+        # each VCPU runs its own thread, identified by its TLS
+        self.sregs.gs.base = self.TLS_BASE + vcpu_nb * 0x1000
+        self.event_buffers = deque(NitroEventStr() for _ in
+                                   range(NITRO_EVENT_BUFFERS))
+        #: System call waiting for its exit event
+        self.pending = None
+        self.next_time = time.monotonic()
+        self.paused_since = None
+        #: Total time spent paused between get_event and continue_vm
+        self.stall_time = 0
+        #: Longest time spent paused for a single event
+        self.max_stall_time = 0
+        #: Time spent paused, like :attr:`.VCPU.pause_latency`
+        self.pause_latency = LatencyHistogram()
+        #: Number of requests made, by request name
+        self.ioctls = Counter()
+        self.dirty_regs = None
+        self.stats = defaultdict(int)
+
+    def pace(self):
+        rate = self.vm.generator.rate
+        if rate:
+            self.next_time += 1 / rate
+            delay = self.next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def get_event(self):
+        """
+        Retrieve the next simulated event
+
+        :rtype: NitroEventStr
+        """
+        self.ioctls['get_event'] += 1
+        if not self.vm.trap_enabled:
+            time.sleep(self.TIMEOUT)
+            raise ValueError('get_event failed on vcpu {}'.format(self.vcpu_nb))
+        if self.pending is not None:
+            direction = SyscallDirection.exit
+            cr3 = self.pending
+            self.pending = None
+            # return value
+            self.regs.rax = 0
+        else:
+            direction = SyscallDirection.enter
+            for _ in range(self.MAX_FILTERED):
+                self.pace()
+                syscall_nb, cr3 = next(self.stream)
+                filters = self.vm.syscall_filters
+                if not filters or syscall_nb in filters:
+                    break
+            else:
+                raise ValueError('get_event failed on vcpu {}'.format(self.vcpu_nb))
+            self.pending = cr3
+            self.regs.rax = syscall_nb
+        self.sregs.cr3 = cr3
+        try:
+            nitro_ev = self.event_buffers.pop()
+        except IndexError:
+            nitro_ev = NitroEventStr()
+        nitro_ev.present = True
+        nitro_ev.direction = direction.value
+        nitro_ev.type = SyscallType.syscall.value
+        nitro_ev.regs = self.regs
+        nitro_ev.sregs = self.sregs
+        self.paused_since = time.perf_counter()
+        return nitro_ev
+
+    def release_event(self, nitro_ev):
+        if len(self.event_buffers) < NITRO_EVENT_BUFFERS:
+            self.event_buffers.append(nitro_ev)
+
+    def continue_vm(self):
+        """Continue virtual machine execution"""
+        self.flush_regs()
+        self.ioctls['continue_vm'] += 1
+        if self.paused_since is not None:
+            stall = time.perf_counter() - self.paused_since
+            self.stall_time += stall
+            self.max_stall_time = max(self.max_stall_time, stall)
+            self.pause_latency.record(stall)
+            self.paused_since = None
+        return 0
+
+    def get_regs(self):
+        self.ioctls['get_regs'] += 1
+        return Regs.from_buffer_copy(self.regs)
+
+    def get_sregs(self):
+        self.ioctls['get_sregs'] += 1
+        return SRegs.from_buffer_copy(self.sregs)
+
+    def set_regs(self, regs):
+        self.ioctls['set_regs'] += 1
+        memmove(addressof(self.regs), addressof(regs), sizeof(Regs))
+        return 0
+
+    def set_sregs(self, sregs):
+        self.ioctls['set_sregs'] += 1
+        memmove(addressof(self.sregs), addressof(sregs), sizeof(SRegs))
+        return 0
+
+    def close(self):
+        pass
+
+
+class SimulatedDomain:
+    """Stand-in for the parts of a libvirt domain that Nitro relies on."""
+
+    __slots__ = (
+        'domain_name',
+        'nb_vcpu',
+        'active',
+        'suspended',
+    )
+
+    def __init__(self, name, nb_vcpu):
+        self.domain_name = name
+        self.nb_vcpu = nb_vcpu
+        self.active = True
+        self.suspended = False
+
+    def name(self):
+        return self.domain_name
+
+    def isActive(self):
+        return self.active
+
+    def suspend(self):
+        self.suspended = True
+
+    def resume(self):
+        self.suspended = False
+
+    def vcpus(self):
+        # (number, state, cpu time, real cpu)
+        info = [(i, 1, 0, i) for i in range(self.nb_vcpu)]
+        cpumaps = [(True,) for _ in range(self.nb_vcpu)]
+        return info, cpumaps
+
+    def destroy(self):
+        self.active = False
+
+
+class SimulatedMemory:
+    """Sparse, page-granular byte addressable memory."""
+
+    __slots__ = (
+        'pages',
+        'lock',
+    )
+
+    PAGE_SIZE = 0x1000
+
+    def __init__(self):
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def read(self, addr, count):
+        chunks = []
+        while count > 0:
+            page, offset = divmod(addr, self.PAGE_SIZE)
+            size = min(count, self.PAGE_SIZE - offset)
+            content = self.pages.get(page)
+            if content is None:
+                chunks.append(bytes(size))
+            else:
+                chunks.append(bytes(content[offset:offset + size]))
+            addr += size
+            count -= size
+        return b''.join(chunks)
+
+    def write(self, addr, buffer):
+        with self.lock:
+            view = memoryview(buffer)
+            while view:
+                page, offset = divmod(addr, self.PAGE_SIZE)
+                size = min(len(view), self.PAGE_SIZE - offset)
+                content = self.pages.setdefault(page, bytearray(self.PAGE_SIZE))
+                content[offset:offset + size] = view[:size]
+                addr += size
+                view = view[size:]
+
+
+class SimulatedLinuxLibvmi:
+    """
+    Minimal libvmi stand-in exposing the memory of a simulated 64-bit Linux
+    guest: a system call table, a task list of ``nb_processes`` tasks and
+    their page directories. The guest has a single flat address space, the
+    ``pid`` arguments of the read and write methods are ignored. Every request
+    is counted in ``calls``.
+    """
+
+    __slots__ = (
+        'memory',
+        'handlers',
+        'symbols',
+        'offsets',
+        'cr3s',
+        'calls',
+    )
+
+    PAGE_OFFSET = 0xffff880000000000
+    SYS_CALL_TABLE = 0xffffffff81a00000
+    LINUX_BANNER = 0xffffffff81b00000
+    HANDLERS_BASE = 0xffffffff81100000
+    TASKS_BASE = PAGE_OFFSET + 0x100000
+    MM_BASE = PAGE_OFFSET + 0x10000000
+    PGD_BASE = PAGE_OFFSET + 0x20000000
+    STRUCT_SIZE = 0x1000
+
+    OFFSETS = {
+        'linux_tasks': 0x350,
+        'linux_mm': 0x3a0,
+        'linux_pid': 0x448,
+        'linux_pgd': 0x40,
+        'linux_name': 0x5c8,
+    }
+
+    def __init__(self, nb_processes=100, handlers=LINUX_SYSCALL_HANDLERS):
+        self.memory = SimulatedMemory()
+        self.offsets = dict(self.OFFSETS)
+        self.calls = Counter()
+        #: handler address -> handler name
+        self.handlers = {}
+        for i, name in enumerate(handlers):
+            addr = self.HANDLERS_BASE + i * 0x100
+            self.handlers[addr] = name
+            self.write_addr(self.SYS_CALL_TABLE + i * 8, addr)
+        self.symbols = {
+            'sys_call_table': self.SYS_CALL_TABLE,
+            'init_task': self.TASKS_BASE,
+            'linux_banner': self.LINUX_BANNER,
+        }
+        self.memory.write(self.LINUX_BANNER,
+                          b'Linux version 4.4.0-nitro (simulated)\n\0')
+        #: cr3 values of the processes having an address space
+        self.cr3s = []
+        # task 0 is the swapper, a kernel thread without mm
+        nb_tasks = nb_processes + 1
+        for i in range(nb_tasks):
+            task = self.TASKS_BASE + i * self.STRUCT_SIZE
+            next_task = self.TASKS_BASE + ((i + 1) % nb_tasks) * self.STRUCT_SIZE
+            self.write_addr(task + self.offsets['linux_tasks'],
+                            next_task + self.offsets['linux_tasks'])
+            self.memory.write(task + self.offsets['linux_pid'],
+                              struct.pack('I', i))
+            name = 'swapper/0' if i == 0 else 'process{}'.format(i)
+            self.memory.write(task + self.offsets['linux_name'],
+                              name.encode() + b'\0')
+            if i == 0:
+                continue
+            mm = self.MM_BASE + i * self.STRUCT_SIZE
+            pgd = self.PGD_BASE + i * self.STRUCT_SIZE
+            self.write_addr(task + self.offsets['linux_mm'], mm)
+            self.write_addr(mm + self.offsets['linux_pgd'], pgd)
+            self.cr3s.append(pgd - self.PAGE_OFFSET)
+
+    def write_addr(self, addr, value):
+        self.memory.write(addr, struct.pack('Q', value))
+
+    def get_offset(self, name):
+        self.calls['get_offset'] += 1
+        return self.offsets[name]
+
+    def translate_ksym2v(self, symbol):
+        self.calls['translate_ksym2v'] += 1
+        return self.symbols[symbol]
+
+    def translate_v2ksym(self, addr):
+        self.calls['translate_v2ksym'] += 1
+        return self.handlers.get(addr)
+
+    def translate_kv2p(self, addr):
+        self.calls['translate_kv2p'] += 1
+        return addr - self.PAGE_OFFSET
+
+    def read_addr_va(self, addr, pid):
+        self.calls['read_addr_va'] += 1
+        value, = struct.unpack('Q', self.memory.read(addr, 8))
+        return value
+
+    def read_32(self, addr, pid):
+        self.calls['read_32'] += 1
+        value, = struct.unpack('I', self.memory.read(addr, 4))
+        return value
+
+    def read_str_va(self, addr, pid):
+        self.calls['read_str_va'] += 1
+        chars = []
+        while True:
+            char = self.memory.read(addr + len(chars), 1)
+            if char == b'\0':
+                break
+            chars.append(char)
+        return b''.join(chars).decode()
+
+    def read_va(self, addr, pid, count):
+        self.calls['read_va'] += 1
+        return self.memory.read(addr, count), count
+
+    def write_va(self, addr, pid, buffer):
+        self.calls['write_va'] += 1
+        self.memory.write(addr, buffer)
+        return len(buffer)
+
+    def v2pcache_flush(self, dtb=None):
+        self.calls['v2pcache_flush'] += 1
+
+    def pidcache_flush(self):
+        self.calls['pidcache_flush'] += 1
+
+    def rvacache_flush(self):
+        self.calls['rvacache_flush'] += 1
+
+    def symcache_flush(self):
+        self.calls['symcache_flush'] += 1
+
+    def destroy(self):
+        pass
@@ -1,3 +1,6 @@
+_UNSET = object()
+
+
 class Syscall:
     """
     Class representing system call events.
@@ -6,42 +9,119 @@ class Syscall:
     of what is happening inside the virtual machine. The class enables access to
     information about the process that created the event and makes it possible
     to access call's arguments.
+
+    The names, the process and the arguments that are not given are resolved
+    by ``backend`` the first time they are accessed, so events nobody looks at
+    cost little more than their number.
     """
 
     __slots__ = (
-        "event",
-        "full_name",
-        "name",
-        "process",
-        "args",
-        "hook"
+        "_event",
+        "enter_event",
+        "nb",
+        "backend",
+        "_full_name",
+        "_name",
+        "_process",
+        "_args",
+        "hook",
+        "out_pointers",
+        "out",
     )
 
-    def __init__(self, event, full_name, name, process, args):
-        #: Associated low-level NitroEvent
-        self.event = event
-        #: Full name of the systme call handler (eg. SyS_write)
-        self.full_name = full_name
-        #: Short "cleaned up" name of the system call handler (eg. write)
-        self.name = name
-        #: Process that produced the event
-        self.process = process
-        #: Arguments passed to the call
-        self.args = args
+    def __init__(self, event, full_name=_UNSET, name=_UNSET, process=_UNSET,
+                 args=_UNSET, nb=None, backend=None):
+        self._event = event
+        #: Event of the system call enter, the arguments are taken from it
+        self.enter_event = event
+        #: System call number, None if unknown
+        self.nb = nb
+        #: Backend resolving the missing attributes
+        self.backend = backend
+        self._full_name = full_name
+        self._name = name
+        self._process = process
+        self._args = args
         #: Hook associated with the event
         self.hook = None
+        #: Pointers of the OUT arguments, recorded when the call is entered
+        self.out_pointers = None
+        #: Values of the OUT arguments read when the call exits, indexed by
+        #: argument position
+        self.out = None
+
+    @property
+    def event(self):
+        """Associated low-level NitroEvent, the one being processed"""
+        return self._event
+
+    @event.setter
+    def event(self, event):
+        self._event = event
+        self.retarget_arguments()
+
+    def retarget_arguments(self):
+        # modified registers go to the VCPU paused on the current event, the
+        # thread might have entered the call on another VCPU
+        if self._args not in (None, _UNSET):
+            try:
+                self._args.target_event = self._event
+            except AttributeError:
+                # not an ArgumentMap
+                pass
+
+    @property
+    def full_name(self):
+        """Full name of the systme call handler (eg. SyS_write)"""
+        if self._full_name is _UNSET:
+            self._full_name, self._name = self.backend.resolve_syscall(self.nb)
+        return self._full_name
+
+    @property
+    def name(self):
+        """Short "cleaned up" name of the system call handler (eg. write)"""
+        if self._name is _UNSET:
+            self._full_name, self._name = self.backend.resolve_syscall(self.nb)
+        return self._name
+
+    @property
+    def process(self):
+        """Process that produced the event"""
+        if self._process is _UNSET:
+            self._process = self.backend.syscall_process(self)
+        return self._process
+
+    @property
+    def args(self):
+        """Arguments passed to the call"""
+        if self._args is _UNSET:
+            self._args = self.backend.syscall_arguments(self)
+            self.retarget_arguments()
+        return self._args
+
+    @args.setter
+    def args(self, args):
+        self._args = args
+        self.retarget_arguments()
+
+    def as_dict(self, process_fields=None):
+        """
+        Retrieve a dict representation of the system call event.
 
-    def as_dict(self):
-        """Retrieve a dict representation of the system call event."""
+        :param process_fields: names of the process fields to include, all of
+            them if None
+        """
         info = {
             "full_name": self.full_name,
             "name": self.name,
             "event": self.event.as_dict(),
         }
         if self.process:
-            info['process'] = self.process.as_dict()
+            info['process'] = self.process.as_dict(process_fields)
         if self.hook:
             info['hook'] = self.hook
-        if self.args is not None and self.args.modified:
-            info['modified'] = self.args.modified
+        if self._args not in (None, _UNSET) and self._args.modified:
+            info['modified'] = self._args.modified
+        if self.out:
+            info['out'] = self.out
         return info
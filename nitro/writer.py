@@ -0,0 +1,184 @@
+"""
+Streaming output of the recorded events, as JSON lines.
+"""
+
+import gzip
+import json
+import logging
+import lzma
+import os
+import threading
+import time
+from queue import Queue, Empty
+
+
+#: Functions opening files for writing text, by compression method
+OPENERS = {
+    None: open,
+    'gzip': gzip.open,
+    'lzma': lzma.open,
+}
+
+
+class EventWriter:
+    """
+    Write events to a file, one JSON object per line, from a background
+    thread.
+
+    Events are serialized by :meth:`write`, while they cannot change anymore,
+    and queued for the thread, which writes and compresses them. It
+    flushes the file every ``flush_interval`` seconds so that a crash loses
+    at most the last moments of the capture. With lzma, data still held by
+    the compressor is only written when the file is closed.
+
+    When ``max_size`` or ``max_age`` is given, the file is rotated once it
+    grows past ``max_size`` bytes of uncompressed data or gets older than
+    ``max_age`` seconds. The files are then numbered: ``events.jsonl.gz``
+    becomes ``events.0.jsonl.gz``, ``events.1.jsonl.gz``...
+    """
+
+    __slots__ = (
+        'path',
+        'compression',
+        'max_size',
+        'max_age',
+        'flush_interval',
+        'queue',
+        'thread',
+        'error',
+        'file',
+        'file_index',
+        'file_size',
+        'file_opened',
+        'closed',
+    )
+
+    #: Marks the end of the lines in the queue
+    STOP = object()
+
+    def __init__(self, path, compression=None, max_size=None, max_age=None,
+                 flush_interval=1, queue_size=10000):
+        """
+        :param str path: file to write
+        :param str compression: ``gzip``, ``lzma`` or None
+        :param int max_size: size triggering a rotation, in bytes
+        :param float max_age: age triggering a rotation, in seconds
+        :param float flush_interval: time between flushes, in seconds
+        :param int queue_size: number of events queued before :meth:`write`
+            blocks
+        """
+        if compression not in OPENERS:
+            raise ValueError('Unknown compression {}'.format(compression))
+        self.path = path
+        self.compression = compression
+        self.max_size = max_size
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.queue = Queue(maxsize=queue_size)
+        #: Exception raised by the writer thread, if any
+        self.error = None
+        self.file = None
+        self.file_index = 0
+        self.file_size = 0
+        self.file_opened = None
+        self.closed = False
+        self.open_file()
+        self.thread = threading.Thread(target=self.run, name='nitro-writer',
+                                       daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def rotating(self):
+        return self.max_size is not None or self.max_age is not None
+
+    def file_path(self):
+        """Path of the current file"""
+        if not self.rotating:
+            return self.path
+        directory, name = os.path.split(self.path)
+        stem, dot, suffixes = name.partition('.')
+        name = '{}.{}{}{}'.format(stem, self.file_index, dot, suffixes)
+        return os.path.join(directory, name)
+
+    def open_file(self):
+        path = self.file_path()
+        logging.info('Writing events to %s', path)
+        self.file = OPENERS[self.compression](path, 'wt')
+        self.file_size = 0
+        self.file_opened = time.monotonic()
+
+    def rotate(self):
+        self.file.close()
+        self.file_index += 1
+        self.open_file()
+
+    def needs_rotation(self):
+        if self.max_size is not None and self.file_size >= self.max_size:
+            return True
+        return (self.max_age is not None and
+                time.monotonic() - self.file_opened >= self.max_age)
+
+    def write(self, event):
+        """
+        Serialize ``event`` and queue it to be written, blocking while the
+        queue is full. The hooks may still modify the event afterwards.
+
+        :param dict event: JSON serializable event
+        :raises: the exception that stopped the writer thread, if any
+        """
+        if self.error is not None:
+            raise self.error
+        if self.closed:
+            raise ValueError('EventWriter is closed')
+        self.queue.put(json.dumps(event) + '\n')
+
+    def close(self):
+        """
+        Write the queued events and close the file.
+
+        :raises: the exception that stopped the writer thread, if any
+        """
+        if not self.closed:
+            self.closed = True
+            if self.thread.is_alive():
+                self.queue.put(self.STOP)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        try:
+            while True:
+                try:
+                    line = self.queue.get(
+                        timeout=max(0, next_flush - time.monotonic()))
+                except Empty:
+                    line = None
+                if line is self.STOP:
+                    break
+                if line is not None:
+                    self.file.write(line)
+                    self.file_size += len(line)
+                if time.monotonic() >= next_flush:
+                    self.file.flush()
+                    next_flush = time.monotonic() + self.flush_interval
+                if self.rotating and self.file_size and self.needs_rotation():
+                    self.rotate()
+        except Exception as e:
+            logging.exception('Failed to write events')
+            self.error = e
+            # unblock the producers, the events are lost
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except Empty:
+                    break
+        finally:
+            self.file.close()
@@ -0,0 +1,76 @@
+import os
+import sys
+import datetime
+import unittest
+
+from unittest.mock import Mock
+
+# local
+sys.path.insert(1, os.path.realpath('../..'))
+from nitro.kvm import NitroEventStr
+from nitro.event import NitroEvent, SyscallDirection, SyscallType
+from nitro.simulation import SimulatedVM, SimulatedLinuxLibvmi, EventGenerator
+
+def create_event(direction=SyscallDirection.enter, rax=0x1, cr3=0x1000):
+    raw = NitroEventStr()
+    raw.direction = direction.value
+    raw.type = SyscallType.syscall.value
+    raw.regs.rax = rax
+    raw.sregs.cr3 = cr3
+    return NitroEvent(raw, Mock(vcpu_nb=1))
+
+class TestNitroEvent(unittest.TestCase):
+    def test_as_dict(self):
+        """Check that lazily decoded fields match the raw event."""
+        event = create_event(SyscallDirection.exit, rax=0x2a, cr3=0x5000)
+        info = event.as_dict()
+
+        self.assertEqual(event.direction, SyscallDirection.exit)
+        self.assertEqual(event.type, SyscallType.syscall)
+        self.assertEqual(info["vcpu"], 1)
+        self.assertEqual(info["direction"], "exit")
+        self.assertEqual(info["type"], "syscall")
+        self.assertEqual(info["rax"], "0x2a")
+        self.assertEqual(info["cr3"], "0x5000")
+        # the textual time is derived from the nanosecond timestamp
+        parsed = datetime.datetime.strptime(info["time"], "%Y-%m-%dT%H:%M:%S.%f")
+        self.assertAlmostEqual(parsed.timestamp(), event.timestamp / 1e9, places=3)
+
+    def test_copy(self):
+        """Check that copies are independent from the original buffer."""
+        event = create_event(rax=0x3)
+        copy = event.copy()
+        event.raw.regs.rax = 0x4
+        event.release()
+
+        event.vcpu_io.release_event.assert_called_once_with(event.raw)
+        self.assertEqual(copy.regs.rax, 0x3)
+        self.assertEqual(copy.timestamp, event.timestamp)
+        self.assertEqual(copy.direction, SyscallDirection.enter)
+        copy.release()
+        event.vcpu_io.release_event.assert_called_once_with(event.raw)
+
+    def test_update_register(self):
+        """Check that register changes are written back once on resume."""
+        libvmi = SimulatedLinuxLibvmi(nb_processes=1)
+        vm = SimulatedVM(EventGenerator({0: 1}, libvmi.cr3s), 1)
+        vm.set_syscall_trap(True)
+        vcpu_io, = vm.attach_vcpus()
+        event = NitroEvent(vcpu_io.get_event(), vcpu_io)
+
+        event.update_register("rdi", 0x10)
+        event.update_register("rsi", 0x20)
+        event.update_register("rdx", 0x30)
+        self.assertEqual(event.get_register("rsi"), 0x20)
+        self.assertEqual(vcpu_io.regs.rsi, 0)
+        vcpu_io.continue_vm()
+
+        self.assertEqual(vcpu_io.ioctls["get_regs"], 1)
+        self.assertEqual(vcpu_io.ioctls["set_regs"], 1)
+        self.assertEqual(vcpu_io.stats["regs_ioctls_saved"], 4)
+        self.assertEqual((vcpu_io.regs.rdi, vcpu_io.regs.rsi, vcpu_io.regs.rdx),
+                         (0x10, 0x20, 0x30))
+
+        # the VCPU is running again
+        with self.assertRaises(RuntimeError):
+            event.update_register("rdi", 0x40)
@@ -1,11 +1,14 @@
+import functools
 import os
 import pathlib
 import struct
 import sys
+import tempfile
+import threading
 import unittest
 import logging
 
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, patch, call
 
 # TODO:
 # Make sure we do not end up importing anything that might cause problems
@@ -23,7 +26,12 @@ from nitro.backends.linux import LinuxBackend
 from nitro.backends.linux.backend import clean_name as linux_clean_name
 from nitro.libvmi import Libvmi
 from nitro.event import SyscallDirection
+from nitro.backends.backend import CachePolicy, CATCH_ALL
 from nitro.syscall import Syscall
+from nitro.listener import Listener
+from nitro.metrics import collect_metrics
+from nitro.simulation import (SimulatedKVM, SimulatedDomain, EventGenerator,
+                              SimulatedLinuxLibvmi)
 
 # Mock common backend objects with some defaults
 
@@ -46,7 +54,8 @@ def get_offset(symbol):
         "linux_tasks": 0x350,
         "linux_mm": 0x3a0,
         "linux_pid": 0x448,
-        "linux_pgd": 0x40
+        "linux_pgd": 0x40,
+        "linux_name": 0x5c8
     }[symbol]
 
 # Is this safe, will this work without libvmi installed?
@@ -63,7 +72,8 @@ domain = Mock(**{
 
 listener = Mock()
 
-LinuxBackend.build_syscall_name_map = lambda _: {}
+load_syscall_table = LinuxBackend.load_syscall_table
+LinuxBackend.load_syscall_table = lambda _: []
 
 def get_resource_path(name):
     return pathlib.Path(__file__).parent.joinpath("resources", name)
@@ -95,6 +105,214 @@ class TestLinux(unittest.TestCase):
             self.assertEqual(backend.get_syscall_name(2), "SyS_open")
             self.assertEqual(backend.get_syscall_name(3), "SyS_close")
 
+    def test_syscall_table_cache(self):
+        """Check that the system call table is read at once and cached on disk."""
+        backend = LinuxBackend(domain, libvmi, listener)
+        with get_resource_path("syscall_table_sample.bin").open("rb") as handle:
+            memory = handle.read().ljust(8192, b"\0")
+        symbols = {
+            0xffffffff8120f6a0: "SyS_read",
+            0xffffffff8120f760: "SyS_write",
+            0xffffffff8120db70: "SyS_open",
+            0xffffffff8120ba50: "SyS_close",
+        }
+        expected = ["SyS_read", "SyS_write", "SyS_open", "SyS_close"]
+        with tempfile.TemporaryDirectory() as cache_dir, \
+             patch.dict(os.environ, {"NITRO_CACHE_DIR": cache_dir}), \
+             patch.object(backend.libvmi, "read_va", return_value=(memory, len(memory))) as read_va, \
+             patch.object(backend.libvmi, "read_str_va", return_value="Linux version 4.4.0"), \
+             patch.object(backend.libvmi, "translate_ksym2v", return_value=0xc0ffee), \
+             patch.object(backend.libvmi, "translate_v2ksym", side_effect=symbols.get):
+            self.assertEqual(load_syscall_table(backend), expected)
+            read_va.assert_called_once_with(0xc0ffee, 0, len(memory))
+            # the same kernel is not read again
+            self.assertEqual(load_syscall_table(backend), expected)
+            read_va.assert_called_once_with(0xc0ffee, 0, len(memory))
+
+        # a short read falls back to reading the entries one by one
+        def read_addr_va(addr, pid):
+            start = addr - backend.sys_call_table_addr
+            return struct.unpack("P", memory[start:start + 8])[0]
+        with patch.object(backend.libvmi, "read_va", return_value=(memory[:16], 16)), \
+             patch.object(backend.libvmi, "read_addr_va", side_effect=read_addr_va), \
+             patch.object(backend.libvmi, "translate_v2ksym", side_effect=symbols.get):
+            self.assertEqual(backend.read_syscall_table(), expected)
+
+    def test_resolve_syscall(self):
+        """Check that system calls are resolved from the table before the guest memory."""
+        with patch.object(LinuxBackend, "load_syscall_table", return_value=["SyS_read", "sys_write"]):
+            backend = LinuxBackend(domain, libvmi, listener)
+        self.assertEqual(backend.syscall_names,
+                         {"SyS_read": 0, "read": 0, "sys_write": 1, "write": 1})
+        with patch.object(LinuxBackend, "get_syscall_name", return_value="SyS_open") as get_syscall_name:
+            self.assertEqual(backend.resolve_syscall(0), ("SyS_read", "read"))
+            self.assertEqual(backend.resolve_syscall(1), ("sys_write", "write"))
+            get_syscall_name.assert_not_called()
+            self.assertEqual(backend.resolve_syscall(2), ("SyS_open", "open"))
+            get_syscall_name.assert_called_once_with(2)
+
+    def test_define_hooks(self):
+        """Check that hooks are defined and their filters installed at once."""
+        listener = Mock()
+        with patch.object(LinuxBackend, "load_syscall_table", return_value=["SyS_read", "SyS_write", "SyS_open"]):
+            backend = LinuxBackend(domain, libvmi, listener)
+        self.assertEqual(backend.find_syscall_nb("open"), 2)
+        self.assertEqual(backend.find_syscall_nb("SyS_open"), 2)
+        self.assertIsNone(backend.find_syscall_nb("close"))
+
+        callback = Mock()
+        backend.define_hooks({"read": callback, "open": callback})
+        self.assertEqual(backend.hooks[SyscallDirection.enter], {"read": [callback], "open": [callback]})
+        listener.add_syscall_filters.assert_called_once_with([0, 2])
+
+        with self.assertRaises(RuntimeError):
+            backend.define_hooks({"write": callback, "close": callback},
+                                 direction=SyscallDirection.exit)
+        self.assertEqual(backend.hooks[SyscallDirection.exit], {})
+        listener.add_syscall_filters.assert_called_once_with([0, 2])
+
+    def test_required_filters(self):
+        """Check that the system calls releasing processes are trapped with the hooks."""
+        listener = Mock()
+        with patch.object(LinuxBackend, "load_syscall_table",
+                          return_value=["SyS_read", "SyS_write", "SyS_exit"]):
+            backend = LinuxBackend(domain, libvmi, listener)
+        backend.define_hook("read", Mock())
+        backend.define_hook("write", Mock(), direction=SyscallDirection.exit)
+        listener.add_syscall_filters.assert_has_calls([call([0, 2]), call([1, 2])])
+
+        backend.undefine_hook("read")
+        listener.remove_syscall_filters.assert_called_once_with([0])
+        # nothing is filtered anymore
+        backend.undefine_hook("write", SyscallDirection.exit)
+        listener.remove_syscall_filters.assert_called_with([1, 2])
+
+        # the system calls whose OUT arguments are captured stay trapped
+        backend.define_out_argument("write", 1)
+        listener.add_syscall_filters.assert_called_with([1, 2])
+        backend.define_hook("write", Mock())
+        backend.undefine_hook("write")
+        self.assertEqual(listener.remove_syscall_filters.call_count, 2)
+
+        # the memory system calls are needed by the cache policy
+        with patch.object(LinuxBackend, "load_syscall_table",
+                          return_value=["SyS_read", "SyS_write", "SyS_exit", "SyS_mmap"]):
+            backend = LinuxBackend(domain, libvmi, listener,
+                                   cache_policy=CachePolicy.generation)
+        backend.define_hook("read", Mock())
+        listener.add_syscall_filters.assert_called_with([0, 2, 3])
+
+    def test_dispatch_hooks(self):
+        """Check that hooks are dispatched by number, in order, with catch-all hooks."""
+        listener = Mock()
+        with patch.object(LinuxBackend, "load_syscall_table",
+                          return_value=["SyS_read", "SyS_write", "SyS_open", "SyS_openat"]):
+            backend = LinuxBackend(domain, libvmi, listener)
+        calls = []
+
+        def hook(tag):
+            return lambda syscall, backend: calls.append((tag, syscall.nb))
+
+        catch_all, first, second, pattern = hook("*"), hook(1), hook(2), hook("open*")
+        backend.define_hook("*", catch_all)
+        backend.define_hook("open*", pattern)
+        backend.define_hook("read", first)
+        backend.define_hook("SyS_read", second)
+        listener.add_syscall_filters.assert_has_calls([call([2, 3]), call([0]), call([0])])
+
+        def dispatch(nb):
+            calls.clear()
+            backend.dispatch_hooks(Syscall(Mock(direction=SyscallDirection.enter),
+                                           None, None, Mock(), None, nb))
+            return calls
+
+        self.assertEqual(dispatch(0), [(1, 0), (2, 0), ("*", 0)])
+        self.assertEqual(dispatch(3), [("open*", 3), ("*", 3)])
+        self.assertEqual(dispatch(None), [("*", None)])
+        self.assertEqual(backend.stats["hooks_completed"], 6)
+        self.assertEqual(backend.hook_latency[SyscallDirection.enter, catch_all].count, 3)
+        self.assertEqual(backend.hook_latency[SyscallDirection.enter, first].count, 1)
+
+        # the filter is kept while the system call is hooked
+        backend.undefine_hook("read")
+        listener.remove_syscall_filters.assert_not_called()
+        backend.undefine_hook("SyS_read", callback=second)
+        listener.remove_syscall_filters.assert_called_once_with([0])
+        self.assertEqual(dispatch(0), [("*", 0)])
+        with self.assertRaises(RuntimeError):
+            backend.define_hook("close*", first)
+
+        # callables without a name are logged too
+        backend.define_hook("write", functools.partial(hook("partial")))
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            dispatch(1)
+        self.assertIn("functools.partial", "\n".join(logs.output))
+        self.assertEqual(backend.stats["hooks_completed"], 9)
+
+    def test_configure(self):
+        """Check that hook changes are applied with the filters."""
+        libvmi = SimulatedLinuxLibvmi(nb_processes=1)
+        sim_domain = SimulatedDomain("nitro_test", 1)
+        generator = EventGenerator({0: 1}, libvmi.cr3s)
+        listener = Listener(sim_domain, SimulatedKVM(generator, 1), pid=0)
+        with patch.object(LinuxBackend, "load_syscall_table", return_value=["SyS_read", "SyS_write", "SyS_open"]):
+            backend = LinuxBackend(sim_domain, libvmi, listener)
+        callback = Mock()
+        backend.define_hook("read", callback)
+        with backend.configure():
+            backend.undefine_hook("read")
+            backend.define_hook("write", callback)
+            backend.define_hooks({"open": callback}, direction=SyscallDirection.exit)
+            listener.set_traps(True)
+            self.assertEqual(backend.hooks[SyscallDirection.enter], {"read": [callback]})
+            self.assertEqual(listener.vm_io.syscall_filters, {0})
+        self.assertEqual(backend.hooks[SyscallDirection.enter], {"write": [callback]})
+        self.assertEqual(backend.hooks[SyscallDirection.exit], {"open": [callback]})
+        self.assertEqual(listener.vm_io.syscall_filters, {1, 2})
+        self.assertTrue(listener.vm_io.trap_enabled)
+
+        # the changes made earlier in the same configuration are taken into account
+        with backend.configure():
+            backend.define_hook("read", callback)
+            backend.undefine_hook("read")
+            backend.undefine_hook("write")
+            with self.assertRaises(RuntimeError):
+                backend.undefine_hook("write")
+            with self.assertRaises(RuntimeError):
+                backend.undefine_hook("open", callback=Mock())
+        self.assertEqual(backend.hooks[SyscallDirection.enter], {})
+        self.assertEqual(listener.vm_io.syscall_filters, {2})
+
+    def test_metrics(self):
+        """Check that backend statistics and latencies are exposed."""
+        libvmi = SimulatedLinuxLibvmi(nb_processes=2)
+        sim_domain = SimulatedDomain("nitro_test", 1)
+        generator = EventGenerator({0: 1, 1: 1}, libvmi.cr3s)
+        listener = Listener(sim_domain, SimulatedKVM(generator, 1), pid=0)
+        with patch.object(LinuxBackend, "load_syscall_table", return_value=["SyS_read", "SyS_write"]):
+            backend = LinuxBackend(sim_domain, libvmi, listener, syscall_filtering=False)
+
+        def on_read(syscall, backend):
+            raise ValueError("hook failure")
+
+        backend.define_hook("read", on_read)
+        listener.set_traps(True)
+        count = 0
+        for event in listener.listen():
+            backend.process_event(event)
+            count += 1
+            if count == 20:
+                listener.stop(synchronous=False)
+
+        lines = collect_metrics(listener, backend).splitlines()
+        reads = backend.syscall_latency[SyscallDirection.enter, 0].count
+        self.assertIn('nitro_syscalls_total{direction="enter",syscall="read",nb="0"} %s'
+                      % float(reads), lines)
+        self.assertIn("nitro_hook_errors_total %s" % float(reads), lines)
+        self.assertIn("nitro_backend_misc_error_total %s" % float(reads), lines)
+        self.assertIn('nitro_hook_seconds_count{direction="enter",hook="%s"} %s'
+                      % (on_read.__qualname__, float(reads)), lines)
+
     def test_associate_process(self):
         """Test process association."""
 
@@ -126,6 +344,87 @@ class TestLinux(unittest.TestCase):
             process = backend.associate_process(init_task_mm_pgd + 0x100)
             self.assertIsNotNone(process)
 
+    def test_process_cache(self):
+        """Test that processes are cached by cr3 and invalidated."""
+        backend = LinuxBackend(domain, libvmi, listener)
+        init_task = translate_ksym2v("init_task")
+        mm_offset = get_offset("linux_mm")
+        pgd_offset = get_offset("linux_pgd")
+        tasks_offset = get_offset("linux_tasks")
+        other_task = 0x2000
+        memory = {
+            init_task + mm_offset: 0, # swapper has no mm
+            init_task + mm_offset + 8: 0,
+            init_task + tasks_offset: other_task + tasks_offset,
+            other_task + mm_offset: 0x6060,
+            0x6060 + pgd_offset: 0x7070,
+            other_task + tasks_offset: init_task + tasks_offset,
+        }
+
+        with patch.object(backend.libvmi, "read_addr_va", side_effect=lambda addr, pid: memory[addr]) as read, \
+             patch.object(backend.libvmi, "translate_kv2p", side_effect=lambda pgd: pgd + 0x100):
+            process = backend.associate_process(0x7170)
+            self.assertIs(backend.associate_process(0x7170), process)
+            self.assertEqual(backend.tasks, {0x7170: other_task})
+            self.assertEqual(backend.stats["process_cache_refresh"], 1)
+            self.assertEqual(backend.stats["process_cache_hit"], 1)
+            reads = read.call_count
+
+            # unknown address spaces trigger a new walk
+            self.assertIsNone(backend.associate_process(0x8000))
+            self.assertEqual(backend.stats["process_cache_refresh"], 2)
+            self.assertGreater(read.call_count, reads)
+
+            backend.invalidate_process(0x7170)
+            self.assertNotIn(0x7170, backend.processes)
+            backend.associate_process(0x7170)
+            self.assertEqual(backend.stats["process_cache_refresh"], 3)
+
+    def test_released_process(self):
+        """Check that processes releasing their address space are not reused."""
+        backend = LinuxBackend(domain, libvmi, listener)
+        init_task = translate_ksym2v("init_task")
+        mm_offset = get_offset("linux_mm")
+        pgd_offset = get_offset("linux_pgd")
+        tasks_offset = get_offset("linux_tasks")
+        dying_task = 0x2000
+        memory = {
+            init_task + mm_offset: 0,
+            init_task + mm_offset + 8: 0,
+            init_task + tasks_offset: dying_task + tasks_offset,
+            dying_task + mm_offset: 0x6060,
+            0x6060 + pgd_offset: 0x7070,
+            dying_task + tasks_offset: init_task + tasks_offset,
+        }
+
+        def create_process(libvmi, cr3, task, *args):
+            return Mock(cr3=cr3, task_struct=task)
+
+        with patch.object(backend.libvmi, "read_addr_va", side_effect=lambda addr, pid: memory[addr]), \
+             patch.object(backend.libvmi, "translate_kv2p", side_effect=lambda pgd: pgd + 0x100), \
+             patch("nitro.backends.linux.backend.LinuxProcess", side_effect=create_process):
+            process = backend.associate_process(0x7170)
+            syscall = Syscall(Mock(**{"sregs.cr3": 0x7170}), nb=60, backend=backend)
+            backend.process_releasing(syscall)
+            self.assertIs(syscall.process, process)
+            # the task still uses its address space
+            self.assertIs(backend.associate_process(0x7170), process)
+            self.assertEqual(backend.released_tasks, {0x7170: dying_task})
+
+            # the task exits and a new one gets the same page directory
+            new_task = 0x3000
+            memory.update({
+                dying_task + mm_offset: 0,
+                dying_task + mm_offset + 8: 0,
+                dying_task + tasks_offset: new_task + tasks_offset,
+                new_task + mm_offset: 0x8080,
+                0x8080 + pgd_offset: 0x7070,
+                new_task + tasks_offset: init_task + tasks_offset,
+            })
+            self.assertEqual(backend.associate_process(0x7170).task_struct, new_task)
+            self.assertEqual(backend.stats["process_cache_released"], 1)
+            self.assertEqual(backend.released_tasks, {})
+
     def test_check_caches_flushed(self):
         """Check that libvmi caches are flushed."""
         backend = LinuxBackend(domain, libvmi, listener)
@@ -138,20 +437,127 @@ class TestLinux(unittest.TestCase):
         libvmi.v2pcache_flush.assert_called_once_with()
         libvmi.pidcache_flush.assert_called_once_with()
         libvmi.rvacache_flush.assert_called_once_with()
-        libvmi.symcache_flush.assert_called_once_with()
+        # kernel symbols don't move
+        libvmi.symcache_flush.assert_not_called()
+
+    def test_cache_policy_generation(self):
+        """Check that caches are only flushed when an address space changes."""
+        vmi = Mock(spec=Libvmi, **{"get_offset.side_effect": get_offset,
+                                   "translate_ksym2v.side_effect": translate_ksym2v})
+        table = ["SyS_read"] + ["SyS_foo"] * 8 + ["SyS_mmap"]
+        with patch.object(LinuxBackend, "load_syscall_table", return_value=table):
+            backend = LinuxBackend(domain, vmi, listener,
+                                   cache_policy=CachePolicy.generation)
+
+        def process(direction, rax, cr3):
+            event = Mock(direction=direction, vcpu_nb=0, regs=Mock(rax=rax),
+                         sregs=Mock(cr3=cr3, **{"fs.base": 0, "gs.base": 0}))
+            event.copy.return_value = event
+            backend.process_event(event)
+
+        with patch.object(LinuxBackend, "associate_process"):
+            process(SyscallDirection.enter, 0, 0x1000)
+            process(SyscallDirection.exit, 0, 0x1000)
+            vmi.v2pcache_flush.assert_not_called()
+            process(SyscallDirection.enter, 9, 0x1000)
+            process(SyscallDirection.exit, 0, 0x1000)
+            vmi.v2pcache_flush.assert_called_once_with(0x1000)
+            # other address spaces are not affected
+            process(SyscallDirection.enter, 0, 0x2000)
+            self.assertEqual(vmi.v2pcache_flush.call_count, 1)
+            self.assertEqual(backend.stats["cache_flushes"], 1)
 
     def test_process_event(self):
         """Test that the event handler returns a syscall object with somewhat sensible content"""
         backend = LinuxBackend(domain, libvmi, listener)
-        event = Mock(direction=SyscallDirection.enter, vcpu_nb=0)
+        event = Mock(direction=SyscallDirection.enter, vcpu_nb=0, regs=Mock(rax=1))
+        event.copy.return_value = event
 
-        with patch.object(LinuxBackend, "associate_process"), \
-             patch.object(LinuxBackend, "get_syscall_name", return_value="SyS_write"):
+        with patch.object(LinuxBackend, "associate_process") as associate_process, \
+             patch.object(LinuxBackend, "resolve_syscall", return_value=("SyS_write", "write")) as resolve:
             syscall = backend.process_event(event)
+            # nothing is resolved until it is needed
+            associate_process.assert_not_called()
+            resolve.assert_not_called()
 
-        self.assertEqual(syscall.name, "write")
-        self.assertEqual(syscall.full_name, "SyS_write")
+            self.assertEqual(syscall.name, "write")
+            self.assertEqual(syscall.full_name, "SyS_write")
+            self.assertIs(syscall.process, associate_process.return_value)
+            with patch.object(LinuxBackend, "build_arguments") as build_arguments:
+                self.assertIs(syscall.args, build_arguments.return_value)
+            build_arguments.assert_called_once_with(event, associate_process.return_value, 1)
+            resolve.assert_called_once_with(1)
         self.assertIsInstance(syscall, Syscall)
+        self.assertEqual(backend.syscall_latency[SyscallDirection.enter, 1].count, 1)
+
+    def test_hooks_unlocked(self):
+        """Check that hooks run without holding the backend lock."""
+        with patch.object(LinuxBackend, "load_syscall_table", return_value=["SyS_read"]):
+            backend = LinuxBackend(domain, libvmi, Mock())
+        event = Mock(direction=SyscallDirection.enter, vcpu_nb=0, regs=Mock(rax=0))
+        event.copy.return_value = event
+        acquired = []
+
+        def try_lock(lock):
+            if lock.acquire(blocking=False):
+                lock.release()
+                acquired.append(True)
+
+        def hook(syscall, backend):
+            # another VCPU thread can process its event meanwhile
+            thread = threading.Thread(target=try_lock, args=(backend.lock,))
+            thread.start()
+            thread.join()
+
+        backend.define_hook("read", hook)
+        with patch.object(LinuxBackend, "associate_process"):
+            backend.process_event(event)
+        self.assertEqual(acquired, [True])
+        self.assertEqual(backend.stats["hooks_completed"], 1)
+
+    def test_syscall_pairing(self):
+        """Check that exits are paired with the enters of the same thread."""
+        backend = LinuxBackend(domain, libvmi, listener)
+        backend.pending_syscalls.size = 2
+        names = {0: ("SyS_read", "read"), 1: ("SyS_write", "write")}
+
+        def process(direction, vcpu_nb, tls, rax=0):
+            event = Mock(direction=direction, vcpu_nb=vcpu_nb, regs=Mock(rax=rax),
+                         sregs=Mock(cr3=0x1000, **{"fs.base": tls, "gs.base": 0}))
+            event.copy.return_value = event
+            return backend.process_event(event)
+
+        with patch.object(LinuxBackend, "associate_process"), \
+             patch.object(LinuxBackend, "resolve_syscall", side_effect=names.get):
+            # without exit hooks, only the number of the call is kept
+            process(SyscallDirection.enter, 0, 0x10, 1)
+            exit = process(SyscallDirection.exit, 0, 0x10)
+            self.assertEqual((exit.nb, exit.name, exit.args), (1, "write", None))
+
+            exit_hook = Mock(return_value=None)
+            backend.define_hook(CATCH_ALL, exit_hook, SyscallDirection.exit)
+            read = process(SyscallDirection.enter, 0, 0x10, 0)
+            write = process(SyscallDirection.enter, 1, 0x20, 1)
+            # the threads migrated between the VCPUs
+            self.assertIs(process(SyscallDirection.exit, 0, 0x20), write)
+            self.assertIs(process(SyscallDirection.exit, 1, 0x10), read)
+            exit_hook.assert_has_calls([call(write, backend), call(read, backend)])
+            self.assertEqual(backend.stats["hooks_completed"], backend.stats["hooks_processed"])
+            self.assertEqual(process(SyscallDirection.exit, 1, 0x10).name, "Unknown")
+
+            process(SyscallDirection.enter, 0, 0x10)
+            process(SyscallDirection.enter, 0, 0x10)
+            process(SyscallDirection.enter, 0, 0x20)
+            process(SyscallDirection.enter, 0, 0x30)
+            self.assertEqual(list(backend.pending_syscalls.pending),
+                             [(0x1000, 0x20, 0), (0x1000, 0x30, 0)])
+
+        self.assertEqual(backend.stats["syscall_orphan_exit"], 1)
+        self.assertEqual(backend.stats["syscall_orphan_enter"], 2)
+        self.assertEqual(backend.stats["syscall_pending_eviction"], 1)
+
+        backend.pending_syscalls.expire(float("inf"))
+        self.assertEqual(len(backend.pending_syscalls), 0)
 
     def test_clean_name(self):
         """Test that system call handler names are properly cleaned."""
@@ -0,0 +1,171 @@
+import os
+import sys
+import threading
+import unittest
+
+from unittest.mock import patch
+
+# local
+sys.path.insert(1, os.path.realpath('../..'))
+from nitro.listener import Listener
+from nitro.event import SyscallDirection
+from nitro.simulation import (SimulatedKVM, SimulatedVM, SimulatedDomain,
+                              EventGenerator, SimulatedLinuxLibvmi)
+
+def create_listener(nb_vcpu=2, syscalls=None):
+    libvmi = SimulatedLinuxLibvmi(nb_processes=4)
+    generator = EventGenerator(syscalls or {0: 1, 1: 1, 2: 1}, libvmi.cr3s)
+    domain = SimulatedDomain("nitro_test", nb_vcpu)
+    listener = Listener(domain, SimulatedKVM(generator, nb_vcpu), pid=0)
+    listener.set_traps(True)
+    return listener
+
+class TestListener(unittest.TestCase):
+    def test_listen(self):
+        """Check that the listener yields simulated events in enter/exit pairs."""
+        listener = create_listener(nb_vcpu=1)
+        events = []
+        for event in listener.listen():
+            events.append((event.direction, event.regs.rax))
+            if len(events) == 10:
+                listener.stop(synchronous=False)
+
+        self.assertEqual(len(events), 10)
+        for (enter, nb), (exit, _) in zip(events[::2], events[1::2]):
+            self.assertEqual(enter, SyscallDirection.enter)
+            self.assertEqual(exit, SyscallDirection.exit)
+            self.assertIn(nb, (0, 1, 2))
+
+    def test_syscall_filter(self):
+        """Check that only filtered system calls are reported."""
+        listener = create_listener()
+        listener.add_syscall_filter(1)
+        numbers = set()
+        for event in listener.listen():
+            if event.direction == SyscallDirection.enter:
+                numbers.add(event.regs.rax)
+                if len(numbers) > 1 or event.vcpu_nb == 1:
+                    listener.stop(synchronous=False)
+        self.assertEqual(numbers, {1})
+
+    def test_add_syscall_filters(self):
+        """Check that filters are added and removed in a single suspension of the domain."""
+        listener = create_listener()
+        listener.add_syscall_filter(1)
+        suspended = []
+        add_syscall_filter = listener.vm_io.add_syscall_filter
+
+        def check_suspended(syscall_nb):
+            suspended.append(listener.domain.suspended)
+            return add_syscall_filter(syscall_nb)
+
+        with patch.object(SimulatedVM, "add_syscall_filter", side_effect=check_suspended):
+            listener.add_syscall_filters([0, 1, 2])
+        self.assertEqual(suspended, [True, True])
+        self.assertEqual(listener.vm_io.syscall_filters, {0, 1, 2})
+        self.assertFalse(listener.domain.suspended)
+
+        suspended.clear()
+        remove_syscall_filter = listener.vm_io.remove_syscall_filter
+
+        def check_removal_suspended(syscall_nb):
+            suspended.append(listener.domain.suspended)
+            return remove_syscall_filter(syscall_nb)
+
+        with patch.object(SimulatedVM, "remove_syscall_filter",
+                          side_effect=check_removal_suspended):
+            listener.remove_syscall_filters([0, 2, 3])
+        self.assertEqual(suspended, [True, True])
+        self.assertEqual(listener.vm_io.syscall_filters, {1})
+
+    def test_configure(self):
+        """Check that configuration changes are applied at once."""
+        listener = create_listener()
+        listener.set_traps(False)
+        listener.add_syscall_filter(0)
+        listener.add_syscall_filter(1)
+        with patch.object(SimulatedDomain, "suspend", autospec=True,
+                          side_effect=SimulatedDomain.suspend) as suspend:
+            with listener.configure() as config:
+                listener.remove_syscall_filter(0)
+                listener.add_syscall_filter(2)
+                config.set_traps(True)
+                listener.add_syscall_filters([3, 4])
+                # nothing changes until the block exits
+                self.assertEqual(listener.vm_io.syscall_filters, {0, 1})
+                self.assertFalse(listener.vm_io.trap_enabled)
+            suspend.assert_called_once_with(listener.domain)
+        self.assertEqual(listener.vm_io.syscall_filters, {1, 2, 3, 4})
+        self.assertTrue(listener.vm_io.trap_enabled)
+        self.assertFalse(listener.domain.suspended)
+
+        with self.assertRaises(RuntimeError):
+            with listener.configure():
+                listener.set_traps(False)
+                listener.remove_syscall_filter(1)
+                raise RuntimeError("aborted")
+        self.assertEqual(listener.vm_io.syscall_filters, {1, 2, 3, 4})
+        self.assertTrue(listener.vm_io.trap_enabled)
+        self.assertIsNone(listener.configuration)
+
+    def test_listen_parallel(self):
+        """Check that every VCPU processes and resumes its own events."""
+        listener = create_listener(nb_vcpu=4)
+        lock = threading.Lock()
+        seen = {}
+
+        def callback(event):
+            with lock:
+                seen[event.vcpu_nb] = seen.get(event.vcpu_nb, 0) + 1
+                if all(seen.get(i, 0) >= 10 for i in range(4)):
+                    listener.stop(synchronous=False)
+
+        listener.listen_parallel(callback)
+        self.assertEqual(set(seen), {0, 1, 2, 3})
+        for vcpu_io in listener.vcpus_io:
+            self.assertEqual(vcpu_io.ioctls["get_event"],
+                             vcpu_io.ioctls["continue_vm"])
+
+    def test_listen_parallel_error(self):
+        """Check that callback errors stop the listener and are raised."""
+        listener = create_listener()
+
+        def callback(event):
+            raise RuntimeError("hook failure")
+
+        with self.assertRaises(RuntimeError):
+            listener.listen_parallel(callback)
+
+    def test_latency_report(self):
+        """Check that queue waits and VCPU pauses are measured."""
+        listener = create_listener()
+        count = 0
+        for event in listener.listen():
+            count += 1
+            if count == 20:
+                listener.stop(synchronous=False)
+
+        report = listener.latency_report()
+        self.assertEqual(report["queue_wait"]["count"], listener.queue_wait.count)
+        self.assertGreaterEqual(report["queue_wait"]["count"], 20)
+        self.assertEqual(set(report["vcpu_paused"]), {0, 1})
+        for vcpu_io in listener.vcpus_io:
+            self.assertEqual(report["vcpu_paused"][vcpu_io.vcpu_nb]["count"],
+                             vcpu_io.ioctls["continue_vm"])
+
+    def test_event_buffers_recycled(self):
+        """Check that released event buffers are reused and copies kept."""
+        listener = create_listener(nb_vcpu=1)
+        buffers = set()
+        copies = []
+        for event in listener.listen():
+            buffers.add(id(event.raw))
+            copies.append((event.copy(), event.regs.rax, event.sregs.cr3))
+            if len(copies) == 20:
+                listener.stop(synchronous=False)
+
+        self.assertLessEqual(len(buffers), 2)
+        for copy, rax, cr3 in copies:
+            self.assertFalse(copy.pooled)
+            self.assertEqual(copy.regs.rax, rax)
+            self.assertEqual(copy.sregs.cr3, cr3)
@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+import urllib.error
+import urllib.request
+
+# local
+sys.path.insert(1, os.path.realpath('../..'))
+from nitro.metrics import LatencyHistogram, MetricsServer, collect_metrics, escape_label
+from nitro.listener import Listener
+from nitro.simulation import (SimulatedKVM, SimulatedDomain, EventGenerator,
+                              SimulatedLinuxLibvmi)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        """Check that percentiles are estimated from the buckets."""
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.as_dict()["p99_us"], 0)
+        for _ in range(98):
+            histogram.record(10e-6)
+        histogram.record(1e-3)
+        histogram.record(0.5)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.max, 0.5)
+        # within a quarter of a power of two
+        self.assertTrue(10e-6 <= histogram.percentile(0.5) <= 12.5e-6)
+        self.assertTrue(1e-3 <= histogram.percentile(0.99) <= 1.25e-3)
+        self.assertEqual(histogram.percentile(1), 0.5)
+        summary = histogram.as_dict()
+        self.assertAlmostEqual(summary["mean_us"], (98 * 10 + 1000 + 500000) / 100)
+        self.assertAlmostEqual(summary["max_us"], 500000)
+
+    def test_buckets(self):
+        """Check that durations fall in the bucket they are bounded by."""
+        for duration in (0, 0.5e-6, 1e-6, 1.9e-6, 3e-6, 123e-6, 7.5):
+            bucket = LatencyHistogram.bucket(duration)
+            self.assertLess(duration, LatencyHistogram.upper_bound(bucket))
+            if bucket:
+                self.assertGreaterEqual(duration, LatencyHistogram.upper_bound(bucket - 1))
+        histogram = LatencyHistogram()
+        histogram.record(10 ** 5)
+        self.assertEqual(histogram.buckets[-1], 1)
+
+
+def run_listener(nb_events):
+    libvmi = SimulatedLinuxLibvmi(nb_processes=4)
+    generator = EventGenerator({0: 1}, libvmi.cr3s)
+    listener = Listener(SimulatedDomain("nitro_test", 2), SimulatedKVM(generator, 2), pid=0)
+    listener.set_traps(True)
+    count = 0
+    for _ in listener.listen():
+        count += 1
+        if count == nb_events:
+            listener.stop(synchronous=False)
+    return listener
+
+
+class TestMetrics(unittest.TestCase):
+    def test_collect_metrics(self):
+        """Check that listener metrics are formatted for Prometheus."""
+        listener = run_listener(10)
+        lines = collect_metrics(listener).splitlines()
+        self.assertIn("# TYPE nitro_vcpu_events_total counter", lines)
+        events = sum(float(line.split()[1]) for line in lines
+                     if line.startswith("nitro_vcpu_events_total{"))
+        self.assertEqual(events, sum(vcpu.ioctls["continue_vm"] for vcpu in listener.vcpus_io))
+        self.assertIn('nitro_queue_wait_seconds{quantile="0.99"} %s'
+                      % float(listener.queue_wait.percentile(0.99)), lines)
+        self.assertIn("nitro_queue_wait_seconds_count %s" % float(listener.queue_wait.count), lines)
+        self.assertIn("nitro_queue_depth 0.0", lines)
+        self.assertEqual(escape_label('a"b\\c\n'), 'a\\"b\\\\c\\n')
+
+    def test_server(self):
+        """Check that metrics are served over HTTP."""
+        listener = run_listener(4)
+        server = MetricsServer(listener, address=("127.0.0.1", 0))
+        server.start()
+        self.addCleanup(server.stop)
+        url = "http://{}:{}".format(*server.address)
+        with urllib.request.urlopen(url + "/metrics") as response:
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+            self.assertIn(b"nitro_process_cpu_seconds_total", response.read())
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + "/other")
@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+import unittest
+from collections import defaultdict
+
+from unittest.mock import Mock
+
+# local
+sys.path.insert(1, os.path.realpath('../..'))
+from nitro.backends.process import Process, PageCache, EventPageCaches
+from nitro.event import NitroEvent
+from nitro.simulation import SimulatedMemory
+
+class SimpleProcess(Process):
+    __slots__ = ("pid", "name")
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.memory = SimulatedMemory()
+        self.memory.write(0x1ff8, bytes(range(16)))
+        self.libvmi = Mock(**{
+            "read_va.side_effect": lambda addr, pid, count: (self.memory.read(addr, count), count),
+            "write_va.side_effect": lambda addr, pid, buffer: self.memory.write(addr, buffer),
+        })
+        self.stats = defaultdict(int)
+        self.cache = PageCache(self.stats)
+        self.process = SimpleProcess(self.libvmi, 0x1000, self.cache)
+        self.process.pid = 4
+
+    def test_read(self):
+        """Check that overlapping reads are served from the cached pages."""
+        self.assertEqual(self.cache.read(self.libvmi, 0x1ff8, 4, 16), bytes(range(16)))
+        self.assertEqual(self.cache.read(self.libvmi, 0x1ffc, 4, 8), bytes(range(4, 12)))
+        self.assertEqual(self.cache.read(self.libvmi, 0x2000, 4, 4), bytes(range(8, 12)))
+        self.assertEqual(self.libvmi.read_va.call_count, 2)
+        self.assertEqual(self.stats["page_cache_miss"], 2)
+        self.assertEqual(self.stats["page_cache_hit"], 3)
+        # address spaces are cached separately
+        self.cache.read(self.libvmi, 0x2000, 5, 4)
+        self.assertEqual(self.stats["page_cache_miss"], 3)
+
+        self.cache.clear()
+        self.cache.read(self.libvmi, 0x2000, 4, 4)
+        self.assertEqual(self.stats["page_cache_miss"], 4)
+
+    def test_write(self):
+        """Check that writes invalidate the cached pages."""
+        self.assertEqual(self.process.read_memory(0x2000, 2), b"\x08\x09")
+        self.process.write_memory(0x2000, b"\xff")
+        self.assertEqual(self.process.read_memory(0x2000, 2), b"\xff\x09")
+        self.assertEqual(self.stats["page_cache_miss"], 2)
+
+    def test_event_caches(self):
+        """Check that pages are only served to the event they were read for."""
+        caches = EventPageCaches()
+        process = SimpleProcess(self.libvmi, 0x1000, caches)
+        process.pid = 4
+        event = NitroEvent(Mock(), Mock())
+        event.page_cache = PageCache(self.stats)
+        caches.event = event
+        self.assertEqual(process.read_memory(0x2000, 1), b"\x08")
+        self.memory.write(0x2000, b"\xff")
+        self.assertEqual(process.read_memory(0x2000, 1), b"\x08")
+
+        # the hooks of another VCPU's event run on another thread
+        reads = []
+        def read():
+            reads.append(process.read_memory(0x2000, 1))
+            caches.event = NitroEvent(Mock(), Mock())
+            reads.append(process.read_memory(0x2000, 1))
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        self.assertEqual(reads, [b"\xff", b"\xff"])
+
+        event.release()
+        self.assertIsNone(event.page_cache)
+        self.assertEqual(process.read_memory(0x2000, 1), b"\xff")
@@ -0,0 +1,477 @@
+import os
+import sys
+import struct
+import unittest
+import tempfile
+
+from unittest.mock import Mock, patch, call
+
+# We do not want to import libvirt
+sys.modules["libvirt"] = Mock()
+
+# local
+sys.path.insert(1, os.path.realpath('../..'))
+from nitro.backends.windows import WindowsBackend
+from nitro.backends.windows.backend import EprocessIndex
+from nitro.backends.windows.process import WindowsProcess
+from nitro.backends.windows.arguments import WindowsArgumentMap
+from nitro.event import SyscallType
+from nitro.syscall import Syscall
+from nitro.backends.windows.types import (ObjectAttributes, FileBasicInformation,
+                                          RtlUserProcessParameters)
+from nitro.backends import layout_cache
+from nitro.simulation import SimulatedMemory
+from libvmi import Libvmi, LibvmiError
+
+NTOSKRNL_BASE = 0xfffff80002a00000
+
+SYMBOLS = {
+    "syscall_table": [
+        ["r", {"divider": "Table 0 @ 0xfffff80002a8b300"}],
+        ["r", {"divider": None, "entry": 0x52, "symbol": {"symbol": "nt!NtCreateFile"}}],
+        ["r", {"divider": None, "entry": 0x30, "symbol": {"symbol": "nt!NtOpenFile"}}],
+        ["r", {"divider": "Table 1 @ 0xfffff960001a1c00"}],
+        ["r", {"divider": None, "entry": 0x0, "symbol": {"symbol": "win32k!NtUserGetThreadState"}}],
+    ],
+    "offsets": {
+        "EPROCESS": {"ActiveProcessLinks": 0x188, "UniqueProcessId": 0x180},
+        "KPROCESS": {"DirectoryTableBase": 0x28},
+    }
+}
+
+PS_ACTIVE_PROCESS_HEAD = 0xfffff80002c5a940
+EPROCESS_BASE = 0xfffffa8000c00000
+PS_LOADED_MODULE_LIST = 0xfffff80002c78e50
+LDR_ENTRY_BASE = 0xfffffa8000a00000
+WIN32K_BASE = 0xfffff96000080000
+
+def create_header(timestamp=0x4ce7951a, size=0x5e7000, checksum=0x55d8b0):
+    header = bytearray(0x60)
+    struct.pack_into("<4s4xI", header, 0, b"PE\0\0", timestamp)
+    struct.pack_into("<I", header, 0x18 + 0x38, size)
+    struct.pack_into("<I", header, 0x18 + 0x40, checksum)
+    return bytes(header)
+
+def create_module_list(memory, modules):
+    """Write a loaded module list made of (base, name) in memory"""
+    links = [PS_LOADED_MODULE_LIST]
+    for i, (base, name) in enumerate(modules):
+        entry = LDR_ENTRY_BASE + i * 0x100
+        name = name.encode("utf-16-le")
+        memory.write(entry + 0x30, struct.pack("<Q", base))
+        memory.write(entry + 0x58, struct.pack("<H6xQ", len(name), entry + 0x80))
+        memory.write(entry + 0x80, name)
+        links.append(entry)
+    for i, entry in enumerate(links):
+        memory.write(entry, struct.pack("<QQ", links[(i + 1) % len(links)], links[i - 1]))
+
+def create_libvmi(header, win32k_header=None, memory=None):
+    """libvmi handle on ``memory``, where ntoskrnl and win32k are loaded"""
+    if memory is None:
+        memory = SimulatedMemory()
+    for base, image_header in ((NTOSKRNL_BASE, header),
+                               (WIN32K_BASE, win32k_header or header)):
+        memory.write(base + 0x3c, struct.pack("<I", 0x100))
+        memory.write(base + 0x100, image_header)
+    create_module_list(memory, [(NTOSKRNL_BASE, "ntoskrnl.exe"), (WIN32K_BASE, "win32k.sys")])
+    if not any(memory.read(PS_ACTIVE_PROCESS_HEAD, 16)):
+        create_process_list(memory, [])
+
+    def read_va(addr, pid, count):
+        # pages that were never written are not mapped
+        if addr // memory.PAGE_SIZE not in memory.pages:
+            return b"", 0
+        return memory.read(addr, count), count
+
+    offsets = {"win_ntoskrnl_va": NTOSKRNL_BASE, "win_tasks": 0x188, "win_pid": 0x180}
+    symbols = {"PsActiveProcessHead": PS_ACTIVE_PROCESS_HEAD,
+               "PsLoadedModuleList": PS_LOADED_MODULE_LIST}
+    return Mock(spec=Libvmi, **{
+        "get_offset.side_effect": lambda name: offsets.get(name, 0),
+        "translate_ksym2v.side_effect": symbols.__getitem__,
+        "read_32.side_effect": lambda addr, pid: struct.unpack("<I", memory.read(addr, 4))[0],
+        "read_addr_va.side_effect": lambda addr, pid: struct.unpack("<Q", memory.read(addr, 8))[0],
+        "read_va.side_effect": read_va,
+    })
+
+def create_process_list(memory, processes):
+    """Write a process list made of (dtb, pid) in memory"""
+    links = [PS_ACTIVE_PROCESS_HEAD]
+    for i, (dtb, pid) in enumerate(processes):
+        eproc = EPROCESS_BASE + i * 0x1000
+        memory.write(eproc + 0x28, struct.pack("<Q", dtb))
+        memory.write(eproc + 0x180, struct.pack("<Q", pid))
+        links.append(eproc + 0x188)
+    for i, entry in enumerate(links):
+        memory.write(entry, struct.pack("<QQ", links[(i + 1) % len(links)], links[i - 1]))
+
+def create_memory_libvmi(memory):
+    return create_libvmi(create_header(), memory=memory)
+
+domain = Mock(**{"vcpus.return_value": [[2]]})
+
+class TestWindows(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        patcher = patch.dict(os.environ, {"NITRO_CACHE_DIR": self.cache_dir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.cache_dir.cleanup)
+
+    def test_kernel_id(self):
+        """Check that the kernel is identified by the PE headers of ntoskrnl and win32k."""
+        win32k_header = create_header(0x4ce79b2e, 0x3a1000, 0x3a0c5d)
+        libvmi = create_libvmi(create_header(), win32k_header)
+        with patch.object(WindowsBackend, "load_symbols"):
+            backend = WindowsBackend(domain, libvmi, Mock())
+        kernel_id = "ntoskrnl-4CE7951A5e7000-0055d8b0_win32k-4CE79B2E3a1000-003a0c5d"
+        self.assertEqual(backend.get_kernel_id(), kernel_id)
+        libvmi.read_va.assert_any_call(NTOSKRNL_BASE + 0x100, 0, 0x60)
+        libvmi.read_va.assert_any_call(WIN32K_BASE + 0x100, 0, 0x60)
+
+        # win32k is only mapped in the address space of session processes
+        memory = SimulatedMemory()
+        create_process_list(memory, [(0x187000, 4), (0x2000, 200)])
+        backend.libvmi = create_libvmi(create_header(), win32k_header, memory)
+        read_va = backend.libvmi.read_va.side_effect
+        def read_session_va(addr, pid, count):
+            if WIN32K_BASE <= addr < WIN32K_BASE + 0x1000 and pid != 200:
+                raise LibvmiError("VMI_FAILURE")
+            return read_va(addr, pid, count)
+        backend.libvmi.read_va.side_effect = read_session_va
+        self.assertEqual(backend.get_kernel_id(), kernel_id)
+
+        backend.libvmi = create_libvmi(bytes(0x60))
+        self.assertIsNone(backend.get_kernel_id())
+        backend.libvmi = create_libvmi(create_header(), bytes(0x60))
+        self.assertIsNone(backend.get_kernel_id())
+
+    def test_symbols_cache(self):
+        """Check that cached symbols are used instead of dumping the memory."""
+        libvmi = create_libvmi(create_header())
+        with patch.object(WindowsBackend, "extract_symbols", return_value=SYMBOLS) as extract:
+            WindowsBackend(domain, libvmi, Mock())
+            backend = WindowsBackend(domain, libvmi, Mock())
+        extract.assert_called_once_with()
+        # the service tables could not be read
+        self.assertEqual(backend.symbols, dict(SYMBOLS, argument_tables=[None, None]))
+        self.assertEqual(backend.sdt[0]["ServiceTable"][0x52], "nt!NtCreateFile")
+        self.assertEqual(backend.sdt[1]["ServiceTable"][0x0], "win32k!NtUserGetThreadState")
+        self.assertIsNotNone(layout_cache.load_layout("windows", backend.get_kernel_id()))
+
+    def test_layout_cache_failure(self):
+        """Check that no temporary file is left when a layout cannot be stored."""
+        with self.assertRaises(TypeError):
+            layout_cache.store_layout("windows", "kernel", {"symbols": object()})
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir.name, "windows")), [])
+        self.assertIsNone(layout_cache.load_layout("windows", "kernel"))
+
+    def test_resolve_syscall(self):
+        """Check that system call numbers are resolved in both tables."""
+        libvmi = create_libvmi(create_header())
+        with patch.object(WindowsBackend, "extract_symbols", return_value=SYMBOLS):
+            backend = WindowsBackend(domain, libvmi, Mock())
+        self.assertEqual(backend.resolve_syscall(0x52), ("nt!NtCreateFile", "NtCreateFile"))
+        self.assertEqual(backend.resolve_syscall(0x1000), ("win32k!NtUserGetThreadState", "NtUserGetThreadState"))
+        self.assertEqual(backend.resolve_syscall(0x31), ("Table0!Unknown", "Unknown"))
+        self.assertEqual(backend.resolve_syscall(0x2000), ("Table2!Unknown", "Unknown"))
+        self.assertEqual(backend.get_syscall_name(0x30), "nt!NtOpenFile")
+
+    def test_process_cache(self):
+        """Check that processes are evicted and invalidated."""
+        libvmi = create_libvmi(create_header())
+        with patch.object(WindowsBackend, "extract_symbols", return_value=SYMBOLS):
+            backend = WindowsBackend(domain, libvmi, Mock(), process_cache_size=2)
+
+        def find_eprocess(cr3):
+            return Mock(cr3=cr3, pid=cr3 >> 12)
+
+        with patch.object(WindowsBackend, "find_eprocess", side_effect=find_eprocess) as find:
+            first = backend.associate_process(0x1000)
+            backend.associate_process(0x2000)
+            self.assertIs(backend.associate_process(0x1000), first)
+            backend.associate_process(0x3000)
+            self.assertEqual(list(backend.processes.by_cr3), [0x1000, 0x3000])
+            self.assertIs(backend.processes.get_by_pid(1), first)
+            self.assertIsNone(backend.processes.get_by_pid(2))
+            self.assertEqual(find.call_count, 3)
+
+            syscall = Mock(process=first, args=[0xffffffffffffffff])
+            backend.process_terminating(syscall)
+            self.assertIsNone(backend.processes.get_by_pid(1))
+            # other processes are checked again when they are next used
+            syscall.args = [0x4]
+            backend.process_terminating(syscall)
+            self.assertEqual(len(backend.processes), 1)
+            with patch.object(EprocessIndex, "is_current", side_effect=[True, False]) as is_current:
+                third = backend.associate_process(0x3000)
+                self.assertIs(backend.associate_process(0x3000), third)
+                backend.process_terminating(syscall)
+                self.assertIsNot(backend.associate_process(0x3000), third)
+            self.assertEqual(is_current.call_count, 2)
+            self.assertEqual(find.call_count, 4)
+
+        self.assertEqual(backend.stats["process_cache_hit"], 4)
+        self.assertEqual(backend.stats["process_cache_miss"], 3)
+        self.assertEqual(backend.stats["process_cache_eviction"], 1)
+        self.assertEqual(backend.stats["process_cache_invalidation"], 2)
+        self.assertEqual(backend.stats["process_cache_stale"], 1)
+
+    def test_required_filters(self):
+        """Check that NtTerminateProcess is trapped with the hooks."""
+        syscall_table = list(SYMBOLS["syscall_table"])
+        syscall_table.insert(1, ["r", {"divider": None, "entry": 0x29,
+                                       "symbol": {"symbol": "nt!NtTerminateProcess"}}])
+        listener = Mock()
+        with patch.object(WindowsBackend, "extract_symbols",
+                          return_value=dict(SYMBOLS, syscall_table=syscall_table)):
+            backend = WindowsBackend(domain, create_libvmi(create_header()), listener)
+        backend.define_hook("NtCreateFile", Mock())
+        listener.add_syscall_filters.assert_called_once_with([0x29, 0x52])
+
+    def test_eprocess_index(self):
+        """Check that the process list is indexed and updated from its tail."""
+        memory = SimulatedMemory()
+        create_process_list(memory, [(0x187000, 4), (0x2000, 200), (0x3000, 300)])
+        libvmi = create_memory_libvmi(memory)
+        with patch.object(WindowsBackend, "extract_symbols", return_value=SYMBOLS):
+            backend = WindowsBackend(domain, libvmi, Mock())
+        index = backend.eprocesses
+        libvmi.read_va.reset_mock()
+
+        self.assertEqual(index.find_by_dtb(0x2000), (EPROCESS_BASE + 0x1000, 200))
+        self.assertEqual(index.find_by_pid(300), (EPROCESS_BASE + 0x2000, 0x3000))
+        self.assertEqual(backend.stats["eprocess_index_update"], 1)
+        self.assertEqual(backend.stats["eprocess_index_refresh"], 0)
+        # one read per process, and one to check the known process
+        self.assertEqual(libvmi.read_va.call_count, 4)
+
+        create_process_list(memory, [(0x187000, 4), (0x2000, 200), (0x3000, 300), (0x4000, 400)])
+        libvmi.read_va.reset_mock()
+        self.assertEqual(index.find_by_pid(400), (EPROCESS_BASE + 0x3000, 0x4000))
+        self.assertEqual(backend.stats["eprocess_index_refresh"], 0)
+        self.assertEqual(libvmi.read_va.call_count, 2)
+
+        # a process replaced by an older entry is found by a new walk
+        create_process_list(memory, [(0x187000, 4), (0x4000, 500), (0x3000, 300)])
+        self.assertEqual(index.find_by_pid(500), (EPROCESS_BASE + 0x1000, 0x4000))
+        self.assertEqual(backend.stats["eprocess_index_refresh"], 1)
+        self.assertIsNone(index.find_by_pid(400))
+        self.assertIsNone(index.find_by_dtb(0x2000))
+
+    def test_eprocess_index_stale(self):
+        """Check that the entries of terminated processes are not returned."""
+        memory = SimulatedMemory()
+        create_process_list(memory, [(0x187000, 4), (0x2000, 200), (0x3000, 300)])
+        libvmi = create_memory_libvmi(memory)
+        with patch.object(WindowsBackend, "extract_symbols", return_value=SYMBOLS):
+            backend = WindowsBackend(domain, libvmi, Mock())
+        index = backend.eprocesses
+        self.assertEqual(index.find_by_dtb(0x2000), (EPROCESS_BASE + 0x1000, 200))
+
+        # the EPROCESS memory is reused by a process with another pid
+        create_process_list(memory, [(0x187000, 4), (0x2000, 600), (0x3000, 300)])
+        self.assertEqual(index.find_by_dtb(0x2000), (EPROCESS_BASE + 0x1000, 600))
+        self.assertEqual(backend.stats["eprocess_index_stale"], 1)
+        self.assertIsNone(index.find_by_pid(200))
+
+        # the process is unlinked but its EPROCESS is left untouched
+        create_process_list(memory, [(0x187000, 4), (0x2000, 600), (0x2000, 700)])
+        memory.write(EPROCESS_BASE + 0x188, struct.pack("<Q", EPROCESS_BASE + 0x2188))
+        memory.write(EPROCESS_BASE + 0x2188, struct.pack("<QQ", PS_ACTIVE_PROCESS_HEAD,
+                                                          EPROCESS_BASE + 0x188))
+        self.assertEqual(index.find_by_dtb(0x2000), (EPROCESS_BASE + 0x2000, 700))
+        self.assertEqual(backend.stats["eprocess_index_stale"], 2)
+
+        # terminated processes are dropped from the index
+        process = Mock(cr3=0x2000, pid=700)
+        backend.process_terminating(Mock(process=process, args=[0xffffffffffffffff]))
+        self.assertNotIn(0x2000, index.by_dtb)
+        self.assertNotIn(700, index.by_pid)
+        backend.process_terminating(Mock(process=process, args=[0x4]))
+        self.assertIn(0x3000, index.by_dtb)
+
+        # the memory of the process is unmapped
+        del memory.pages[(EPROCESS_BASE + 0x1000) // memory.PAGE_SIZE]
+        self.assertFalse(index.is_current(EPROCESS_BASE + 0x1000, 0x2000, 600))
+        with self.assertRaises(RuntimeError):
+            index.read_entry(EPROCESS_BASE + 0x1188)
+
+    def test_get_process_by_pid(self):
+        """Check that processes are found by pid and cached."""
+        memory = SimulatedMemory()
+        create_process_list(memory, [(0x187000, 4), (0x2000, 200)])
+        libvmi = create_memory_libvmi(memory)
+        with patch.object(WindowsBackend, "extract_symbols", return_value=SYMBOLS):
+            backend = WindowsBackend(domain, libvmi, Mock())
+        with patch("nitro.backends.windows.backend.WindowsProcess") as process_class:
+            process_class.return_value = Mock(cr3=0x2000, pid=200)
+            process = backend.get_process_by_pid(200)
+            self.assertIs(backend.associate_process(0x2000), process)
+            self.assertIsNone(backend.get_process_by_pid(300))
+        process_class.assert_called_once_with(libvmi, 0x2000, EPROCESS_BASE + 0x1000, backend.symbols,
+                                              200, backend.lock, backend.page_cache)
+
+    def test_time_libvmi(self):
+        """Check that the reads of the process index are timed as well."""
+        memory = SimulatedMemory()
+        create_process_list(memory, [(0x187000, 4), (0x2000, 200)])
+        libvmi = create_memory_libvmi(memory)
+        with patch.object(WindowsBackend, "extract_symbols", return_value=SYMBOLS):
+            backend = WindowsBackend(domain, libvmi, Mock(), time_libvmi=True)
+        reads = backend.stats["libvmi_reads"]
+        self.assertEqual(backend.eprocesses.find_by_pid(200), (EPROCESS_BASE + 0x1000, 0x2000))
+        self.assertGreater(backend.stats["libvmi_reads"], reads)
+
+    def test_lazy_process(self):
+        """Check that process fields are only read when accessed."""
+        symbols = {"offsets": {"EPROCESS": {"ImageFileName": 0x2e0, "UniqueProcessId": 0x180,
+                                            "InheritedFromUniqueProcessId": 0x290,
+                                            "Wow64Process": 0x320}}}
+        libvmi = Mock(spec=Libvmi, **{"read_str_va.return_value": "notepad.exe",
+                                      "read_addr_va.return_value": 0x10})
+        process = WindowsProcess(libvmi, 0x2000, EPROCESS_BASE, symbols, pid=200)
+        self.assertEqual(process.pid, 200)
+        libvmi.read_addr_va.assert_not_called()
+
+        self.assertEqual(process.as_dict(["name", "pid", "parent_pid", "iswow64"]),
+                         {"name": "notepad.exe", "pid": 200, "parent_pid": 0x10, "iswow64": True})
+        self.assertEqual(process.name, "notepad.exe")
+        libvmi.read_str_va.assert_called_once_with(EPROCESS_BASE + 0x2e0, 0)
+        self.assertEqual(libvmi.read_addr_va.call_count, 2)
+
+    def test_out_arguments(self):
+        """Check that OUT arguments are recorded at enter and read at exit."""
+        libvmi = create_libvmi(create_header())
+        listener = Mock()
+        with patch.object(WindowsBackend, "extract_symbols", return_value=SYMBOLS):
+            backend = WindowsBackend(domain, libvmi, listener)
+        backend.define_out_argument("NtCreateFile", 0)
+        backend.define_out_argument("NtCreateFile", 3, "<I")
+        listener.add_syscall_filters.assert_called_with([0x52])
+        with self.assertRaises(RuntimeError):
+            backend.define_out_argument("NtUnknown", 0)
+        process = Mock(**{"read_memory.side_effect": [struct.pack("<Q", 0x44),
+                                                      RuntimeError("unmapped")]})
+        syscall = Syscall(Mock(), "nt!NtCreateFile", "NtCreateFile", process,
+                          [0x1000, 0, 0, 0x2000], nb=0x52)
+        backend.record_out_arguments(syscall)
+        process.read_memory.assert_not_called()
+
+        # the arguments may be overwritten before the call returns
+        syscall.args = None
+        backend.capture_out_arguments(syscall)
+        self.assertEqual(syscall.out, {0: 0x44, 3: None})
+        self.assertEqual(process.read_memory.call_args_list, [call(0x1000, 8), call(0x2000, 4)])
+        self.assertEqual(backend.stats["out_argument_failure"], 1)
+        self.assertEqual(syscall.as_dict()["out"], {0: 0x44, 3: None})
+
+    def test_modify_at_exit(self):
+        """Check that registers modified at exit go to the VCPU of the exit."""
+        enter_event = Mock(type=SyscallType.syscall)
+        exit_event = Mock(type=SyscallType.syscall)
+        syscall = Syscall(enter_event, nb=0x52)
+        syscall.args = WindowsArgumentMap(enter_event, Mock(), 11)
+        syscall.event = exit_event
+        syscall.args[0] = 0x10
+        exit_event.update_register.assert_called_once_with("rcx", 0x10)
+        enter_event.update_register.assert_not_called()
+
+class TestTypes(unittest.TestCase):
+    def create_process(self, memory):
+        return Mock(**{"read_memory.side_effect": memory.read})
+
+    def test_object_attributes(self):
+        """Check that structures are read at once."""
+        memory = SimulatedMemory()
+        name = "\\??\\C:\\test.txt".encode("utf-16-le")
+        memory.write(0x1000, struct.pack("<I4xQQ", 0x30, 0x44, 0x2000))
+        memory.write(0x2000, struct.pack("<HH4xQ", len(name), len(name) + 2, 0x3000))
+        memory.write(0x3000, name)
+        process = self.create_process(memory)
+        obj = ObjectAttributes(0x1000, process)
+        self.assertEqual(obj.RootDirectory, 0x44)
+        self.assertEqual(obj.ObjectName.Buffer, "\\??\\C:\\test.txt")
+        self.assertEqual(obj.ObjectName.MaximumLength, len(name) + 2)
+        self.assertEqual(process.read_memory.call_count, 3)
+
+    def test_nested(self):
+        """Check that nested and overlapping fields are decoded from the same read."""
+        memory = SimulatedMemory()
+        memory.write(0x1000, struct.pack("<qqqqI", 1, 2, 3, 0x100000002, 0x20))
+        process = self.create_process(memory)
+        info = FileBasicInformation(0x1000, process)
+        self.assertEqual(info.LastAccessTime.QuadPart, 2)
+        self.assertEqual(info.ChangeTime.LowPart, 2)
+        self.assertEqual(info.ChangeTime.HighPart, 1)
+        self.assertEqual(info.FileAttributes, 0x20)
+        process.read_memory.assert_called_once_with(0x1000, 0x24)
+
+        memory.write(0x2000 + 0x60, struct.pack("<HH4xQ", 4, 6, 0x3000))
+        memory.write(0x2000 + 0x70, struct.pack("<HH4xQ", 2, 4, 0x3010))
+        memory.write(0x3000, "ab".encode("utf-16-le"))
+        memory.write(0x3010, "c".encode("utf-16-le"))
+        process = self.create_process(memory)
+        parameters = RtlUserProcessParameters(0x2000, process)
+        self.assertEqual(parameters.ImagePathName.Buffer, "ab")
+        self.assertEqual(parameters.CommandLine.Buffer, "c")
+        self.assertEqual(process.read_memory.call_args_list[0], call(0x2060, 0x20))
+        self.assertEqual(process.read_memory.call_count, 3)
+
+class TestArguments(unittest.TestCase):
+    def test_argument_table(self):
+        """Check that the number of arguments is read from the service table."""
+        memory = SimulatedMemory()
+        entries = [0x1000 << 4] * 0x53
+        entries[0x52] = (0x2000 << 4) | 7
+        memory.write(0xfffff80002a8b300, struct.pack("<83I", *entries))
+        memory.write(0xfffff960001a1c00, bytes(4))
+        libvmi = create_memory_libvmi(memory)
+        with tempfile.TemporaryDirectory() as cache_dir, \
+             patch.dict(os.environ, {"NITRO_CACHE_DIR": cache_dir}), \
+             patch.object(WindowsBackend, "extract_symbols", return_value=SYMBOLS):
+            backend = WindowsBackend(domain, libvmi, Mock())
+            self.assertEqual(backend.get_argument_count(0x52), 11)
+            self.assertEqual(backend.get_argument_count(0x30), 4)
+            self.assertEqual(backend.get_argument_count(0x1000), 4)
+            self.assertIsNone(backend.get_argument_count(0x1001))
+
+            # after a reboot, the table is elsewhere and the cached counts are used
+            memory.write(0xfffff80002a8b300, bytes(83 * 4))
+            backend = WindowsBackend(domain, libvmi, Mock())
+        self.assertEqual(backend.get_argument_count(0x52), 11)
+        self.assertEqual(backend.get_argument_count(0x1000), 4)
+
+    def test_snapshot(self):
+        """Check that arguments are read once, stack arguments in one read."""
+        memory = SimulatedMemory()
+        memory.write(0x8000 + 0x28, struct.pack("<3Q", 5, 6, 7))
+        process = Mock(**{"read_memory.side_effect": memory.read})
+        registers = {"rcx": 1, "rdx": 2, "r8": 3, "r9": 4}
+        event = Mock(type=SyscallType.syscall, regs=Mock(rsp=0x8000),
+                     **{"get_register.side_effect": registers.get})
+        args = WindowsArgumentMap(event, process, 7)
+        self.assertEqual(args[0], 1)
+        process.read_memory.assert_not_called()
+        self.assertEqual(args[5], 6)
+        self.assertEqual([args[i] for i in range(7)], [1, 2, 3, 4, 5, 6, 7])
+        process.read_memory.assert_called_once_with(0x8028, 0x18)
+        self.assertEqual(event.get_register.call_count, 4)
+
+        # when the whole stack is unreadable, the arguments are read one by one
+        def read_one(addr, count):
+            if count != 8:
+                raise RuntimeError("Fail to read memory")
+            return memory.read(addr, count)
+        process.read_memory.side_effect = read_one
+        args = WindowsArgumentMap(event, process, 7)
+        self.assertEqual(args[5], 6)
+        process.read_memory.assert_called_with(0x8030, 8)
+        process.read_memory.reset_mock()
+        process.read_memory.side_effect = memory.read
+
+        # without the number of arguments, they are read one by one
+        args = WindowsArgumentMap(event, process)
+        self.assertEqual(args[6], 7)
+        self.assertEqual(args[6], 7)
+        process.read_memory.assert_called_once_with(0x8038, 8)
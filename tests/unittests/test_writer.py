@@ -0,0 +1,92 @@
+import os
+import sys
+import gzip
+import json
+import lzma
+import tempfile
+import unittest
+
+from unittest.mock import Mock
+
+# local
+sys.path.insert(1, os.path.realpath('../..'))
+from nitro.writer import EventWriter
+
+
+def read_lines(path, opener=open):
+    with opener(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+class TestEventWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_write(self):
+        """Check that events are written one per line, in order."""
+        events = [{"name": "read", "nb": i} for i in range(100)]
+        with EventWriter(self.path("events.jsonl")) as writer:
+            for event in events:
+                writer.write(event)
+        self.assertEqual(read_lines(self.path("events.jsonl")), events)
+        with self.assertRaises(ValueError):
+            writer.write(events[0])
+
+    def test_flush(self):
+        """Check that events are flushed while the writer is running."""
+        writer = EventWriter(self.path("events.jsonl"), flush_interval=0)
+        self.addCleanup(writer.close)
+        writer.write({"name": "open"})
+        for _ in range(100):
+            if os.path.getsize(self.path("events.jsonl")):
+                break
+            writer.thread.join(0.01)
+        self.assertEqual(read_lines(self.path("events.jsonl")), [{"name": "open"}])
+
+    def test_compression(self):
+        """Check that events are compressed."""
+        for compression, opener in (("gzip", gzip.open), ("lzma", lzma.open)):
+            path = self.path("events.jsonl." + compression)
+            with EventWriter(path, compression) as writer:
+                writer.write({"compression": compression})
+            self.assertEqual(read_lines(path, opener), [{"compression": compression}])
+        with self.assertRaises(ValueError):
+            EventWriter(self.path("events.jsonl"), "zip")
+
+    def test_rotation(self):
+        """Check that files are rotated once they are large enough."""
+        event = {"name": "write"}
+        size = len(json.dumps(event)) + 1
+        with EventWriter(self.path("events.jsonl.gz"), "gzip", max_size=2 * size) as writer:
+            for _ in range(5):
+                writer.write(event)
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ["events.0.jsonl.gz", "events.1.jsonl.gz", "events.2.jsonl.gz"])
+        self.assertEqual(read_lines(self.path("events.2.jsonl.gz"), gzip.open), [event])
+
+    def test_snapshot(self):
+        """Check that events are written as they were when queued."""
+        event = {"name": "read", "modified": {0: 1}}
+        with EventWriter(self.path("events.jsonl"), flush_interval=60) as writer:
+            writer.write(event)
+            event["modified"][1] = 2
+        self.assertEqual(read_lines(self.path("events.jsonl")),
+                         [{"name": "read", "modified": {"0": 1}}])
+
+    def test_error(self):
+        """Check that writer failures are reported to the producer."""
+        writer = EventWriter(self.path("events.jsonl"), flush_interval=60)
+        with self.assertRaises(TypeError):
+            writer.write({"invalid": object()})
+        writer.file.close()
+        writer.file = Mock(**{"write.side_effect": OSError("disk full")})
+        writer.write({})
+        writer.thread.join()
+        with self.assertRaises(OSError):
+            writer.write({})
+        with self.assertRaises(OSError):
+            writer.close()
@@ -58,22 +58,22 @@ class NitroThread(Thread):
     def run(self):
         # start timer
         start_time = datetime.datetime.now()
-        if self.analyze_enabled:
-            for name, callback in self.enter_hooks.items():
-                self.nitro.backend.define_hook(name, callback, direction=SyscallDirection.enter)
-            for name, callback in self.exit_hooks.items():
-                self.nitro.backend.define_hook(name, callback, direction=SyscallDirection.exit)
-        self.nitro.listener.set_traps(True)
+        # filters and trap are set while the domain is suspended once
+        with self.nitro.listener.configure():
+            if self.analyze_enabled:
+                self.nitro.backend.define_hooks(self.enter_hooks, direction=SyscallDirection.enter)
+                self.nitro.backend.define_hooks(self.exit_hooks, direction=SyscallDirection.exit)
+            self.nitro.listener.set_traps(True)
         if self.ready_event is not None:
             self.ready_event.set() # is this really necessary
         for event in self.nitro.listen():
             if self.analyze_enabled:
                 try:
                     syscall = self.nitro.backend.process_event(event)
+                    # the process is resolved lazily, here
+                    ev_info = syscall.as_dict()
                 except LibvmiError:
                     ev_info = event.as_dict()
-                else:
-                    ev_info = syscall.as_dict()
             else:
                 ev_info = event.as_dict()
             self.events.append(ev_info)